@@ -0,0 +1,355 @@
+#!/usr/bin/python3
+"""Benchmark for `default flag`: generates a seeded synthetic corpus with planted flags, and measures throughput,
+recall and peak memory of every kind of search. Results are written as JSON to compare between versions
+
+    python3 benchmarks/flag_benchmark.py -o before.json
+    python3 benchmarks/flag_benchmark.py --large-files 2 --large-size 4G -o big.json
+"""
+import argparse
+import base64
+import bz2
+import gzip
+import io
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tarfile
+import time
+import zipfile
+from urllib.parse import quote
+from default.main import info, progress, success, warning
+
+PREFIX = "CTF"
+CORPUS_VERSION = 1
+WORDS = ["the", "flag", "is", "not", "here", "function", "return", "value", "error", "data", "user", "admin",
+         "password", "token", "config", "server", "request", "response", "static", "public", "import", "class"]
+BASE58 = b"123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+
+
+def b58encode(data):
+    n = int.from_bytes(data, "big")
+    result = b""
+    while n:
+        n, digit = divmod(n, 58)
+        result = BASE58[digit:digit + 1] + result
+    return result
+
+
+def xor(data, key):
+    return bytes(c ^ key[i % len(key)] for i, c in enumerate(data))
+
+
+# Name -> (option needed to find it, function that encodes a flag). Every planted flag is a separate token
+ENCODERS = {
+    "Plain": (None, lambda f: f),
+    "Reversed": (None, lambda f: f[::-1]),
+    "Hex": (None, lambda f: f.hex().encode()),
+    "Base32": (None, lambda f: base64.b32encode(f)),
+    "Base64": (None, lambda f: base64.b64encode(f)),
+    "Base64 offset": (None, lambda f: base64.b64encode(b"x" + f)),
+    "Base64url": (None, lambda f: base64.urlsafe_b64encode(b"\xfb\xff" + f)),
+    "Base85": (None, lambda f: base64.b85encode(f)),
+    "Ascii85": (None, lambda f: base64.a85encode(f)),
+    "Base58": (None, b58encode),
+    "Any case": (None, lambda f: f.upper()),
+    "UTF-16LE": (None, lambda f: f.decode().encode("utf-16-le")),
+    "UTF-16BE": (None, lambda f: f.decode().encode("utf-16-be")),
+    "UTF-32LE": (None, lambda f: f.decode().encode("utf-32-le")),
+    "XOR": ("brute_force", lambda f: xor(f, b"\x42")),
+    "XOR repeating": ("brute_force", lambda f: xor(f, b"k3y")),
+    "ROT": ("brute_force", lambda f: bytes((c + 13) % 256 for c in f)),
+    "Base64 > Hex": ("decode", lambda f: base64.b64encode(f.hex().encode())),
+    "Base64 > Base64": ("decode", lambda f: base64.b64encode(base64.b64encode(f))),
+    "Gzip > Base64": ("decode", lambda f: gzip.compress(base64.b64encode(f), mtime=0)),
+    "URL": ("decode", lambda f: quote(f.decode(), safe="").encode()),
+}
+SCENARIOS = {  # Name -> options, like the command line flags of `default flag`
+    "search": {},
+    "brute-force": {"brute_force": True},
+    "decode": {"decode": True},
+    "archives": {"search_zip": True},
+    "all": {"brute_force": True, "decode": True, "search_zip": True},
+}
+
+
+def parse_size(s):
+    """Parse a size like 512M or 4G into bytes"""
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    if s[-1].upper() in units:
+        return int(float(s[:-1]) * units[s[-1].upper()])
+    return int(s)
+
+
+class Corpus:
+    def __init__(self, directory, seed):
+        """Writes files with planted flags, and remembers where they are in a manifest"""
+        self.directory = directory
+        self.random = random.Random(seed)
+        self.planted = []  # {"id", "encoding", "option", "path", "offset"}
+
+    def new_flag(self, encoding):
+        """A unique flag, so it can be recognized in the results"""
+        flag_id = f"{len(self.planted):04d}{self.random.getrandbits(32):08x}"
+        option, encoder = ENCODERS[encoding]
+        return flag_id, option, encoder(f"{PREFIX}{{bench_{flag_id}}}".encode())
+
+    def plant(self, encoding, path, offset, flag_id, option):
+        self.planted.append({"id": flag_id, "encoding": encoding, "option": option, "path": path, "offset": offset})
+
+    def text(self, words):
+        return " ".join(self.random.choice(WORDS) for _ in range(words)).encode()
+
+    def write_text_file(self, path, size, encoding=None):
+        """A file of random words, with one flag planted in between"""
+        data = self.text(size // 6)
+        if encoding is not None:
+            flag_id, option, encoded = self.new_flag(encoding)
+            offset = self.random.randrange(len(data) + 1)
+            offset = data.rfind(b" ", 0, offset) + 1  # Between words
+            data = data[:offset] + encoded + b" " + data[offset:]
+            self.plant(encoding, path, offset, flag_id, option)
+        return data
+
+    def write_binary_file(self, path, size, encodings):
+        """A file of random bytes, with flags planted at random offsets. Written in chunks so it can be very large"""
+        offsets = sorted(self.random.randrange(size) for _ in encodings)
+        position = 0
+        with open(os.path.join(self.directory, path), "wb") as f:
+            for offset, encoding in zip(offsets, encodings):
+                offset = max(offset, position)
+                self.write_random(f, offset - position)
+                flag_id, option, encoded = self.new_flag(encoding)
+                padding = b"\x00" * 4 if encoding.startswith("UTF") else b" "  # Separate it from the random bytes
+                f.write(padding + encoded + padding)
+                self.plant(encoding, path, offset + len(padding), flag_id, option)
+                position = offset + len(padding) * 2 + len(encoded)
+            self.write_random(f, size - position)
+
+    def write_random(self, f, size):
+        while size > 0:
+            chunk = min(size, 16 * 1024 * 1024)
+            f.write(self.random.randbytes(chunk))
+            size -= chunk
+
+    def write_archives(self):
+        """Nested archives, with flags inside every level"""
+        os.makedirs(os.path.join(self.directory, "archives"), exist_ok=True)
+
+        def archive_flag(path):
+            flag_id, _, encoded = self.new_flag("Plain")
+            self.plant("Plain", path, 0, flag_id, "search_zip")
+            return encoded + b"\n"
+
+        inner = io.BytesIO()
+        with zipfile.ZipFile(inner, "w", zipfile.ZIP_DEFLATED) as z:
+            z.writestr("deep.txt", archive_flag("./archives/nested.tar.gz:nested.tar:inner.zip:deep.txt"))
+            z.writestr("filler.txt", self.text(10000))
+
+        with tarfile.open(os.path.join(self.directory, "archives", "nested.tar.gz"), "w:gz") as tar:
+            for name, data in [("inner.zip", inner.getvalue()),
+                               ("notes.txt", archive_flag("./archives/nested.tar.gz:nested.tar:notes.txt"))]:
+                member = tarfile.TarInfo(name)
+                member.size = len(data)
+                tar.addfile(member, io.BytesIO(data))
+
+        with gzip.open(os.path.join(self.directory, "archives", "log.txt.gz"), "wb") as f:
+            f.write(self.text(50000) + b"\n" + archive_flag("./archives/log.txt.gz:log.txt"))
+        with open(os.path.join(self.directory, "archives", "dump.bz2"), "wb") as f:
+            f.write(bz2.compress(self.random.randbytes(1024 * 1024) + archive_flag("./archives/dump.bz2:dump")))
+
+    def generate(self, small_files, small_size, large_files, large_size):
+        encodings = list(ENCODERS)
+        for i in range(small_files):
+            path = f"./text/{i // 100:03d}/file{i:05d}.txt"
+            os.makedirs(os.path.join(self.directory, os.path.dirname(path)), exist_ok=True)
+            encoding = encodings[i % len(encodings)] if i % 2 == 0 else None  # Half of the files contain a flag
+            data = self.write_text_file(path, self.random.randint(small_size // 2, small_size * 2), encoding)
+            with open(os.path.join(self.directory, path), "wb") as f:
+                f.write(data)
+
+        os.makedirs(os.path.join(self.directory, "binary"), exist_ok=True)
+        for i in range(large_files):
+            self.write_binary_file(f"./binary/large{i}.bin", large_size, encodings)
+
+        self.write_archives()
+
+        with open(os.path.join(self.directory, "manifest.json"), "w") as f:
+            json.dump({"version": CORPUS_VERSION, "planted": self.planted}, f)
+
+
+def get_size(directory):
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(directory) for f in files)
+
+
+def is_found(planted, matches):
+    """If a match is at the planted offset, or contains the decoded flag (brute-force and decoding)"""
+    for match in matches.get(planted["path"], []):
+        if abs(match[0] - planted["offset"]) <= 8 or planted["id"] in match[1]:
+            return True
+    return False
+
+
+def peak_rss():
+    """Peak memory of this process and its (pool) children in MB"""
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024
+
+
+def run_scenario(name, corpus):
+    """Run one search in this process, prints the results as JSON. Called in a new process for every scenario"""
+    from default.lib.flag_search import FlagMatcher, get_needles, search_tree
+    from default.lib.xor_search import BruteForceMatcher
+    from default.lib.decode_search import DecodeMatcher
+    from default.lib.archive_search import ArchiveSearcher
+
+    options = SCENARIOS[name]
+    os.chdir(corpus)
+    start = time.perf_counter()
+    needles = get_needles(PREFIX + "{")
+    matchers = [FlagMatcher(needles)]
+    if options.get("brute_force"):
+        matchers.append(BruteForceMatcher([PREFIX + "{"]))
+    if options.get("decode"):
+        matchers.append(DecodeMatcher(needles))
+    archives = ArchiveSearcher() if options.get("search_zip") else None
+
+    matches = {}
+    for path, file_matches, _ in search_tree(".", matchers, ignore=["manifest.json"], archives=archives):
+        matches[path] = [(m.offset, m.text.decode("latin-1")) for m in file_matches]
+    seconds = time.perf_counter() - start
+
+    json.dump({"seconds": seconds, "peak_rss_mb": peak_rss(), "matches": matches}, sys.stdout)
+
+
+def run_regex():
+    """Time creating the regexes of all encodings without cache, and creating a matcher"""
+    import default.lib.basen_search as basen
+    from default.lib.flag_search import FlagMatcher, get_needles
+
+    prefixes = ["CTF{", "ctf{", "flag{", "HTB{", "picoCTF{"]
+    start = time.perf_counter()
+    for prefix in prefixes:
+        for encoding in basen.ALPHABETS:
+            basen.create_basen_regex(prefix.encode(), encoding)
+    create = time.perf_counter() - start
+
+    basen._cache = {"version": basen.CACHE_VERSION, "regexes": {}}  # Empty cache in memory, file is not read
+    basen.save_cache = lambda: None
+    start = time.perf_counter()
+    needles = [n for prefix in prefixes for n in get_needles(prefix)]
+    FlagMatcher(needles)
+    cold = time.perf_counter() - start
+
+    start = time.perf_counter()
+    FlagMatcher([n for prefix in prefixes for n in get_needles(prefix)])
+    warm = time.perf_counter() - start
+
+    json.dump({"create_basen_regex_ms": create * 1000, "cold_matcher_ms": cold * 1000, "warm_matcher_ms": warm * 1000,
+               "needles": len(needles)}, sys.stdout)
+
+
+def run_child(*args):
+    """Run a part of the benchmark in a new process, so memory is measured separately"""
+    p = subprocess.run([sys.executable, os.path.abspath(__file__), *args], stdout=subprocess.PIPE, check=True)
+    return json.loads(p.stdout)
+
+
+def get_version():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def benchmark(ARGS):
+    corpus = os.path.abspath(ARGS.corpus)
+    parameters = {"seed": ARGS.seed, "small_files": ARGS.small_files, "small_size": parse_size(ARGS.small_size),
+                  "large_files": ARGS.large_files, "large_size": parse_size(ARGS.large_size)}
+
+    try:
+        with open(os.path.join(corpus, "parameters.json")) as f:
+            reuse = json.load(f) == {**parameters, "version": CORPUS_VERSION}
+    except (OSError, ValueError):
+        reuse = False
+
+    if not reuse:
+        progress(f"Generating corpus in '{corpus}'...")
+        shutil.rmtree(corpus, ignore_errors=True)
+        os.makedirs(corpus)
+        Corpus(corpus, ARGS.seed).generate(ARGS.small_files, parameters["small_size"], ARGS.large_files,
+                                           parameters["large_size"])
+        with open(os.path.join(corpus, "parameters.json"), "w") as f:
+            json.dump({**parameters, "version": CORPUS_VERSION}, f)
+    else:
+        info(f"Reusing corpus in '{corpus}'")
+
+    with open(os.path.join(corpus, "manifest.json")) as f:
+        planted = json.load(f)["planted"]
+    size = get_size(corpus)
+    info(f"Corpus: {size / 1024 ** 2:.1f} MB with {len(planted)} planted flags")
+
+    results = {}
+    for name in ARGS.scenarios:
+        progress(f"Running '{name}'...")
+        run = run_child("run", name, corpus)
+        options = SCENARIOS[name]
+        expected = [p for p in planted if p["option"] is None or options.get(p["option"])]
+        found = [p for p in expected if is_found(p, run["matches"])]
+        missed = sorted({p["encoding"] for p in expected if p not in found})
+        results[name] = {
+            "seconds": round(run["seconds"], 3),
+            "mb_per_s": round(size / 1024 ** 2 / run["seconds"], 2),
+            "recall": round(len(found) / len(expected), 4) if expected else None,
+            "found": len(found),
+            "expected": len(expected),
+            "missed_encodings": missed,
+            "matches": sum(len(m) for m in run["matches"].values()),
+            "peak_rss_mb": round(run["peak_rss_mb"], 1),
+        }
+        success(f"{name}: {results[name]['mb_per_s']} MB/s, recall {results[name]['recall']}, "
+                f"peak RSS {results[name]['peak_rss_mb']} MB")
+        if missed:
+            warning(f"Missed flags in encodings: {', '.join(missed)}")
+
+    progress("Timing regex construction...")
+    regex = run_child("regex")
+    success(f"Regex construction: {regex['cold_matcher_ms']:.1f} ms cold, {regex['warm_matcher_ms']:.1f} ms cached")
+
+    output = {
+        "version": get_version(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "corpus": {**parameters, "bytes": size, "planted": len(planted)},
+        "scenarios": results,
+        "regex": {k: round(v, 3) if isinstance(v, float) else v for k, v in regex.items()},
+    }
+    with open(ARGS.output, "w") as f:
+        json.dump(output, f, indent=4)
+    success(f"Saved results to '{ARGS.output}'")
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "run":  # Child process of a scenario
+        return run_scenario(sys.argv[2], sys.argv[3])
+    elif len(sys.argv) > 1 and sys.argv[1] == "regex":
+        return run_regex()
+
+    parser = argparse.ArgumentParser(description="Benchmark the flag search on a generated corpus, and output JSON")
+    parser.add_argument('-o', '--output', default="flag_benchmark.json", help="File to write JSON results to")
+    parser.add_argument('-c', '--corpus', default="/tmp/default-flag-corpus",
+                        help="Directory for the corpus, reused if generated with the same parameters")
+    parser.add_argument('-s', '--seed', type=int, default=1337, help="Seed for generating the corpus")
+    parser.add_argument('--small-files', type=int, default=2000, help="Number of small text files")
+    parser.add_argument('--small-size', default="8K", help="Average size of small text files")
+    parser.add_argument('--large-files', type=int, default=2, help="Number of large binary files")
+    parser.add_argument('--large-size', default="128M", help="Size of every large binary file, like 4G")
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS), help="Searches to run")
+    benchmark(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,383 @@
+#!/usr/bin/python3
+"""Load test for `default listen`: runs the DNS, HTTP and nc listeners in a separate process and floods them with
+loopback clients. Measures latency, drop rate, throughput and CPU time of the listener per request as JSON
+
+    python3 benchmarks/listener_benchmark.py -o before.json
+    python3 benchmarks/listener_benchmark.py --scenarios dns --dns-rate 50000 --duration 10 -o dns.json
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import re
+import resource
+import shutil
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import Namespace
+from collections import Counter
+from default.main import progress, success, warning
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ["dns", "http", "tcp"]
+DNS_SOCKETS = 8  # Client sockets, so transaction IDs don't repeat too quickly
+HTTP_FILE = "large.bin"
+TIMEOUT = 5  # Seconds to wait for the listener to start, and for late replies
+
+
+def parse_size(s):
+    """Parse a size like 512M or 4G into bytes"""
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    if s[-1].upper() in units:
+        return int(float(s[:-1]) * units[s[-1].upper()])
+    return int(s)
+
+
+def raise_file_limit():
+    """Many simultaneous connections need more file descriptors than the default soft limit"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or hard > 1024 * 1024:
+        hard = 1024 * 1024
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+
+def percentile(values, p):
+    """Percentile of latencies in milliseconds"""
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * p / 100))] * 1000, 3)
+
+
+def cpu_seconds(pid):
+    """User and system CPU time a process used so far, from /proc (Linux only)"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rpartition(")")[2].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def serve(scenario, port, directory, stats_path):
+    """Run a listener like `default listen` does, and write the events it saw as JSON when interrupted. Called in a
+    new process for every scenario"""
+    spec = importlib.util.spec_from_file_location("listen", os.path.join(ROOT, "default", "commands", "listen.py"))
+    listen = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(listen)
+
+    signal.signal(signal.SIGINT, signal.default_int_handler)  # Also when started in the background
+    ARGS = Namespace(ip="127.0.0.1", verbose=False, directory=directory, response="127.0.0.1", rules=None, exfil=None,
+                     output=None, transcripts=None)
+    counts = Counter()
+
+    def emit(event):
+        counts[event["protocol"] + ("-" + event["event"] if "event" in event else "")] += 1
+        counts["received"] += event.get("received", 0) if event.get("event") == "close" else 0
+
+    if scenario == "dns":
+        listener = listen.setup_dns(ARGS, port, emit)
+    elif scenario == "http":
+        listener = listen.setup_http(ARGS, port, emit)
+    else:
+        sockets = listen.bind(ARGS, port, [socket.SOCK_STREAM])
+        manager, _ = listen.setup_nc(ARGS, sockets, emit)
+        listener = manager, sockets, None
+    listen.run_listeners([listener])
+
+    with open(stats_path, "w") as f:
+        json.dump(counts, f)
+
+
+class Listener:
+    def __init__(self, scenario, port, directory):
+        """The listener of a scenario in a child process, with its stdout discarded like a terminal nobody reads"""
+        self.stats_path = os.path.join(directory, f"{scenario}-events.json")
+        self.process = subprocess.Popen([sys.executable, os.path.abspath(__file__), "serve", scenario, str(port),
+                                         directory, self.stats_path], stdout=subprocess.DEVNULL, cwd=ROOT)
+
+    def cpu(self):
+        return cpu_seconds(self.process.pid)
+
+    def stop(self):
+        """Stop the listener, returns the number of events it saw"""
+        self.process.send_signal(signal.SIGINT)
+        try:
+            self.process.wait(TIMEOUT)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            raise RuntimeError("Listener did not stop")
+        try:
+            with open(self.stats_path) as f:
+                return json.load(f)
+        finally:
+            os.remove(self.stats_path)
+
+
+async def wait_ready(port):
+    """Wait until the listener accepts connections. DNS starts listening on TCP after UDP"""
+    deadline = time.monotonic() + TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.05)
+    raise RuntimeError(f"Listener did not start on port {port}")
+
+
+def result(listener, cpu_before, client_cpu_before, requests, latencies, seconds, sent):
+    """Common measurements of a scenario. CPU time of the clients is included, because they can be the bottleneck
+    when they share the CPU cores with the listener"""
+    cpu_after = listener.cpu()
+    cpu = cpu_after - cpu_before if cpu_before is not None and cpu_after is not None else None
+    return {
+        "requests": requests,
+        "seconds": round(seconds, 3),
+        "per_second": round(requests / seconds, 1),
+        "p50_ms": percentile(latencies, 50),
+        "p99_ms": percentile(latencies, 99),
+        "max_ms": percentile(latencies, 100),
+        "drop_rate": round(1 - requests / sent, 4) if sent else None,
+        "cpu_seconds": round(cpu, 2) if cpu is not None else None,
+        "cpu_ms_per_request": round(cpu * 1000 / requests, 4) if cpu is not None and requests else None,
+        "client_cpu_seconds": round(time.process_time() - client_cpu_before, 2),
+    }
+
+
+class DNSClient(asyncio.DatagramProtocol):
+    def __init__(self, latencies):
+        """Matches replies to queries by their transaction ID"""
+        self.latencies = latencies
+        self.pending = {}  # Transaction ID -> time sent
+        self.next_id = 0
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def send(self, query):
+        id = self.next_id
+        self.next_id = (self.next_id + 1) % 65536
+        self.pending[id] = time.perf_counter()  # Replaces an unanswered query with the same ID, which was dropped
+        self.transport.sendto(struct.pack("!H", id) + query[2:])
+
+    def datagram_received(self, data, addr):
+        start = self.pending.pop(struct.unpack_from("!H", data)[0], None)
+        if start is not None:
+            self.latencies.append(time.perf_counter() - start)
+
+    def error_received(self, exc):
+        pass
+
+
+async def load_dns(ARGS, listener, port):
+    """Send queries at a fixed rate over UDP, whether they are answered or not"""
+    from dnslib import DNSRecord
+
+    queries = [DNSRecord.question(f"bench{i}.example.com").pack() for i in range(ARGS.dns_names)]
+    loop = asyncio.get_running_loop()
+    latencies = []
+    clients = []
+    for _ in range(DNS_SOCKETS):
+        _, client = await loop.create_datagram_endpoint(lambda: DNSClient(latencies), remote_addr=("127.0.0.1", port))
+        clients.append(client)
+
+    cpu_before, client_cpu_before = listener.cpu(), time.process_time()
+    start = time.perf_counter()
+    sent = 0
+    while (elapsed := time.perf_counter() - start) < ARGS.duration:
+        while sent < elapsed * ARGS.dns_rate:  # Catch up on the schedule
+            clients[sent % DNS_SOCKETS].send(queries[sent % len(queries)])
+            sent += 1
+        await asyncio.sleep(0.001)
+    seconds = time.perf_counter() - start
+
+    deadline = time.monotonic() + TIMEOUT  # Late replies still count, but not for throughput
+    while any(client.pending for client in clients) and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    for client in clients:
+        client.transport.close()
+
+    return {**result(listener, cpu_before, client_cpu_before, len(latencies), latencies, seconds, sent), "sent": sent,
+            "rate": ARGS.dns_rate}
+
+
+async def download(port, path, deadline, latencies, totals):
+    """Download a file over and over on one keep-alive connection until the deadline"""
+    request = f"GET /{path} HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\n\r\n".encode()
+    reader = writer = None
+    while time.perf_counter() < deadline:
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection("127.0.0.1", port, limit=1024 * 1024)
+            start = time.perf_counter()
+            totals["sent"] += 1
+            writer.write(request)
+            headers = await reader.readuntil(b"\r\n\r\n")
+            length = re.search(rb"(?i)content-length: *(\d+)", headers)
+            if length is None:
+                raise ConnectionError("No Content-Length in response")
+            remaining = int(length[1])
+            while remaining:
+                chunk = await reader.read(min(remaining, 1024 * 1024))
+                if not chunk:
+                    raise ConnectionError("Connection closed during download")
+                remaining -= len(chunk)
+                totals["bytes"] += len(chunk)
+            latencies.append(time.perf_counter() - start)
+        except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):  # Reconnect
+            totals["errors"] += 1
+            if writer is not None:
+                writer.close()
+            reader = writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def load_http(ARGS, listener, port):
+    """Concurrent keep-alive clients downloading a large file"""
+    latencies = []
+    totals = Counter()
+    cpu_before, client_cpu_before = listener.cpu(), time.process_time()
+    start = time.perf_counter()
+    await asyncio.gather(*(download(port, HTTP_FILE, start + ARGS.duration, latencies, totals)
+                           for _ in range(ARGS.http_clients)))
+    seconds = time.perf_counter() - start
+
+    return {**result(listener, cpu_before, client_cpu_before, len(latencies), latencies, seconds, totals["sent"]),
+            "clients": ARGS.http_clients, "file_bytes": parse_size(ARGS.http_size), "errors": totals["errors"],
+            "mb_per_s": round(totals["bytes"] / 1024 ** 2 / seconds, 1)}
+
+
+async def connect(port, latencies, connections, totals):
+    start = time.perf_counter()
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection("127.0.0.1", port), TIMEOUT)
+    except (OSError, asyncio.TimeoutError):
+        totals["errors"] += 1
+        return
+    latencies.append(time.perf_counter() - start)
+    writer.write(b"id\n")
+    connections.append(writer)
+
+
+async def load_tcp(ARGS, listener, port):
+    """Many simultaneous connections that each send a line, held open until all are connected"""
+    latencies = []
+    connections = []
+    totals = Counter()
+    cpu_before, client_cpu_before = listener.cpu(), time.process_time()
+    start = time.perf_counter()
+    await asyncio.gather(*(connect(port, latencies, connections, totals) for _ in range(ARGS.tcp_connections)))
+    await asyncio.gather(*(writer.drain() for writer in connections), return_exceptions=True)
+    seconds = time.perf_counter() - start
+
+    await asyncio.sleep(1)  # Let the listener accept the backlog
+    for writer in connections:
+        writer.close()
+    await asyncio.sleep(1)
+
+    return {**result(listener, cpu_before, client_cpu_before, len(latencies), latencies, seconds, ARGS.tcp_connections),
+            "errors": totals["errors"]}
+
+
+LOADS = {"dns": load_dns, "http": load_http, "tcp": load_tcp}
+
+
+def run_scenario(ARGS, scenario, port, directory):
+    listener = Listener(scenario, port, directory)
+    try:
+        asyncio.run(wait_ready(port))
+        output = asyncio.run(LOADS[scenario](ARGS, listener, port))
+    finally:
+        events = listener.stop()
+
+    if scenario == "dns":  # What the listener saw, to tell apart lost queries from lost replies
+        output["received_by_listener"] = events.get("dns", 0)
+    elif scenario == "http":
+        output["received_by_listener"] = events.get("http", 0)
+    else:
+        output["received_by_listener"] = events.get("tcp-open", 0) - 1  # Without the connection from wait_ready()
+        output["bytes_received_by_listener"] = events.get("received", 0)
+        output["drop_rate"] = round(1 - output["received_by_listener"] / ARGS.tcp_connections, 4)
+    return output
+
+
+def get_version():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                              cwd=ROOT).stdout.strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def benchmark(ARGS):
+    limit = raise_file_limit()
+    if "tcp" in ARGS.scenarios and ARGS.tcp_connections * 2 + 100 > limit:  # Both ends are in this machine
+        warning(f"Open file limit of {limit} is too low for {ARGS.tcp_connections} connections, expect errors")
+
+    directory = tempfile.mkdtemp(prefix="default-listener-")
+    try:
+        if "http" in ARGS.scenarios:
+            progress(f"Writing {ARGS.http_size} file to serve...")
+            with open(os.path.join(directory, HTTP_FILE), "wb") as f:
+                remaining = parse_size(ARGS.http_size)
+                while remaining > 0:
+                    f.write(os.urandom(min(remaining, 16 * 1024 * 1024)))
+                    remaining -= 16 * 1024 * 1024
+
+        results = {}
+        for i, scenario in enumerate(ARGS.scenarios):
+            progress(f"Running '{scenario}'...")
+            results[scenario] = output = run_scenario(ARGS, scenario, ARGS.port + i, directory)
+            summary = f"{output['per_second']}/s, p50 {output['p50_ms']} ms, p99 {output['p99_ms']} ms, drop rate {output['drop_rate']}"
+            if "mb_per_s" in output:
+                summary += f", {output['mb_per_s']} MB/s"
+            success(f"{scenario}: {summary}, {output['cpu_ms_per_request']} ms CPU per request")
+            if output.get("errors"):
+                warning(f"{output['errors']} requests failed")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    output = {
+        "version": get_version(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "parameters": {"duration": ARGS.duration, "dns_rate": ARGS.dns_rate, "dns_names": ARGS.dns_names,
+                       "http_clients": ARGS.http_clients, "http_size": ARGS.http_size,
+                       "tcp_connections": ARGS.tcp_connections},
+        "scenarios": results,
+    }
+    with open(ARGS.output, "w") as f:
+        json.dump(output, f, indent=4)
+    success(f"Saved results to '{ARGS.output}'")
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":  # Child process of a scenario
+        return serve(sys.argv[2], int(sys.argv[3]), sys.argv[4], sys.argv[5])
+
+    parser = argparse.ArgumentParser(description="Load test the listeners over loopback, and output JSON")
+    parser.add_argument('-o', '--output', default="listener_benchmark.json", help="File to write JSON results to")
+    parser.add_argument('-p', '--port', type=int, default=15353, help="First port to listen on, one for every scenario")
+    parser.add_argument('-d', '--duration', type=float, default=5, help="Seconds to send DNS queries and HTTP requests")
+    parser.add_argument('--dns-rate', type=int, default=20000, help="DNS queries per second to send over UDP")
+    parser.add_argument('--dns-names', type=int, default=1000, help="Number of different names to query")
+    parser.add_argument('--http-clients', type=int, default=16, help="Number of concurrent HTTP downloads")
+    parser.add_argument('--http-size', default="64M", help="Size of the file to download over HTTP")
+    parser.add_argument('--tcp-connections', type=int, default=2000, help="Number of simultaneous TCP connections to nc")
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS, help="Listeners to test")
+    benchmark(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
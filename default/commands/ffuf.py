@@ -1,10 +1,21 @@
-import random
-import string
-from tempfile import NamedTemporaryFile
+import asyncio
+import base64
+import tempfile
+import time
 from default.main import *
-from urllib.parse import urlparse
+from urllib.parse import urlparse, urljoin
+from default.lib.fuzz_engine import Fuzzer, Template, MATCH_CODES, read_wordlist, to_result, header
+from default.lib.fuzz_calibration import Baseline, calibrate, get_cached, set_cached
+from default.lib.fuzz_state import FuzzState, run_job
+from default.lib.fuzz_cluster import Clusters
+from default.lib.fuzz_throttle import Throttle
+from default.lib.fuzz_params import ParamMiner, MODES
 
 EXTENSIONS = [".html", ".php", ".txt", ".bak", "~"]
+FFUF_THREADS = 40  # Default of ffuf
+AUTO_PROCESSES = 4  # ffuf processes running at once in `ffuf auto`
+SHOW_SIMILAR = 3  # Near-duplicate hits that are printed, more of them are only counted
+SCHEMES = ("http", "https")  # Fuzzed at once for virtual hosts, when a domain is given without one
 
 
 def output_args(filename, n=None):
@@ -52,37 +63,94 @@ def FUZZ_vhost_keyword(domain):
 
         return fuzz_hosts
 
-def calibrate_size(domain, vhost=False):
-    progress("Calibrating...")
-    domain, scheme = get_domain(domain)  # Normalize domain
-    
-    # Try known negative paths
-    wordlist = [''.join(random.choice(string.ascii_letters) for i in range(j)) for j in range(10, 30)]
-    with NamedTemporaryFile(delete=False) as tmp:
-        tmp.write("\n".join(wordlist).encode())
-        tmp.close()
-        if vhost:
-            output = command(["ffuf", "-u", f"{scheme}://{domain}", "-w", tmp.name, 
-                              "-H", f"Host: {FUZZ_vhost_keyword(domain)[0]}", "-mc", "0", "-json"], get_output=True)
-        else:
-            output = command(["ffuf", "-u", FUZZ_content_keyword(domain), "-w", tmp.name, "-mc", "0", "-json"], get_output=True)
-        
-        os.remove(tmp.name)
-        if not output: error("No output from calibration. Is host down?")
-        lines = []
-        for line in output.splitlines():
-            lines.append(json.loads(line))
-        
-        # If all lengths are the same
-        length, words = lines[0]["length"], lines[0]["words"]
-        if all(line["length"] == length for line in lines):
-            success(f"Found negative filter: size={length}")
-            return ["-fs", length]
-        elif all(line["words"] == words for line in lines):
-            success(f"Found negative filter: words={words}")
-            return ["-fw", words]
-        else:
-            error("Failed to find consistent negative character or word length")
+def vhost_target(domain):
+    """Domain to connect to while fuzzing its Host header, without the FUZZ part"""
+    return ".".join(part for part in domain.split(".") if part != "FUZZ")
+
+
+def vhost_job(domain, schemes):
+    """Template that fuzzes all patterns of a domain on all schemes at once, with its calibration mode and the words of
+    its other keywords. FUZZ is filled into the VHOST pattern, which is recorded in the input of every hit"""
+    patterns = FUZZ_vhost_keyword(domain)
+    template = Template(f"SCHEME://{vhost_target(domain)}/", headers=[("Host", "VHOST")])
+    return template, f"vhost {' '.join(schemes)} {' '.join(patterns)}", {"VHOST": patterns, "SCHEME": schemes}
+
+
+def answering_schemes(domain):
+    """Schemes of `SCHEMES` that the host of a domain answers on"""
+    async def run():
+        fuzzer = Fuzzer(len(SCHEMES), retries=0)
+        try:
+            return await asyncio.gather(*(fuzzer.fetch(Template(f"{scheme}://{vhost_target(domain)}/").render({}))
+                                          for scheme in SCHEMES))
+        finally:
+            fuzzer.close()
+
+    schemes = [scheme for scheme, response in zip(SCHEMES, asyncio.run(run())) if response is not None]
+    if not schemes:
+        error(f"No answer on {' or '.join(SCHEMES)}. Is host down?")
+    return schemes
+
+
+def expand_hosts(wordlist, patterns, filename):
+    """Write every host of the patterns to a wordlist for ffuf, which can't fill a keyword inside another one. Hosts
+    are only written once, returns the pattern of every host"""
+    pattern_of = {}
+    with open(filename, "w") as f:
+        for word in read_wordlist(wordlist):
+            for pattern in patterns:
+                host = pattern.replace("FUZZ", word)
+                if host not in pattern_of:
+                    pattern_of[host] = pattern
+                    f.write(f"{host}\n")
+    return pattern_of
+
+
+def calibrate_size(ARGS, template, mode, keywords={}, processes=1):
+    """Arguments for ffuf from the (cached) calibration of a template: filters, falling back to ffuf's own -ac, and the
+    threads and rate the host kept up with while calibrating, split over `processes`"""
+    async def run():
+        fuzzer = new_fuzzer(ARGS)
+        try:
+            baseline = await load_baseline(fuzzer, template, mode, ARGS.recalibrate, keywords=keywords)
+            throttles = fuzzer.throttles.values() or [Throttle(fuzzer.concurrency, fuzzer.rate)]  # None when cached
+            return baseline, min(throttles, key=lambda throttle: (throttle.slow_start, throttle.limit))  # Most limited
+        finally:
+            fuzzer.close()
+
+    baseline, throttle = asyncio.run(run())
+    filter_args = baseline.to_ffuf_args()
+    if filter_args is None:
+        warning("Negative responses are too different to filter in ffuf, using its own auto-calibration")
+        filter_args = ["-ac"]
+    throttle_args = throttle.to_ffuf_args(processes)
+    if throttle.throttled or throttle.errors or not throttle.slow_start:
+        warning(f"Host slowed down while calibrating, limiting ffuf to {shlex.join(throttle_args)}")
+    return filter_args + throttle_args
+
+
+async def load_baseline(fuzzer, template, mode, recalibrate=False, label="", state=None, keywords={}):
+    """Calibration of the host of a template from the checkpoint, the cache, or by sampling random inputs with every
+    combination of the words of other `keywords`"""
+    if state is not None and mode in state.baselines:
+        return Baseline.from_json(state.baselines[mode])
+
+    domain, scheme = get_domain(template.render({keyword: words[0] for keyword, words in keywords.items()}).url)
+    baseline = None if recalibrate else get_cached(domain, scheme, mode)
+    if baseline is not None:
+        success(f"Using cached calibration{label} from {int((time.time() - baseline.created) / 60)} minutes ago: {baseline}")
+    else:
+        progress(f"Calibrating{label}...")
+        baseline = await calibrate(fuzzer, template, mode, keywords)
+        if baseline is None:
+            error("No output from calibration. Is host down?")
+        set_cached(domain, scheme, mode, baseline)
+        success(f"Found negative responses{label}: {baseline}")
+
+    if state is not None:
+        state.baselines[mode] = baseline.to_json()
+    return baseline
+
 
 def get_domain(url):
     if not (url.startswith("http://") or url.startswith("https://")):  # If already plain domain
@@ -91,11 +159,189 @@ def get_domain(url):
         return urlparse(url).netloc, urlparse(url).scheme
 
 
+def new_fuzzer(ARGS):
+    return Fuzzer(ARGS.threads, rate=ARGS.rate)
+
+
+def report_throttles(fuzzer):
+    """Warn about hosts that could not keep up with the requested concurrency"""
+    for (scheme, host, port), throttle in fuzzer.throttles.items():
+        if throttle.throttled or throttle.errors or not throttle.slow_start:
+            warning(f"{host}:{port} slowed down ({throttle.throttled} throttled, {throttle.errors} failed), "
+                    f"ended at {throttle}")
+
+
+def load_state(ARGS):
+    """Checkpoint of an interrupted run of this command with --resume, otherwise a new one"""
+    arguments = {k: v for k, v in vars(ARGS).items() if k not in ("func", "resume", "threads", "rate", "recalibrate")}
+    state = FuzzState(arguments, ARGS.resume)
+    if state.resumed:
+        info(f"Resuming from the checkpoint in {state.filename!r}")
+    elif ARGS.resume:
+        warning("No checkpoint of this command was found, starting from the beginning")
+    return state
+
+
+def run_checkpointed(state, main):
+    """Run a coroutine that fuzzes, saving the checkpoint if it is interrupted"""
+    try:
+        return asyncio.run(main)
+    except BaseException:
+        state.save(force=True)
+        warning(f"Progress saved in {state.filename!r}, run the same command with --resume to continue")
+        raise
+
+
+def close_state(state):
+    """Remove the checkpoint of a finished run, or keep it if some requests failed to retry them later"""
+    if state.is_complete():
+        state.remove()
+    else:
+        warning(f"Some requests failed, run the same command with --resume to retry them (checkpoint in {state.filename!r})")
+
+
+def use_native(ARGS, tool="ffuf"):
+    """Use the native fuzzing engine if asked, or if the tool is not installed"""
+    if "native" in ARGS and ARGS.native:
+        return True
+    if which(tool) is None:
+        warning(f"{tool} is not installed, using the native fuzzing engine instead")
+        return True
+    return False
+
+
+def result_name(result):
+    values = list(result["input"].values())
+    return values[0] if len(values) == 1 else " | ".join(f"{k}: {v}" for k, v in result["input"].items())
+
+
+def format_result(result, name=None):
+    """Result line like ffuf, from a result in its JSON format"""
+    name = name or result_name(result)
+    color = {2: Fore.GREEN, 3: Fore.BLUE, 4: Fore.YELLOW, 5: Fore.RED}.get(result["status"] // 100, "")
+    return (f"{name:<40} [Status: {color}{result['status']}{Style.RESET_ALL}, Size: {result['length']}, Words: {result['words']}, "
+            f"Lines: {result['lines']}, Duration: {result['duration'] // 1000000}ms]")
+
+
+def print_result(result, name=None):
+    print(format_result(result, name))
+
+
+def show_hit(clusters, result, name=None, response=None):
+    """Print a hit, unless `SHOW_SIMILAR` near-duplicates of it were printed already"""
+    cluster = clusters.add(result, response, name or result_name(result))
+    result["cluster"] = cluster.id
+    if cluster.count <= SHOW_SIMILAR:
+        print_result(result, name)
+    elif cluster.count == SHOW_SIMILAR + 1:
+        info(f"Hiding more responses like {cluster.label}, they are counted at the end")
+
+
+def print_clusters(clusters):
+    """Summary of the clusters that had hits hidden, with a representative of each"""
+    collapsed = sorted((cluster for cluster in clusters.clusters if cluster.count > SHOW_SIMILAR), key=lambda c: -c.count)
+    if collapsed:
+        info(f"Collapsed {sum(c.count for c in collapsed)} near-duplicate hits into {len(collapsed)} groups:")
+    for cluster in collapsed:
+        print(f"{cluster.count:>6} x {format_result(cluster.result, cluster.label)}")
+
+
+def write_output(filename, results):
+    """Save results in the JSON format of ffuf"""
+    if os.path.splitext(filename)[1] not in ("", ".json"):
+        warning("The native engine only writes JSON output")
+    with open(filename, "w") as f:
+        json.dump({"commandline": shlex.join(sys.argv), "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "results": results}, f)
+
+
+def is_directory(response):
+    """If a response redirects to the same URL with a slash, to recurse into it like ffuf"""
+    location = header(response, "Location")
+    return response.status in (301, 302, 307, 308) and urljoin(response.request.url, location) == response.request.url + "/"
+
+
+def fuzz_native(ARGS, state, template, wordlist, mode, extensions=(), match_all=False, recursion=False, output=None,
+                keywords={}, label=None):
+    """Fuzz the FUZZ keyword in a template with the native engine, and print the results like ffuf. Checkpointed in
+    `state` as a job named after the mode, and one more for every directory of the recursion
+
+    keywords: words of other keywords in the template, every combination with FUZZ is sent
+    label: function that names a result when printing it, results with the same label are only kept once"""
+    results = state.results.setdefault(mode, [])
+    state.job(mode, template, mode)
+    clusters = Clusters()
+    seen = set()
+    for result in results:  # Found before resuming
+        show_hit(clusters, result, label and label(result))
+        seen.add(label and label(result))
+
+    def on_response(response):
+        if not (match_all or response.status in MATCH_CODES) or is_negative(response):
+            return
+        result = to_result(response)
+        if label:
+            if label(result) in seen:
+                return
+            seen.add(label(result))
+        show_hit(clusters, result, label and label(result), response)
+        results.append(result)
+        if recursion and is_directory(response):
+            directory = urlparse(response.request.url).path + "/"  # Calibrated separately, it may answer differently
+            name = f"{mode} {directory}"
+            if name not in state.jobs:
+                info(f"Adding a new job to the queue: {response.request.url}/FUZZ")
+                state.job(name, Template(response.request.url + "/FUZZ", template.method, template.headers, template.body), name)
+
+    async def run():
+        nonlocal fuzzer, is_negative
+        fuzzer = new_fuzzer(ARGS)
+        try:
+            while names := state.pending(mode):
+                job = state.jobs[names[0]]
+                is_negative = (await load_baseline(fuzzer, job["template"], job["mode"], ARGS.recalibrate, state=state,
+                                                   keywords=keywords)).is_negative
+                await run_job(fuzzer, state, names[0], {"FUZZ": wordlist, **keywords}, on_response, extensions)
+        finally:
+            fuzzer.close()
+
+    fuzzer = is_negative = None
+    progress("Starting native fuzzing engine...")
+    start = time.monotonic()
+    try:
+        run_checkpointed(state, run())
+    finally:
+        if output:
+            write_output(output, results)
+    seconds = time.monotonic() - start
+    print_clusters(clusters)
+    success(f"Sent {fuzzer.sent} requests in {seconds:.1f}s ({fuzzer.sent / seconds:.0f}/s)")
+    report_throttles(fuzzer)
+    if fuzzer.errors:
+        warning(f"{fuzzer.errors} requests failed after retrying")
+
+
 def do_content(ARGS):
     ARGS.url = FUZZ_content_keyword(ARGS.url)
     info(f"Fuzzing URL: {ARGS.url}")
 
-    ffuf_args = ["-c", "-ac"]  # Color and auto-calibrate filter
+    if not ARGS.wordlist:
+        ARGS.wordlist = f"{LIBRARY_DIR}/list/web-content.txt"
+    if use_native(ARGS):
+        state = load_state(ARGS)
+        fuzz_native(ARGS, state, Template(ARGS.url), ARGS.wordlist, "content", [] if ARGS.no_extensions else EXTENSIONS,
+                    ARGS.all, ARGS.recursion, ARGS.output)
+        close_state(state)
+        success("Finished fuzzing")
+        if ARGS.output:
+            success(f"Output saved in '{ARGS.output}'")
+            info(f"Tip: Use `jq -r .results[].url {shlex.quote(ARGS.output)}` to list all found URLs")
+        return
+
+    ffuf_args = ["-c"]  # Color
+    if ARGS.recursion:  # Directories can answer differently, so let ffuf calibrate every one
+        ffuf_args += ["-ac", "-t", str(ARGS.threads)] + (["-rate", str(int(ARGS.rate))] if ARGS.rate else [])
+    else:  # Filter and limit from the (cached) calibration
+        ffuf_args += calibrate_size(ARGS, Template(ARGS.url), "content")
     if not ARGS.no_extensions:
         ffuf_args += ["-e", ",".join(EXTENSIONS)]
     if ARGS.recursion:
@@ -103,10 +349,10 @@ def do_content(ARGS):
 
     if ARGS.all:  # Removes default response code filter
         ffuf_args += ["-mc", "0"]
-    if not ARGS.wordlist:
-        ARGS.wordlist = f"{LIBRARY_DIR}/list/web-content.txt"
     if ARGS.output:
         ffuf_args += output_args(ARGS.output)
+    if ARGS.resume:
+        warning("ffuf can't continue where it stopped, use --native to resume scans")
 
     progress("Starting ffuf (press ENTER to pause)...")
     command(["ffuf", "-u", ARGS.url, "-w", ARGS.wordlist, *ffuf_args], highlight=True, error_message="Failed to run ffuf")
@@ -116,101 +362,313 @@ def do_content(ARGS):
         info(f"Tip: Use `jq -r .results[].url {shlex.quote(ARGS.output)}` to list all found URLs")
 
 
+def mine_params(ARGS):
+    """Find parameters with the native engine, returns `[(name, difference)]`"""
+    found = []
+
+    def on_found(name, difference):
+        success(f"Found parameter: {name} ({difference})")
+        found.append((name, difference))
+
+    async def run():
+        fuzzer = new_fuzzer(ARGS)
+        miner = ParamMiner(fuzzer, ARGS.url, ARGS.mode, ARGS.value)
+        try:
+            progress("Calibrating...")
+            if not await miner.calibrate():
+                error("The page answers differently every time or not at all, can't compare parameters")
+            info(f"Sending up to {miner.size} parameters per request")
+            start = time.monotonic()
+            await miner.run(read_wordlist(ARGS.wordlist), on_found)
+            success(f"Sent {fuzzer.sent} requests in {time.monotonic() - start:.1f}s")
+            if miner.unchecked:
+                warning(f"{len(miner.unchecked)} parameters could not be checked because their requests kept failing")
+            report_throttles(fuzzer)
+        finally:
+            fuzzer.close()
+
+    progress("Starting native parameter discovery...")
+    asyncio.run(run())
+    return found
+
+
 def do_param(ARGS):
+    if not (ARGS.url.startswith("http://") or ARGS.url.startswith("https://")):
+        ARGS.url = "http://" + ARGS.url
     info(f"Fuzzing URL: {ARGS.url}")
-    x8_args = []
 
     if not ARGS.wordlist:
         ARGS.wordlist = f"{LIBRARY_DIR}/list/web-param.txt"
-    if ARGS.output:
-        x8_args += ["-o", ARGS.output, "-O", "json"]
+    if ARGS.mode != "query" and not ARGS.native:
+        info("x8 is only used for query parameters, using the native engine for a body")
+        ARGS.native = True
 
-    progress("Starting x8...")
-    command(["x8", "-u", ARGS.url, "-w", ARGS.wordlist, *x8_args], highlight=True, error_message="Failed to run x8")
+    if use_native(ARGS, "x8"):
+        found = mine_params(ARGS)
+        if ARGS.output:
+            with open(ARGS.output, "w") as f:
+                json.dump([{"method": "GET" if ARGS.mode == "query" else "POST", "url": ARGS.url, "mode": ARGS.mode,
+                            "found_params": [{"name": name, "value": ARGS.value, "reason": difference}
+                                             for name, difference in found]}], f)
+    else:
+        x8_args = ["-P", f"%k={ARGS.value}"]  # Parameter template
+        if ARGS.output:
+            x8_args += ["-o", ARGS.output, "-O", "json"]
+
+        progress("Starting x8...")
+        command(["x8", "-u", ARGS.url, "-w", ARGS.wordlist, *x8_args], highlight=True, error_message="Failed to run x8")
     success("Finished fuzzing")
     if ARGS.output:
         success(f"Output saved in '{ARGS.output}'")
         info(f"Tip: Use `jq -r .[].found_params[].name {shlex.quote(ARGS.output)}` to list all found parameters")
 
 
-def do_vhost(ARGS, ffuf_args=["-ac"], silent=False):
-    ARGS.domain, scheme = get_domain(ARGS.domain)  # Normalize domain
-    ffuf_args += ["-c"]  # Color and auto-calibrate filter
-    ffuf_output_args = []
+def add_patterns(filename, pattern_of):
+    """Record the pattern of every host in the JSON output of ffuf, like the native engine does"""
+    with open(filename) as f:
+        data = json.load(f)
+    for result in data["results"]:
+        result["input"]["VHOST"] = pattern_of.get(result["input"]["FUZZ"], "")
+    with open(filename, "w") as f:
+        json.dump(data, f)
 
-    if ARGS.all:  # Removes default response code filter
-        ffuf_args += ["-mc", "0"]
+
+def do_vhost(ARGS):
+    explicit = ARGS.domain.startswith("http://") or ARGS.domain.startswith("https://")
+    ARGS.domain, scheme = get_domain(ARGS.domain)  # Normalize domain
+    native = use_native(ARGS)
     if not ARGS.wordlist:
         ARGS.wordlist = f"{LIBRARY_DIR}/list/web-vhost.txt"
 
-    fuzz_hosts = FUZZ_vhost_keyword(ARGS.domain)
-
-    for i, host in enumerate(fuzz_hosts):
+    schemes = [scheme] if explicit else answering_schemes(ARGS.domain)
+    template, mode, keywords = vhost_job(ARGS.domain, schemes)
+    for host in keywords["VHOST"]:
         info(f"Fuzzing domain: {host}")
+    info(f"All patterns are fuzzed at once on {' and '.join(schemes)}")
 
+    if native:
+        state = load_state(ARGS)
+        fuzz_native(ARGS, state, template, ARGS.wordlist, mode, match_all=ARGS.all, output=ARGS.output, keywords=keywords,
+                    label=lambda result: f"{result['input']['SCHEME']}://{result['host']}")
+        close_state(state)
+    else:
+        ffuf_args = ["-c", *calibrate_size(ARGS, template, mode, keywords)]  # Color, filter and limit
+        if ARGS.all:  # Removes default response code filter
+            ffuf_args += ["-mc", "0"]
         if ARGS.output:
-            ffuf_output_args = output_args(ARGS.output, n=i+1)
-
-        progress("Starting ffuf (press ENTER to pause)...")
-        command(["ffuf", "-u", f"{scheme}://{ARGS.domain}", "-w", ARGS.wordlist, "-H", f"Host: {host}",
-                 *ffuf_args, *ffuf_output_args], highlight=True, error_message="Failed to run ffuf")
+            ffuf_args += output_args(ARGS.output)
+        if ARGS.resume:
+            warning("ffuf can't continue where it stopped, use --native to resume scans")
+
+        with tempfile.TemporaryDirectory() as directory:
+            hosts, schemes_file = f"{directory}/hosts.txt", f"{directory}/schemes.txt"
+            pattern_of = expand_hosts(ARGS.wordlist, keywords["VHOST"], hosts)
+            with open(schemes_file, "w") as f:
+                f.write("\n".join(schemes) + "\n")
+            progress("Starting ffuf (press ENTER to pause)...")
+            command(["ffuf", "-u", f"SCHEME://{vhost_target(ARGS.domain)}", "-w", f"{hosts}:FUZZ", "-w", f"{schemes_file}:SCHEME",
+                     "-H", "Host: FUZZ", *ffuf_args], highlight=True, error_message="Failed to run ffuf")
+        if ARGS.output and os.path.splitext(ARGS.output)[1] in ("", ".json"):
+            add_patterns(ARGS.output, pattern_of)
 
     success("Finished fuzzing")
     info("Tip: Try fuzzing any found names again to discover deeper subdomains")
-    if ARGS.output and not silent:
+    if ARGS.output:
         success(f"Output saved in '{ARGS.output}'")
-        info(f"Tip: Use `jq -r .results[].host {shlex.quote(ARGS.output)}*` to list all found domains")
+        info(f"Tip: Use `jq -r '.results[] | [.host, .input.VHOST] | @tsv' {shlex.quote(ARGS.output)}` to list all found domains "
+             f"with their pattern")
+
+
+class AutoOutput:
+    def __init__(self, domain, state):
+        """Text files of `ffuf auto`, results are appended as soon as they are found. They start with the results in
+        the checkpoint when resuming, and skip those that are found again"""
+        self.state = state
+        self.domain = domain
+        self.clusters = {"get": Clusters(), "post": Clusters()}  # Of the endpoints found in this run
+        self.files = {kind: open(f"ffuf-{kind}-{domain}.txt", "w") for kind in ("subdomains", "get", "post")}
+        self.seen = {kind: set() for kind in self.files}
+        for kind, f in self.files.items():
+            for line in state.results.get(kind, []):
+                f.write(f"{line}\n")
+                self.seen[kind].add(line)
+            f.flush()
+
+    def add(self, kind, line):
+        """Add a result, returns `False` if it was already found"""
+        if line in self.seen[kind]:
+            return False
+        self.seen[kind].add(line)
+        self.state.add_result(kind, line)
+        f = self.files[kind]
+        f.write(f"{line}\n")
+        f.flush()
+        self.state.save()
+        return True
+
+    def add_endpoint(self, kind, scheme, result, response=None):
+        """Add a found endpoint, printed unless it is a near-duplicate of many others"""
+        url = f"{scheme}://{result['host']}{urlparse(result['url']).path}"
+        if self.add(kind, url):
+            show_hit(self.clusters[kind], result, url, response)
+
+    def close(self):
+        for (kind, f), name in zip(self.files.items(), ["Subdomain scan", "GET endpoint scan", "POST endpoint scan"]):
+            f.close()
+            success(f"{name} complete! ({len(self.seen[kind])} results in {f.name!r})")
+
+        clusters = [(kind, cluster) for kind in self.clusters for cluster in self.clusters[kind].clusters]
+        if clusters:
+            with open(f"ffuf-clusters-{self.domain}.txt", "w") as f:
+                for kind, cluster in sorted(clusters, key=lambda c: -c[1].count):
+                    f.write(f"{cluster.count}\t{kind.upper()}\t{cluster.result['status']}\t{cluster.result['length']}\t{cluster.label}\n")
+            for kind, clusters in self.clusters.items():
+                print_clusters(clusters)
+            success(f"Found endpoints grouped by similar responses in {f.name!r}")
+
+
+def ffuf_input(result):
+    """Inputs of a result from `ffuf -json`, which are base64 encoded"""
+    return {k: base64.b64decode(v).decode(errors="replace") for k, v in result["input"].items() if k != "FFUFHASH"}
+
+
+async def auto_ffuf(ARGS, output, scheme, vhost_args, state):
+    """Pipeline of ffuf processes, every found subdomain starts its GET and POST scans while the subdomain scan continues.
+    At most `AUTO_PROCESSES` run at once, sharing the threads and rate in `vhost_args` that the host kept up with.
+    Resumes per scan, because ffuf can't continue where it stopped"""
+    budget = asyncio.Semaphore(AUTO_PROCESSES)
+    tasks = []
+    throttle_args = vhost_args[vhost_args.index("-t"):]  # All processes go to the same server
+
+    async def run_ffuf(name, args, on_result):
+        if state.job(name, None, name)["finished"]:
+            return
+        async with budget:
+            state.start(name)
+            process = await asyncio.create_subprocess_exec("ffuf", *args, "-json", stdout=asyncio.subprocess.PIPE,
+                                                           stderr=asyncio.subprocess.DEVNULL, stdin=asyncio.subprocess.DEVNULL)
+            try:
+                async for line in process.stdout:
+                    try:
+                        result = json.loads(line)
+                    except ValueError:
+                        continue
+                    result["input"] = ffuf_input(result)
+                    on_result(result)
+                await process.wait()
+            finally:
+                if process.returncode is None:
+                    process.kill()
+        state.finish(name)
+
+    def on_endpoint(kind, host, result):
+        result["host"] = host
+        output.add_endpoint(kind, scheme, result)
+
+    def scan_host(host):
+        url = FUZZ_content_keyword(f"{scheme}://{ARGS.domain}")
+        tasks.append(asyncio.create_task(run_ffuf(f"get {host}",
+            ["-u", url, "-H", f"Host: {host}", "-w", ARGS.wordlist, "-recursion", "-e", ",".join(EXTENSIONS), "-mc", "0", "-ac",
+             *throttle_args], lambda result: on_endpoint("get", host, result))))
+        tasks.append(asyncio.create_task(run_ffuf(f"post {host}",
+            ["-u", url, "-H", f"Host: {host}", "-w", ARGS.wordlist, "-X", "POST", "-e", ".php", "-mc", "0", "-ac", *throttle_args],
+            lambda result: on_endpoint("post", host, result))))
+
+    def on_vhost(result):
+        if output.add("subdomains", result["host"]):
+            success(f"Found subdomain: {result['host']}")
+            scan_host(result["host"])
+
+    for host in state.results.get("subdomains", []):  # Found before resuming
+        scan_host(host)
+    if output.add("subdomains", ARGS.domain):
+        scan_host(ARGS.domain)
+    with tempfile.TemporaryDirectory() as directory:  # All patterns in one run
+        expand_hosts(ARGS.subdomains, FUZZ_vhost_keyword(ARGS.domain), f"{directory}/hosts.txt")
+        await run_ffuf("vhost", ["-u", f"{scheme}://{vhost_target(ARGS.domain)}", "-w", f"{directory}/hosts.txt", "-H", "Host: FUZZ",
+                                 *vhost_args, "-mc", "0"], on_vhost)
+    info("Subdomain scan finished, waiting for endpoint scans...")
+    await asyncio.gather(*tasks)
+
+
+async def auto_native(ARGS, output, scheme, state):
+    """Pipeline in the native engine, every found subdomain starts its GET and POST scans while the subdomain scan
+    continues. All scans share the connections of one `Fuzzer`"""
+    fuzzer = new_fuzzer(ARGS)
+    tasks = []
+
+    async def endpoint_scan(host, method):
+        kind = method.lower()
+        mode = f"{kind} {host}"
+        state.job(mode, Template(FUZZ_content_keyword(f"{scheme}://{ARGS.domain}"), method, [("Host", host)]), mode)
+
+        while names := state.pending(mode):
+            job = state.jobs[names[0]]
+            baseline = await load_baseline(fuzzer, job["template"], job["mode"], ARGS.recalibrate,
+                                           f" of {method} {host}{job['mode'][len(mode) + 1:]}", state)
+
+            def on_response(response):
+                if baseline.is_negative(response):
+                    return
+                output.add_endpoint(kind, scheme, to_result(response), response)
+                if method == "GET" and is_directory(response):  # Recursion, calibrated separately like in `fuzz_native`
+                    name = f"{mode} {urlparse(response.request.url).path}/"
+                    state.job(name, Template(response.request.url + "/FUZZ", method, [("Host", host)]), name)
+
+            await run_job(fuzzer, state, names[0], {"FUZZ": ARGS.wordlist}, on_response,
+                          EXTENSIONS if method == "GET" else [".php"])
+
+    def scan_host(host):
+        tasks.extend(asyncio.create_task(endpoint_scan(host, method)) for method in ("GET", "POST"))
+
+    try:
+        for host in state.results.get("subdomains", []):  # Found before resuming
+            scan_host(host)
+        if output.add("subdomains", ARGS.domain):
+            scan_host(ARGS.domain)
+        template, mode, keywords = vhost_job(ARGS.domain, [scheme])  # All patterns in one job
+        if not state.job("vhost", template, mode)["finished"]:
+            baseline = await load_baseline(fuzzer, template, mode, ARGS.recalibrate, " of subdomains", state, keywords)
+
+            def on_vhost(response):
+                if not baseline.is_negative(response):
+                    host = to_result(response)["host"]
+                    if output.add("subdomains", host):
+                        success(f"Found subdomain: {host}")
+                        scan_host(host)
+
+            await run_job(fuzzer, state, "vhost", {"FUZZ": ARGS.subdomains, **keywords}, on_vhost)
+        info("Subdomain scan finished, waiting for endpoint scans...")
+        await asyncio.gather(*tasks)
+    finally:
+        fuzzer.close()
+        report_throttles(fuzzer)
 
 
 def do_auto(ARGS):
     if not ARGS.wordlist:
         ARGS.wordlist = f"{LIBRARY_DIR}/list/web-content.txt"
-    
-    ARGS.domain, _ = get_domain(ARGS.domain)
-    calibrated_filter = calibrate_size(ARGS.domain, vhost=True)
-    
-    tmp = NamedTemporaryFile()
-    ARGS.output = tmp.name
-    wordlist_backup = ARGS.wordlist
-    ARGS.wordlist = ARGS.subdomains
-    
-    ARGS.all = True
-    # Subdomain scan
-    progress("Starting subdomain scan...")
-    do_vhost(ARGS, calibrated_filter, silent=True)
-    output = json.load(open(ARGS.output))
-    
-    txt_subdomains = f"ffuf-subdomains-{ARGS.domain}.txt"
-    with open(txt_subdomains, "w") as f:  # Parse JSON to TXT
-        hosts = [ARGS.domain] + [sub["host"] for sub in output["results"]]
-        [f.write(f"{line}\n") for line in hosts]
-        success(f"Subdomain scan complete! ({len(output['results'])} results in {txt_subdomains!r})")
-    
-    # GET scan
-    txt_get = f"ffuf-get-{ARGS.domain}.txt"
-    progress("Starting GET endpoint scan on hosts (press ENTER to pause)...")
-    command(["ffuf", "-u", FUZZ_content_keyword(ARGS.domain), "-H", "Host: HOST", "-w", wordlist_backup, "-w", f"{txt_subdomains}:HOST", 
-                "-recursion", "-e", ",".join(EXTENSIONS), "-mc", "0", "-c", "-ach", "-o", ARGS.output], highlight=True)
-
-    output = json.load(open(ARGS.output))
-    with open(txt_get, "w") as f:  # Parse JSON to TXT
-        endpoints = [f"http://{r['input']['HOST']}/{r['input']['FUZZ']}" for r in output['results']]
-        [f.write(f"{line}\n") for line in endpoints]
-        success(f"GET endpoint scan complete! ({len(output['results'])} results in {txt_get!r})")
-    
-    # POST scan
-    txt_post = f"ffuf-post-{ARGS.domain}.txt"
-    progress("Starting POST endpoint scan on hosts (press ENTER to pause)...")
-    command(["ffuf", "-u", FUZZ_content_keyword(ARGS.domain), "-H", "Host: HOST", "-w", wordlist_backup, "-w", f"{txt_subdomains}:HOST", 
-                "-X", "POST", "-e", ".php", "-mc", "0", "-c", "-ach", "-o", ARGS.output], highlight=True)
-    
-    output = json.load(open(ARGS.output))
-    with open(txt_post, "w") as f:  # Parse JSON to TXT
-        endpoints = [f"http://{r['input']['HOST']}/{r['input']['FUZZ']}" for r in output['results']]
-        [f.write(f"{line}\n") for line in endpoints]
-        success(f"POST endpoint scan complete! ({len(output['results'])} results in {txt_post!r})")
-    
-    tmp.close()
+    if not ARGS.subdomains:
+        ARGS.subdomains = f"{LIBRARY_DIR}/list/web-vhost.txt"
+
+    ARGS.domain, scheme = get_domain(ARGS.domain)
+    native = use_native(ARGS)
+    vhost_args = None if native else calibrate_size(ARGS, *vhost_job(ARGS.domain, [scheme]), processes=AUTO_PROCESSES)
+
+    state = load_state(ARGS)
+    output = AutoOutput(ARGS.domain, state)
+    progress("Starting subdomain scan, every found subdomain is scanned for GET and POST endpoints right away...")
+    start = time.monotonic()
+    try:
+        if native:
+            run_checkpointed(state, auto_native(ARGS, output, scheme, state))
+        else:
+            run_checkpointed(state, auto_ffuf(ARGS, output, scheme, vhost_args, state))
+    finally:
+        output.close()
+    close_state(state)
+    success(f"Finished all scans in {time.monotonic() - start:.0f}s")
+
 
 def setup(subparsers):
     parser = subparsers.add_parser('ffuf', help='Fuzz websites with ffuf for directories/files, parameters or vhosts')
@@ -224,6 +682,12 @@ def setup(subparsers):
     parser_content.add_argument('-r', "--recursion", action="store_true", help="Recursively search when a directory was found")
     parser_content.add_argument('-o', "--output", help="File to save output of ffuf")
     parser_content.add_argument('-a', "--all", action="store_true", help="Match all out-of-place responses, removes response code filter")
+    parser_content.add_argument('-n', "--native", action="store_true", help="Use the built-in fuzzing engine instead of ffuf")
+    parser_content.add_argument("--recalibrate", action="store_true", help="Calibrate again instead of using a cached calibration of the host")
+    parser_content.add_argument('-t', "--threads", type=int, default=FFUF_THREADS,
+                        help=f"Maximum concurrent requests, lowered automatically when the host slows down (default: {FFUF_THREADS})")
+    parser_content.add_argument("--rate", type=float, help="Maximum requests per second")
+    parser_content.add_argument("--resume", action="store_true", help="Continue from the checkpoint of an interrupted run of the same command")
 
     parser_param = parser_subparsers.add_parser('param', help='Fuzz for query parameters on a page')
     parser_param.set_defaults(func=do_param)
@@ -232,6 +696,12 @@ def setup(subparsers):
     parser_param.add_argument('-v', "--value", default="1", help='Value of the parameter to use (default: 1)')
     parser_param.add_argument('-o', "--output", help="File to save output of ffuf")
     parser_param.add_argument('-a', "--all", action="store_true", help="Match all out-of-place responses, removes response code filter")
+    parser_param.add_argument('-m', "--mode", choices=MODES, default="query",
+                              help="Where to send the parameters: in the query string, a POST form or a JSON body (default: query)")
+    parser_param.add_argument('-n', "--native", action="store_true", help="Use the built-in parameter discovery instead of x8")
+    parser_param.add_argument('-t', "--threads", type=int, default=FFUF_THREADS,
+                              help=f"Maximum concurrent requests, lowered automatically when the host slows down (default: {FFUF_THREADS})")
+    parser_param.add_argument("--rate", type=float, help="Maximum requests per second")
 
     parser_vhost = parser_subparsers.add_parser('vhost', help='Fuzz for virtual hosts (subdomains) on a website by changing the Host header')
     parser_vhost.set_defaults(func=do_vhost)
@@ -240,9 +710,21 @@ def setup(subparsers):
     parser_vhost.add_argument('-w', "--wordlist", help='Wordlist of subdomains to use for fuzzing')
     parser_vhost.add_argument('-o', "--output", help="File to save output of ffuf")
     parser_vhost.add_argument('-a', "--all", action="store_true", help="Match all out-of-place responses, removes response code filter")
+    parser_vhost.add_argument('-n', "--native", action="store_true", help="Use the built-in fuzzing engine instead of ffuf")
+    parser_vhost.add_argument("--recalibrate", action="store_true", help="Calibrate again instead of using a cached calibration of the host")
+    parser_vhost.add_argument('-t', "--threads", type=int, default=FFUF_THREADS,
+                              help=f"Maximum concurrent requests, lowered automatically when the host slows down (default: {FFUF_THREADS})")
+    parser_vhost.add_argument("--rate", type=float, help="Maximum requests per second")
+    parser_vhost.add_argument("--resume", action="store_true", help="Continue from the checkpoint of an interrupted run of the same command")
     
     parser_all = parser_subparsers.add_parser('auto', help='First find subdomains, then fuzz those for files and parameters')
     parser_all.set_defaults(func=do_auto)
     parser_all.add_argument('domain', help='The domain or URL to fuzz the Host header on')
     parser_all.add_argument('-s', "--subdomains", help='Wordlist of subdomains to use for fuzzing')
     parser_all.add_argument('-w', "--wordlist", help='Wordlist of paths to use for fuzzing')
+    parser_all.add_argument('-n', "--native", action="store_true", help="Use the built-in fuzzing engine instead of ffuf")
+    parser_all.add_argument("--recalibrate", action="store_true", help="Calibrate again instead of using a cached calibration of the host")
+    parser_all.add_argument('-t', "--threads", type=int, default=FFUF_THREADS,
+                            help=f"Maximum concurrent requests, lowered automatically when the host slows down (default: {FFUF_THREADS})")
+    parser_all.add_argument("--rate", type=float, help="Maximum requests per second")
+    parser_all.add_argument("--resume", action="store_true", help="Continue from the checkpoint of an interrupted run of the same command")
@@ -1,6 +1,10 @@
 from default.main import *
-from base64 import b32encode
-from default.lib.base64_search import create_base64_regex
+from default.lib.flag_search import FlagMatcher, get_needles, search_tree, watch_tree, WIDE
+from default.lib.xor_search import BruteForceMatcher, MAX_KEY_LENGTH
+from default.lib.scan_index import ScanIndex, INDEX_FILENAME
+from default.lib.archive_search import ArchiveSearcher, MAX_DECOMPRESSED
+from default.lib.decode_search import DecodeMatcher, MAX_DEPTH
+from default.lib.file_watch import create_watcher, InotifyWatcher
 
 
 def normalize_prefix(prefix):
@@ -13,36 +17,27 @@ def normalize_prefix(prefix):
     return prefix
 
 
-def get_encoded_length(s, in_bits, out_bits):
-    """Get the length of the encoded value that can be used (last few characters may vary, this function solves that)"""
-    s_bits = len(s) * in_bits  # 8 bits per character
-    encoded_len = s_bits // out_bits  # Split into 5/6 bit per character
-    return encoded_len
+def printable(data):
+    """Make bytes safe to print on a single line"""
+    return re.sub(r"[\x00-\x08\x0a-\x1f\x7f]", ".", data.decode(errors="replace"))
 
 
-def xor(s, key):
-    return bytes([c ^ key for c in s])
+def decode_wide(match):
+    """Show wide characters (UTF-16/UTF-32) as normal text, context is cut to whole characters"""
+    width = WIDE[match.encoding]
+    before = match.before[len(match.before) % width:]
+    after = match.after[:len(match.after) - len(match.after) % width]
+    return match._replace(before=before.decode(match.encoding, errors="replace").encode(),
+                          text=match.text.decode(match.encoding, errors="replace").encode(),
+                          after=after.decode(match.encoding, errors="replace").encode())
 
 
-def rot(s, key):
-    """Rotate every byte of s by key, modulo 256"""
-    return bytes((c + key) % 256 for c in s)
-
-
-def chunks(s, length):
-    return [s[i:i+length] for i in range(0, len(s), length)]
-
-
-def to_grep_hex(s):
-    """Convert bytes to regex hex format (b"A" -> '\x41')"""
-    return ''.join('\\x' + c for c in chunks(s.hex(), 2))
-
-
-def grep(regex, grep_args=[]):
-    if which("rg"):
-        command(["rg", "--color=always", *grep_args, regex], highlight=True, error_message=None)
-    else:
-        command(["grep", "--color=always", "-rE", *grep_args, regex], highlight=True, error_message=None)
+def print_match(match):
+    if match.encoding in WIDE:
+        match = decode_wide(match)
+    print(f"{Fore.MAGENTA}{match.path}{Style.RESET_ALL}:{Fore.GREEN}{match.offset}{Style.RESET_ALL}:"
+          f"{printable(match.before)}{Fore.LIGHTRED_EX}{printable(match.text)}{Style.RESET_ALL}{printable(match.after)} "
+          f"{Fore.LIGHTBLACK_EX}({match.encoding}){Style.RESET_ALL}")
 
 
 def flag(ARGS):
@@ -53,73 +48,86 @@ def flag(ARGS):
 
     flag_prefixes = [normalize_prefix(p) for p in flag_prefixes]
 
+    needles = []
     for prefix in flag_prefixes:
-        progress(f"Searching for flags with {prefix} format")
+        info(f"Flags with {prefix} format:")
 
         prefix = prefix[:-1]  # Remove trailing }
-        search = []
-
-        # Plain
-        search.append(prefix)
-        info(f"- {search[-1]!r}")
-        # Reversed
-        search.append(prefix[::-1])
-        info(f"- Reversed {search[-1]!r}")
-        # Hex encoded
-        search.append(prefix.encode().hex())
-        info(f"- Hex {search[-1]!r}")
-        # Base32 encoded
-        length = get_encoded_length(prefix, 8, 5)  # Base32 translates 8 bits to 5 bits
-        search.append(b32encode(prefix.encode()).decode()[:length])
-        info(f"- Base32 {search[-1]!r}")
-
-        # Do regex search
-        grep_args = []
-
-        regex = '|'.join(re.escape(s) for s in search)
-
-        if ARGS.context is not None:
-            grep_args += ["-o"]  # Show match only
-            regex = f".{{0,{ARGS.context}}}({regex}).{{0,{ARGS.context}}}"
+        for needle in get_needles(prefix):
+            info(f"- {needle.encoding} {needle.description}")
+            needles.append(needle)
 
-        grep_args += ["-a"] if ARGS.all else []  # Match binary (all) files
-
-        grep(regex, grep_args)
-
-        # Base64 encoded
-        regex = create_base64_regex(prefix.encode())
-        info(f"- Base64 (all offsets)")
-
-        if "-o" not in grep_args:
-            grep_args += ["-o"]
-        grep(regex, grep_args)
-
-    success("Completed search")
+        if ARGS.brute_force:
+            key_length = min(MAX_KEY_LENGTH, len(prefix) - 1)
+            info(f"- XOR and ROT with all single-byte keys, repeating XOR keys up to {key_length} bytes")
 
+    # All prefixes and encodings are searched for in one walk over the files
+    matchers = [FlagMatcher(needles, context=ARGS.context)]
     if ARGS.brute_force:
-        for prefix in flag_prefixes:
-            progress(f"Searching 256 possible keys with {prefix} format")
+        matchers.append(BruteForceMatcher([p[:-1] for p in flag_prefixes]))
+    if ARGS.decode:
+        info(f"Decoding nested base64, base32, hex, URL, HTML entities, UTF-16LE and zlib/gzip up to {MAX_DEPTH} layers deep")
+        matchers.append(DecodeMatcher(needles, context=ARGS.context))
+
+    archives = ArchiveSearcher() if ARGS.search_zip else None
+    if archives is not None:
+        info("Searching inside archives and compressed files")
+
+    index = None
+    if not ARGS.no_index:
+        signatures = [m.signature for m in matchers] + ([archives.signature] if archives is not None else [])
+        index = ScanIndex(".", signatures, CONFIG.flag_prefixes, reindex=ARGS.reindex)
+        if index.invalidated:
+            warning("Flag prefixes in config changed since the last search, searching all files again")
+
+    encodings = {n.encoding for n in needles}
+    ignore = [INDEX_FILENAME, INDEX_FILENAME + ".tmp"]
+    seen = set()  # Printed matches, so watching only shows new ones
+
+    def print_results(results):
+        for path, matches, binary in results:
+            binary_match = False
+            for match in sorted(matches, key=lambda m: m.offset):
+                if (match.path, match.offset, match.encoding, match.text) in seen:
+                    continue
+                seen.add((match.path, match.offset, match.encoding, match.text))
+
+                # Brute-force and decoded matches are always shown, because they are mostly found in binary files
+                if binary and not ARGS.all and match.encoding in encodings:
+                    binary_match = True
+                else:
+                    print_match(match)
+
+            if binary_match:
+                print(f"Binary file {path} matches")
+
+    # Armed before searching so files written during the search are not missed, unchanged ones are skipped by the index
+    watcher = create_watcher(".", ignore) if ARGS.watch else None
+
+    progress(f"Searching for {len(matchers[0].needles)} patterns in one pass...")
+    try:
+        print_results(search_tree(".", matchers, index, ignore=ignore, archives=archives))
+    finally:  # Also keep progress if interrupted
+        if index is not None:
+            index.save()
 
-            prefix = prefix.encode()[:-1]  # To bytes and remove trailing }
-            search = []
-
-            # XOR
-            for key in range(1, 256):
-                search.append(xor(prefix, key))
-            info("- XOR")
-
-            # ROT
-            for key in range(1, 256):
-                search.append(rot(prefix, key))
-            info("- ROT")
-
-            search = [to_grep_hex(s) for s in search]
-            # Grep with recursive, binary, Perl regex, byte offset and match only
-            command(["grep", "--color=always", "-raPbo", '|'.join(search)],  # env=dict(os.environ, LANG="C"),
-                    highlight=True, error_message=None)
-
-        success("Completed brute-force search")
-        info("Tip: Use `xxd -s +[offset] -l 32 [file]` to see full data from matches")
+    success("Completed search")
+    for path in archives.exceeded if archives is not None else []:
+        warning(f"Stopped searching '{path}' after {MAX_DECOMPRESSED // 1024 ** 2} MB of decompressed data, it may be a zip bomb")
+    if index is not None and index.reused:
+        info(f"Reused results of {index.reused} unchanged files from '{INDEX_FILENAME}' (use --reindex to search them again)")
+
+    if watcher is not None:
+        method = "inotify" if isinstance(watcher, InotifyWatcher) else "polling"
+        progress(f"Watching for new and modified files using {method}, press Ctrl+C to stop...")
+        try:
+            print_results(watch_tree(watcher, matchers, index, archives))
+        except KeyboardInterrupt:
+            print()
+            success("Stopped watching")
+        finally:
+            if index is not None:
+                index.save()
 
 
 def setup(subparsers):
@@ -127,8 +135,16 @@ def setup(subparsers):
     parser.set_defaults(func=flag)
 
     parser.add_argument('prefix', nargs='?', help=f"Prefix of flag in a CTF{{flag}} format (default: {', '.join(CONFIG.flag_prefixes)})")
-    parser.add_argument('-a', '--all', action='store_true', help="Match and print binary files (adds -a to grep)")
+    parser.add_argument('-a', '--all', action='store_true', help="Match and print binary files")
     parser.add_argument('-b', '--brute-force', action='store_true',
-                        help="Try to brute-force XOR and ROT encodings with 256 attempts (may take some time)")
+                        help="Try to brute-force XOR and ROT encodings, including repeating XOR keys (may take some time)")
     parser.add_argument('-c', '--context', type=int,
                         help="Limit amount of characters to show around match, useful if a file with very long lines matches")
+    parser.add_argument('-d', '--decode', action='store_true',
+                        help="Recursively decode blobs of base64, hex, URL-encoding, zlib, etc. to find flags under multiple encodings")
+    parser.add_argument('-z', '--search-zip', action='store_true',
+                        help="Also search inside archives and compressed files (zip, tar, gz, bz2, xz), without extracting them")
+    parser.add_argument('-w', '--watch', action='store_true',
+                        help="Keep watching for new and modified files after searching, and search them as soon as they are written")
+    parser.add_argument('-r', '--reindex', action='store_true', help="Search all files again, instead of reusing results of unchanged files")
+    parser.add_argument('-n', '--no-index', action='store_true', help="Don't read or write the index of searched files in the current directory")
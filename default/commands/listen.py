@@ -1,8 +1,18 @@
 from default.main import *
 import socket
+import asyncio
+import time
 from pyngrok import ngrok
-from dnslib import DNSRecord, DNSHeader, RR, QTYPE, A, AAAA
+from dnslib import DNSRecord
 import ipaddress
+import base64
+from default.lib.listener import bind_sockets
+from default.lib.dns_server import DNSServer
+from default.lib.http_server import HTTPServer
+from default.lib.nc_server import SessionManager
+from default.lib.dns_rules import Zone, load_rules
+from default.lib.dns_exfil import Reassembler, printable_ratio
+from default.lib.event_log import EventLog, Correlator
 
 
 def get_ip():  # Get WSL IP from interface
@@ -43,37 +53,127 @@ def already_in_portproxy(ip, port):
     return (str(port), ip) in matches
 
 
+def forward_ports(ports, use_ngrok=False):  # Should be at the start of all listen actions
+    """Forward `(port, protocol)` listeners with ngrok, or from Windows to WSL with portproxy after asking once.
+    Returns the ports that were forwarded with portproxy, to remove them again at the end"""
+    if use_ngrok:
+        for port, protocol in ports:
+            progress(f"Creating ngrok tunnel to port {port}")
+            if protocol == "udp":
+                warning("ngrok does not support UDP, defaulting to TCP")
+            protocol = "http" if protocol == "http" else "tcp"
+
+            tunnel = ngrok.connect(port, protocol)
+            success(f"Successfully created ngrok tunnel from {tunnel.public_url}/ to {protocol}://localhost:{port}/")
+        return []  # No need for portproxy if ngrok is used already
+
+    if not detect_wsl():
+        return []
+    ip = get_ip()
+    if any(protocol == "udp" for _, protocol in ports):  # If uses UDP, can't use portproxy
+        warning("WSL portproxy does not support UDP, traffic can't be forwarded from Windows")
+    ports = [port for port, protocol in ports if protocol != "udp" and not already_in_portproxy(ip, port)]  # No need to ask for existing rules
+    if ports and ask("Detected WSL, do you want to forward connections to Windows through to WSL using portproxy?"):  # If portproxy forwarding
+        progress(f"Forwarding port {', '.join(map(str, ports))} to {ip}...")
+        wsl_as_admin("; ".join(f"netsh interface portproxy set v4tov4 {port} {ip}" for port in ports))  # One prompt for all
+        success(f"Port {', '.join(map(str, ports))} is now forwarded to WSL")
+        return ports
+    return []
+
+
+def remove_forwarded_ports(ports):  # Should be at the end of all listen actions
+    if ports and ask(f"Port {', '.join(map(str, ports))} was forwarded to WSL for listener, do you want to remove the rule now?"):
+        wsl_as_admin("; ".join(f"netsh interface portproxy delete v4tov4 {port}" for port in ports))
+        success("Successfully removed forwarding rule")
+
+
 def create_forwarding(ARGS):  # Should be at the start of all listen actions
-    if "ngrok" in ARGS and ARGS.ngrok:
-        protocol = "http" if ARGS.action == "http" else "tcp"
-
-        progress(f"Creating ngrok tunnel to port {ARGS.port}")
-        if "udp" in ARGS and ARGS.udp:
-            warning("ngrok does not support UDP, defaulting to TCP")
-
-        tunnel = ngrok.connect(ARGS.port, protocol)
-        success(f"Successfully created ngrok tunnel from {tunnel.public_url}/ to {protocol}://localhost:{ARGS.port}/")
-        return  # No need for portproxy if ngrok is used already
-
-    is_wsl = detect_wsl()
-    if is_wsl:
-        ip = get_ip()
-        if ("udp" in ARGS and ARGS.udp) or ARGS.action == "dns":  # If uses UDP, can't use portproxy
-            warning("WSL portproxy does not support UDP, traffic can't be forwarded from Windows")
-        elif already_in_portproxy(ip, ARGS.port):  # No need to ask
-            pass
-        elif ask("Detected WSL, do you want to forward connections to Windows through to WSL using portproxy?"):  # If portproxy forwarding
-            progress(f"Forwarding port {ARGS.port} to {ip}...")
-            wsl_as_admin(f"netsh interface portproxy set v4tov4 {ARGS.port} {ip}")
-            success(f"Port {ARGS.port} is now forwarded to WSL")
-            ARGS.forward = "wsl"  # Save for later
+    if ARGS.action == "http":
+        protocol = "http"
+    elif ARGS.action == "dns" or ("udp" in ARGS and ARGS.udp):
+        protocol = "udp"
+    else:
+        protocol = "tcp"
+    ARGS.forwarded = forward_ports([(ARGS.port, protocol)], "ngrok" in ARGS and ARGS.ngrok)  # Save for later
 
 
 def remove_forwarding(ARGS):  # Should be at the end of all listen actions
-    if "forward" in ARGS and ARGS.forward == "wsl":
-        if ask(f"Port {ARGS.port} was forwarded to WSL for listener, do you want to remove the rule now?"):
-            wsl_as_admin(f"netsh interface portproxy delete v4tov4 {ARGS.port}")
-            success("Successfully removed forwarding rule")
+    if "forwarded" in ARGS:
+        remove_forwarded_ports(ARGS.forwarded)
+
+
+def bind(ARGS, port, kinds=(socket.SOCK_DGRAM, socket.SOCK_STREAM)):
+    """Bind sockets on the port, and ask to allow low ports if that is not permitted"""
+    try:
+        return bind_sockets(ARGS.ip, port, kinds)  # Try creating sockets on port
+    except PermissionError:  # Happens if port<1024 and not sudo
+        warning(f"Permission denied listening on port {port}")
+        choice = ask(f"Do you want to allow all low ports until next reboot?")
+        if choice:  # Add rule that allows any user to use any port (resets on boot)
+            command(["sudo", "sysctl", f"net.ipv4.ip_unprivileged_port_start=0"], highlight=True)
+            return bind_sockets(ARGS.ip, port, kinds)  # Try creating sockets on port again
+        else:
+            exit(1)
+    except OSError as e:
+        error(f"Failed to listen on port {port}: {e.strerror}")
+
+
+def addresses(sockets):
+    """Readable addresses of bound sockets, like '0.0.0.0 and :: port 53'"""
+    ips = dict.fromkeys(s.getsockname()[0] for s in sockets)
+    return f"{' and '.join(ips)} port {sockets[0].getsockname()[1]}"
+
+
+def run_listeners(listeners, console=None):
+    """Run `(server, sockets, tick)` listeners in one event loop until Ctrl+C. `tick(final)` is called every second,
+    and once more with `final=True` at the end. `console()` is called when there is input, and returns False at the end"""
+
+    def on_input():
+        if console() is False:  # Ctrl+D
+            loop.remove_reader(sys.stdin.fileno())
+            stop.set()
+
+    async def serve():
+        nonlocal loop, stop
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for server, sockets, _ in listeners:
+            await server.start(sockets)
+        if console is not None:
+            loop.add_reader(sys.stdin.fileno(), on_input)
+        try:
+            while not stop.is_set():
+                try:
+                    await asyncio.wait_for(stop.wait(), 1)
+                except asyncio.TimeoutError:
+                    pass
+                for _, _, tick in listeners:
+                    if tick is not None:
+                        tick(False)
+        finally:
+            if console is not None:
+                loop.remove_reader(sys.stdin.fileno())
+            for server, _, _ in listeners:
+                server.close()
+
+    loop = stop = None
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:  # Don't instantly exit on Ctrl+C
+        pass
+    finally:
+        print()
+        for _, _, tick in listeners:
+            if tick is not None:
+                tick(True)
+
+
+def close_log(log, path):
+    if log is not None:
+        log.close()
+        if log.dropped:
+            warning(f"Dropped {log.dropped} events because the log could not keep up")
+        info(f"Saved log of events to '{path}'")
 
 
 def ipv4_to_ipv6(ip):
@@ -90,29 +190,125 @@ def ipv4_to_ipv6(ip):
     return str(ipaddress.IPv6Address(prefix6to4 | (int(ipv4) << 80)))
 
 
-def create_dns_reply(request, ip):
-    reply = DNSRecord(DNSHeader(id=request.header.id, qr=1, aa=1, ra=1), q=request.q)
+def create_zone(ARGS):
+    """Rules from the rules file, followed by answering all A and AAAA queries with the response IP"""
+    rules = []
+    if ARGS.rules:
+        try:
+            rules = load_rules(ARGS.rules)
+        except ValueError as e:
+            error(f"Invalid rules file '{ARGS.rules}': {e}")
+    rules += [
+        {"name": "*", "type": "A", "answer": ARGS.response},  # Localhost IPv4
+        {"name": "*", "type": "AAAA", "answer": ipv4_to_ipv6(ARGS.response)},  # Localhost IPv6
+    ]
 
-    if request.q.qtype == QTYPE.A:
-        reply.add_answer(RR(request.q.qname, QTYPE.A, rdata=A(ip)))  # Localhost IPv4
-    elif request.q.qtype == QTYPE.AAAA:
-        ipv6 = ipv4_to_ipv6(ip)
-        reply.add_answer(RR(request.q.qname, QTYPE.AAAA, rdata=AAAA(ipv6)))  # Localhost IPv6
-
-    return reply
+    try:
+        return Zone(rules)
+    except (ValueError, re.error) as e:
+        error(f"Invalid rule in '{ARGS.rules}': {e}")
+
+
+NC_HELP = """Commands:
+  !list        List all sessions
+  !attach N    Attach to session N, showing its output and sending input to it
+  !detach      Stop sending input to the attached session
+  !kill [N]    Close session N (default: attached)
+  !!text       Send a line starting with '!'"""
+
+
+def setup_nc(ARGS, sockets, emit):
+    """Session manager for TCP and/or UDP sockets, and the console that controls it from stdin"""
+
+    def on_output(data):
+        sys.stdout.buffer.write(data)
+        sys.stdout.buffer.flush()
+
+    def attach(id):
+        dropped, data = manager.attach(id)
+        info(f"Attached to session {id} ({manager.attached}), !detach to stop")
+        if dropped:
+            warning(f"{dropped} bytes of older output were dropped")
+        on_output(data)
+
+    def on_event(event, session):
+        if event == "open":
+            success(f"New session {session.id} from {session}")
+            if manager.attached is None:  # Act like nc when there is only one
+                attach(session.id)
+        else:
+            warning(f"Session {session.id} from {session} was closed")
+        emit({"time": time.time(), "protocol": session.protocol, "event": event, "session": session.id,
+              "ip": session.ip, "port": session.port, "received": session.received})
+
+    def get_session(arg):
+        try:
+            id = int(arg) if arg else manager.attached.id
+        except (ValueError, AttributeError):
+            warning("Give a session number, see !list")
+            return None
+        if id not in manager.sessions:
+            warning(f"Session {id} does not exist, see !list")
+            return None
+        return id
+
+    def run_command(line):
+        name, _, arg = line[1:].strip().partition(" ")
+        if name in ("list", "ls"):
+            if not manager.sessions:
+                info("No sessions yet")
+            for session in manager.sessions.values():
+                state = "closed" if session.closed else "attached" if session is manager.attached else "open"
+                unseen = session.received - session.shown
+                info(f"{session.id}: {session} ({state}, {int(time.time() - session.started)}s, {unseen} new bytes)")
+        elif name in ("attach", "a"):
+            id = get_session(arg)
+            if id is not None:
+                attach(id)
+        elif name in ("detach", "d"):
+            manager.detach()
+            info("Detached, !attach N to attach to a session")
+        elif name == "kill":
+            id = get_session(arg)
+            if id is not None:
+                manager.kill(id)
+        elif name == "help":
+            print(NC_HELP)
+        else:
+            warning(f"Unknown command '!{name}', see !help")
+
+    def console():
+        data = os.read(sys.stdin.fileno(), 64 * 1024)
+        if not data:  # Ctrl+D
+            return False
+        for line in data.splitlines(keepends=True):
+            if line.startswith(b"!") and not line.startswith(b"!!"):
+                run_command(line.decode(errors="replace"))
+            elif manager.attached is None:
+                warning("Not attached to a session, see !list and !attach N")
+            else:
+                manager.send(line[1:] if line.startswith(b"!!") else line)
+
+    for kind in (socket.SOCK_STREAM, socket.SOCK_DGRAM):
+        bound = [s for s in sockets if s.type == kind]
+        if bound:
+            progress(f"Listening for {'TCP' if kind == socket.SOCK_STREAM else 'UDP'} sessions on {addresses(bound)}")
+    if ARGS.transcripts:
+        info(f"Saving transcripts of sessions to '{ARGS.transcripts}'")
+
+    manager = SessionManager(ARGS.transcripts, on_event, on_output)
+    return manager, console
 
 
 def listen_nc(ARGS):
     create_forwarding(ARGS)
 
     protocol = "udp" if ARGS.udp else "tcp"
-    progress(f"Starting listener on {protocol}://{ARGS.ip}:{ARGS.port}/...")
-    info("Ctrl+C to exit")
     if ARGS.pwncat:
+        progress(f"Starting listener on {protocol}://{ARGS.ip}:{ARGS.port}/...")
+        info("Ctrl+C to exit")
         if ARGS.udp:
             warning("UDP not supported for pwncat, defaulting back to TCP")
-        if ARGS.repeat:
-            warning(f"Cannot repeat pwncat. Start another listener in pwncat shell with 'listen -m linux {ARGS.port}'")
         if ARGS.ip != "0.0.0.0":
             warning("Cannot bind to specific IP address with pwncat, defaulting to all interfaces (0.0.0.0)")
 
@@ -121,84 +317,164 @@ def listen_nc(ARGS):
             interact_fg=True,
             error_message="Failed to run pwncat. Make sure it is installed correctly, and if it's installed on a different python version you could change the command in commands/listen.py",
         )
-    else:  # Default to netcat
-        nc_args = []
-        if ARGS.udp:
-            nc_args.append("-u")
+        success("Closed nc listener")
+        remove_forwarding(ARGS)
+        return
 
-        while True:  # Repeat infinitely if --repeat
-            returncode = command(["rlwrap", "nc", "-lnvp", ARGS.port, "-s", socket.gethostbyname(ARGS.ip), *nc_args], interact_fg=True)
-            if not ARGS.repeat or returncode != 0:
-                break
+    sockets = bind(ARGS, ARGS.port, [socket.SOCK_DGRAM if ARGS.udp else socket.SOCK_STREAM])
+    log = EventLog(ARGS.log) if ARGS.log else None
 
-            info("Connection was closed, starting back up because of --repeat flag")
+    manager, console = setup_nc(ARGS, sockets, log.write if log else lambda event: None)
+    info("Type !help for commands, Ctrl+C to exit")
+    run_listeners([(manager, sockets, None)], console)
 
+    close_log(log, ARGS.log)
+    if ARGS.transcripts:
+        info(f"Saved transcripts of sessions to '{ARGS.transcripts}'")
     success("Closed nc listener")
     remove_forwarding(ARGS)
 
 
+def body_to_json(body):
+    """Request body as text if possible, otherwise base64"""
+    try:
+        return {"body": body.decode()}
+    except UnicodeDecodeError:
+        return {"body_base64": base64.b64encode(body).decode()}
+
+
+def setup_http(ARGS, port, emit):
+    """HTTP server for the directory on the port, printing and emitting every request"""
+    sockets = bind(ARGS, port, [socket.SOCK_STREAM])
+
+    def on_request(request):
+        status = "no response" if request.status is None else f"{request.status} ({request.size} bytes)"
+        info(f"{request.ip} - {request.method} {request.path} -> {status}")
+        if ARGS.verbose:  # Full request
+            print_gray("\n".join(f"{name}: {value}" for name, value in request.headers))
+            if request.body:
+                print_gray(request.body.decode(errors="replace"))
+            print()
+        emit({"time": request.time, "protocol": "http", "ip": request.ip, "port": request.port, "method": request.method,
+              "path": request.path, "version": request.version, "headers": request.headers, **body_to_json(request.body),
+              "status": request.status, "size": request.size})
+
+    directory = f"'{ARGS.directory}'" if ARGS.directory != "." else "current directory"
+    progress(f"Starting HTTP server on http://{ARGS.ip}:{port}/ and serving files in {directory}")
+    return HTTPServer(ARGS.directory, on_request), sockets, None
+
+
 def listen_http(ARGS):
     create_forwarding(ARGS)
+    log = EventLog(ARGS.log) if ARGS.log else None
 
-    directory = f"'{ARGS.directory}'" if ARGS.directory != "." else "current directory"
-    progress(f"Starting HTTP server on http://{ARGS.ip}:{ARGS.port}/ and serving files in {directory}")
+    listener = setup_http(ARGS, ARGS.port, log.write if log else lambda event: None)
     info("Ctrl+C to exit")
-    command(
-        ["python3", "-m", "http.server", str(ARGS.port), "-b", ARGS.ip, "-d", ARGS.directory],
-        interact_fg=True,
-        error_message="Failed to start HTTP server",
-    )
+    run_listeners([listener])
 
+    close_log(log, ARGS.log)
     success("Closed HTTP server")
     remove_forwarding(ARGS)
 
 
+def print_gray(record):
+    print(Fore.LIGHTBLACK_EX, end="")
+    print(record)
+    print(Style.RESET_ALL, end="")
+
+
+def setup_dns(ARGS, port, emit):
+    """DNS server answering from the rules on the port, printing and emitting every query and exfiltrated payload"""
+    zone = create_zone(ARGS)
+    sockets = bind(ARGS, port)
+    reassembler = Reassembler(ARGS.exfil, ARGS.output) if ARGS.exfil else None
+
+    def print_payloads(payloads):
+        for payload in payloads:
+            session = f" in session '{payload.session}'" if payload.session else ""
+            success(f"Received {len(payload.data)} bytes of {payload.encoding} data from {payload.ip}{session} "
+                    f"in {payload.queries} queries, saved to '{payload.path}'")
+            if payload.missing:
+                warning(f"Missing sequence numbers: {', '.join(map(str, payload.missing[:20]))}{'...' if len(payload.missing) > 20 else ''}")
+            if printable_ratio(payload.data) > 0.95:
+                print_gray(payload.data[:1000].decode(errors="replace"))
+            emit({"time": time.time(), "protocol": "dns-exfil", "ip": payload.ip, "session": payload.session,
+                  "encoding": payload.encoding, "size": len(payload.data), "queries": payload.queries,
+                  "missing": payload.missing, "path": payload.path})
+
+    def on_query(query):
+        answers = ", ".join(query.answers) or "nothing"
+        info(f"Received {query.type} request for '{query.name}' from {query.ip}:{query.port} ({query.protocol}), answered {answers}")
+        if ARGS.verbose:  # Full request and reply
+            print_gray(DNSRecord.parse(query.request))
+            print_gray(DNSRecord.parse(query.reply))
+            print()
+        emit({"time": query.time, "protocol": "dns", "transport": query.protocol, "ip": query.ip, "port": query.port,
+              "name": query.name, "type": query.type, "answers": query.answers})
+        if reassembler is not None:
+            print_payloads(reassembler.add(query.ip, query.name))
+
+    def tick(final):
+        if final:  # Save transfers that were still in progress
+            print_payloads(reassembler.close())
+        else:  # Save transfers that finished
+            print_payloads(reassembler.flush())
+
+    progress(f"Listening for DNS over UDP and TCP on {addresses([s for s in sockets if s.type == socket.SOCK_DGRAM])}")
+    if reassembler is not None:
+        info(f"Reassembling data exfiltrated through subdomains of '{reassembler.domain}' into '{ARGS.output}'")
+    return DNSServer(zone.resolve, on_query), sockets, tick if reassembler is not None else None
+
+
 def listen_dns(ARGS):
     create_forwarding(ARGS)
+    log = EventLog(ARGS.log) if ARGS.log else None
 
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)  # UDP
-    try:
-        sock.bind((ARGS.ip, ARGS.port))  # Try creating socket on port
-    except PermissionError:  # Happens if port<1024 and not sudo
-        warning(f"Permission denied listening on port {ARGS.port}")
-        choice = ask(f"Do you want to allow all low ports until next reboot?")
-        if choice:  # Add rule that allows any user to use any port (resets on boot)
-            command(["sudo", "sysctl", f"net.ipv4.ip_unprivileged_port_start=0"], highlight=True)
-            sock.bind((ARGS.ip, ARGS.port))  # Try creating socket on port again
-        else:
-            exit(1)
+    listener = setup_dns(ARGS, ARGS.port, log.write if log else lambda event: None)
+    info("Ctrl+C to exit")
+    run_listeners([listener])
 
-    progress(f"Listening for DNS on udp://{ARGS.ip}:{ARGS.port}/")
-    sock.setblocking(0)
+    close_log(log, ARGS.log)
+    success("Closed DNS listener")
+    remove_forwarding(ARGS)
 
-    try:
-        while True:
-            try:
-                data, addr = sock.recvfrom(4096)  # Try to read
-                request = DNSRecord.parse(data)
-
-                # Read request
-                qtype = QTYPE.get(request.q.qtype)
-                info(f"Received {qtype} request for '{request.q.qname}' from {addr[0]}:{addr[1]}")
-                print(Fore.LIGHTBLACK_EX, end="")
-                print(request)
-                print(Style.RESET_ALL, end="")
-
-                # Send repy
-                reply = create_dns_reply(request, ARGS.response)
-                sock.sendto(reply.pack(), addr)
-
-                info(f"Sent reply with '{ARGS.response}' as answer")
-                print(Fore.LIGHTBLACK_EX, end="")
-                print(reply)
-                print(Style.RESET_ALL)
-            except socket.error:  # sock.recvfrom() raises exception if empty
-                pass
-    except KeyboardInterrupt:  # Don't instantly exit on Ctrl+C
-        pass
-    finally:
-        print()
-        success("Closed DNS listener")
+
+def listen_multi(ARGS):
+    ports = [(port, protocol) for port, protocol in [(ARGS.dns, "udp"), (ARGS.http, "http"), (ARGS.tcp, "tcp"), (ARGS.udp, "udp")] if port]
+    if not ports:
+        error("Choose at least one listener with --dns, --http, --tcp or --udp")
+
+    forwarded = forward_ports(ports, ARGS.ngrok)
+    log = EventLog(ARGS.log)
+    correlator = Correlator()
+
+    def emit(event):  # Link events from the same IP over different protocols
+        event["correlation"], others = correlator.add(event["ip"], event["protocol"].split("-")[0], event["time"])
+        if others:
+            seen = ", ".join(f"{protocol.upper()} {event['time'] - first:.0f}s before" for protocol, first in others.items())
+            success(f"{event['ip']} was also seen over {seen} (correlation {event['correlation']})")
+        log.write(event)
+
+    listeners = []
+    if ARGS.dns:
+        listeners.append(setup_dns(ARGS, ARGS.dns, emit))
+    if ARGS.http:
+        listeners.append(setup_http(ARGS, ARGS.http, emit))
+    console = None
+    sockets = (bind(ARGS, ARGS.tcp, [socket.SOCK_STREAM]) if ARGS.tcp else []) + (bind(ARGS, ARGS.udp, [socket.SOCK_DGRAM]) if ARGS.udp else [])
+    if sockets:  # TCP and UDP sessions share one console
+        manager, console = setup_nc(ARGS, sockets, emit)
+        listeners.append((manager, sockets, None))
+        info("Type !help for session commands")
+    info(f"Logging events of all listeners to '{ARGS.log}'")
+    info("Ctrl+C to exit")
+    run_listeners(listeners, console)
+
+    close_log(log, ARGS.log)
+    if ARGS.transcripts and sockets:
+        info(f"Saved transcripts of sessions to '{ARGS.transcripts}'")
+    success("Closed all listeners")
+    remove_forwarded_ports(forwarded)
 
 
 def listen_ssh(ARGS):
@@ -234,12 +510,13 @@ def setup(subparsers):
     parser = subparsers.add_parser("listen", help="Create network listeners")
     parser_subparsers = parser.add_subparsers(dest="action", required=True)
 
-    parser_nc = parser_subparsers.add_parser("nc", help="Listen for TCP or UDP connections with netcat")
+    parser_nc = parser_subparsers.add_parser("nc", help="Listen for any number of TCP or UDP connections, and switch between them")
     parser_nc.set_defaults(func=listen_nc)
     parser_nc.add_argument("port", nargs="?", type=int, default=1337, help="The port to listen on")
     parser_nc.add_argument("-p", "--pwncat", action="store_true", help="Use pwncat for reverse shell listening instead of nc")
     parser_nc.add_argument("-u", "--udp", action="store_true", help="Listen on UDP port instead of TCP")
-    parser_nc.add_argument("-r", "--repeat", action="store_true", help="After closing, start listener again until manually closed")
+    parser_nc.add_argument("-t", "--transcripts", metavar="DIRECTORY", help="Save the input and output of every session to files in this directory")
+    parser_nc.add_argument("-l", "--log", help="Append every opened and closed session as JSON to this file")
 
     parser_http = parser_subparsers.add_parser("http", help="Listen for HTTP connections and serve a directory as the content")
     parser_http.set_defaults(func=listen_http)
@@ -247,11 +524,41 @@ def setup(subparsers):
         "directory", type=PathType(type="dir"), nargs="?", default=".", help="The directory to serve as content (default: current)"
     )
     parser_http.add_argument("-p", "--port", type=int, default=8000, help="The port to listen on (default: 8000)")
+    parser_http.add_argument("-l", "--log", help="Append every request with its headers and body as JSON to this file")
+    parser_http.add_argument("-v", "--verbose", action="store_true", help="Print the headers and body of every request")
 
     parser_dns = parser_subparsers.add_parser("dns", help="Listen for DNS requests and respond with an IP, creating a DNS server")
     parser_dns.set_defaults(func=listen_dns)
     parser_dns.add_argument("-p", "--port", type=int, default=53, help="The port to listen on (default: 53)")
     parser_dns.add_argument("-r", "--response", default="127.0.0.1", help="The IP address to respond with (default: 127.0.0.1)")
+    parser_dns.add_argument(
+        "-f", "--rules", type=PathType(exists=True, type="file"), help="JSON file with rules for answering names and types (see lib/dns_rules.py)"
+    )
+    parser_dns.add_argument("-l", "--log", help="Append every query as JSON to this file")
+    parser_dns.add_argument("-e", "--exfil", metavar="DOMAIN", help="Reassemble and decode data exfiltrated in subdomains of this domain")
+    parser_dns.add_argument("-o", "--output", default="exfil", help="Directory to save reassembled exfiltrated data to (default: exfil)")
+    parser_dns.add_argument("-v", "--verbose", action="store_true", help="Print the full request and reply of every query")
+
+    parser_multi = parser_subparsers.add_parser("multi", help="Run DNS, HTTP and TCP/UDP session listeners together, logging all events to one file")
+    parser_multi.set_defaults(func=listen_multi)
+    parser_multi.add_argument("--dns", nargs="?", type=int, const=53, metavar="PORT", help="Start a DNS server (default port: 53)")
+    parser_multi.add_argument("--http", nargs="?", type=int, const=8000, metavar="PORT", help="Start an HTTP server (default port: 8000)")
+    parser_multi.add_argument("--tcp", nargs="?", type=int, const=1337, metavar="PORT", help="Listen for TCP sessions (default port: 1337)")
+    parser_multi.add_argument("--udp", nargs="?", type=int, const=1337, metavar="PORT", help="Listen for UDP sessions (default port: 1337)")
+    parser_multi.add_argument(
+        "-d", "--directory", type=PathType(type="dir"), default=".", help="The directory to serve as HTTP content (default: current)"
+    )
+    parser_multi.add_argument("-r", "--response", default="127.0.0.1", help="The IP address to respond to DNS with (default: 127.0.0.1)")
+    parser_multi.add_argument(
+        "-f", "--rules", type=PathType(exists=True, type="file"), help="JSON file with rules for answering names and types (see lib/dns_rules.py)"
+    )
+    parser_multi.add_argument("-e", "--exfil", metavar="DOMAIN", help="Reassemble and decode data exfiltrated in subdomains of this domain")
+    parser_multi.add_argument("-o", "--output", default="exfil", help="Directory to save reassembled exfiltrated data to (default: exfil)")
+    parser_multi.add_argument("-t", "--transcripts", metavar="DIRECTORY", help="Save the input and output of every session to files in this directory")
+    parser_multi.add_argument(
+        "-l", "--log", default="listen-events.jsonl", help="Append every event of all listeners as JSON to this file (default: listen-events.jsonl)"
+    )
+    parser_multi.add_argument("-v", "--verbose", action="store_true", help="Print full DNS queries and HTTP requests")
 
     parser_ssh = parser_subparsers.add_parser("ssh", help="Start an SSH server with password attempt logging using docker")
     parser_ssh.add_argument("port", nargs="?", type=int, default=22, help="The port to listen on (default: 22)")
@@ -262,12 +569,12 @@ def setup(subparsers):
     parser_smtp.add_argument("-w", "--web-port", type=int, default=3000, help="The webmail port to listen on (default: 3000)")
     parser_smtp.set_defaults(func=listen_smtp)
 
-    for p in [parser_nc, parser_http, parser_dns]:  # Add ip argument to all actions
+    for p in [parser_nc, parser_http, parser_dns, parser_multi]:  # Add ip argument to all actions
         p.add_argument(
             "-i",
             "--ip",
             default="0.0.0.0",
             help="The IP address to listen on. Will only accept connections to interface with this IP address (default: 0.0.0.0)",
         )
-    for p in [parser_nc, parser_http]:  # Add ngrok argument to all actions except DNS, because it only uses UDP which ngrok doesn't support
+    for p in [parser_nc, parser_http, parser_multi]:  # Add ngrok argument to all actions except DNS, because it only uses UDP which ngrok doesn't support
         p.add_argument("-n", "--ngrok", action="store_true", help="Use ngrok to create a public subdomain that points to the localhost port")
@@ -0,0 +1,205 @@
+import bz2
+import gzip
+import io
+import lzma
+import os
+import tarfile
+import zipfile
+import zlib
+from concurrent.futures import FIRST_COMPLETED, wait
+from default.lib.flag_search import MAX_LINE, MAX_TAIL, is_binary
+
+MAX_DEPTH = 4  # Levels of nested archives to search (a .tar.gz is 2 levels)
+MAX_DECOMPRESSED = 1024 * 1024 * 1024  # Decompressed bytes to search per archive on disk, protects against zip bombs
+READ_SIZE = 1024 * 1024
+
+ARCHIVE_ERRORS = (zipfile.BadZipFile, tarfile.TarError, lzma.LZMAError, zlib.error, EOFError, OSError, ValueError)
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+class Budget:
+    def __init__(self, limit):
+        """Counts decompressed bytes, raises `BudgetExceeded` once more than `limit` are read"""
+        self.limit = limit
+        self.used = 0
+
+    def take(self, n):
+        self.used += n
+        if self.used > self.limit:
+            raise BudgetExceeded()
+
+
+def get_archive_type(head):
+    """Detect the type of archive or compression from the first 512 bytes, returns `None` for anything else"""
+    if head.startswith((b"PK\x03\x04", b"PK\x05\x06")):  # Also .apk, .jar, .docx, etc.
+        return "zip"
+    elif head.startswith(b"\x1f\x8b"):
+        return "gzip"
+    elif head.startswith(b"BZh"):
+        return "bzip2"
+    elif head.startswith(b"\xfd7zXZ\x00"):
+        return "xz"
+    elif head[257:262] == b"ustar":
+        return "tar"
+
+
+def read_chunks(f, budget):
+    while True:
+        chunk = f.read(READ_SIZE)
+        if not chunk:
+            return
+        budget.take(len(chunk))
+        yield chunk
+
+
+def search_chunks(chunks, matchers, path):
+    """Search a stream of chunks, keeping enough of the previous chunk for matches and context across boundaries"""
+    ahead = max(m.max_length for m in matchers) + MAX_TAIL + max(getattr(m, "context", None) or MAX_LINE for m in matchers)
+    behind = MAX_TAIL + max(getattr(m, "context", None) or MAX_LINE for m in matchers)
+
+    matches = []
+    buffer = b""
+    base = 0  # Offset of the buffer in the stream
+    done = 0  # Matches before this offset were already found
+    binary = None
+    chunks = iter(chunks)
+    while True:
+        chunk = next(chunks, None)
+        if binary is None:
+            binary = is_binary(chunk or b"")
+
+        buffer += chunk or b""
+        end = len(buffer) if chunk is None else len(buffer) - ahead
+        if end > done - base:
+            for matcher in matchers:
+                for match in matcher.search(buffer, path, done - base, end):
+                    matches.append(match._replace(offset=base + match.offset))
+            done = base + end
+
+        if chunk is None:
+            return sorted(matches, key=lambda m: m.offset), binary
+
+        keep = max(0, done - base - behind)  # Drop what can't be part of a match or context anymore
+        buffer = buffer[keep:]
+        base += keep
+
+
+def iter_members(f, kind, name, budget, nested):
+    """Yields `(name, file)` for every member of an archive, or the decompressed stream of a compressed file"""
+    if kind == "zip":
+        if nested:  # Zip files need random access, which is slow or impossible in a decompressed stream
+            f = io.BytesIO(b"".join(read_chunks(f, budget)))
+        with zipfile.ZipFile(f) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or info.flag_bits & 0x1:  # Skip encrypted members
+                    continue
+                with archive.open(info) as member:
+                    yield info.filename, member
+    elif kind == "tar":
+        with tarfile.open(fileobj=f, mode="r|") as archive:  # Streaming mode, members are read in order
+            for info in archive:
+                if info.isfile():
+                    yield info.name, archive.extractfile(info)
+    else:
+        opener = {"gzip": gzip.open, "bzip2": bz2.open, "xz": lzma.open}[kind]
+        with opener(f) as member:
+            yield os.path.splitext(os.path.basename(name))[0], member
+
+
+def search_stream(f, path, matchers, depth, budget, results):
+    """Search a stream of decompressed data, recursing into archives up to `MAX_DEPTH`.
+    Results of every member are appended to `results` as `(path, matches, binary)`, so they survive a `BudgetExceeded`"""
+    if not hasattr(f, "peek"):
+        f = io.BufferedReader(f)
+
+    kind = get_archive_type(f.peek(512)[:512]) if depth < MAX_DEPTH else None
+    if kind is None:
+        if depth > 0:  # The archive itself is already searched as a normal file
+            matches, binary = search_chunks(read_chunks(f, budget), matchers, path)
+            if matches:
+                results.append((path, matches, binary))
+        return
+
+    try:
+        for name, member in iter_members(f, kind, path, budget, nested=depth > 0):
+            search_stream(member, f"{path}:{name}", matchers, depth + 1, budget, results)
+    except ARCHIVE_ERRORS:  # Corrupted or unsupported, search what was possible
+        pass
+
+
+def search_zip_member(path, name, matchers, limit):
+    """Search one member of a zip file on disk, run on a worker process. Returns the results and bytes used"""
+    budget = Budget(limit)
+    results = []
+    try:
+        with zipfile.ZipFile(path) as archive, archive.open(name) as member:
+            search_stream(member, f"{path}:{name}", matchers, 1, budget, results)
+    except ARCHIVE_ERRORS + (BudgetExceeded,):
+        pass
+    return results, budget.used
+
+
+class ArchiveSearcher:
+    def __init__(self):
+        """Search inside archives and compressed files without extracting them to disk"""
+        self.signature = f"archives depth={MAX_DEPTH} size={MAX_DECOMPRESSED}"
+        self.exceeded = []  # Archives that were too large to search completely
+
+    def search(self, path, matchers, get_pool):
+        """Search all members of the archive at `path`, returns a list of `(path, matches, binary)`.
+        Members of large zip files on disk are searched in parallel on the pool from `get_pool()`"""
+        results = []
+        try:
+            with open(path, "rb") as f:
+                kind = get_archive_type(f.read(512))
+                if kind is None:
+                    return results
+
+                if kind == "zip":
+                    with zipfile.ZipFile(f) as archive:
+                        members = [i for i in archive.infolist() if not i.is_dir() and not i.flag_bits & 0x1]
+                    if sum(i.file_size for i in members) > 16 * READ_SIZE:  # Worth the overhead of workers
+                        return self.search_zip_parallel(path, members, matchers, get_pool())
+
+                f.seek(0)
+                search_stream(f, path, matchers, 0, Budget(MAX_DECOMPRESSED), results)
+        except BudgetExceeded:
+            self.exceeded.append(path)
+        except ARCHIVE_ERRORS:
+            pass
+
+        return results
+
+    def search_zip_parallel(self, path, members, matchers, pool):
+        """Search at most one member per CPU at a time, each with a share of the `MAX_DECOMPRESSED` bytes that are not
+        handed out yet. Unused bytes come back when a member finishes, so the limit holds for the whole archive"""
+        pending = list(enumerate(members))
+        running = {}  # Future to index and allowance of a member
+        results = [[] for _ in members]
+        free = MAX_DECOMPRESSED
+        slots = os.cpu_count() or 1
+        exceeded = False
+        while pending or running:
+            while pending and len(running) < slots and free > 0:
+                i, info = pending.pop(0)
+                allowance = min(free, max(info.file_size, free // (slots - len(running))))
+                free -= allowance
+                running[pool.submit(search_zip_member, path, info.filename, matchers, allowance)] = i, allowance
+
+            if not running:  # Every byte is used up, the rest of the members can't be searched
+                exceeded = True
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                i, allowance = running.pop(future)
+                results[i], used = future.result()
+                free += allowance - min(used, allowance)
+                exceeded = exceeded or used > allowance
+
+        if exceeded:
+            self.exceeded.append(path)
+        return [result for member_results in results for result in member_results]
@@ -0,0 +1,209 @@
+import json
+import math
+import os
+import re
+from functools import lru_cache
+
+ALPHABETS = {
+    "Base32": b"ABCDEFGHIJKLMNOPQRSTUVWXYZ234567",
+    "Base64": b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/",
+    "Base64url": b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_",
+    "Base85": b"0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz!#$%&()*+-;<=>?@^_`{|}~",
+    "Ascii85": bytes(range(ord("!"), ord("u") + 1)),
+    "Base58": b"123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz",
+}
+PADDING = {"Base32": rb"=*", "Base64": rb"={0,2}", "Base64url": rb"={0,2}"}  # Regex for padding at the end
+BITS = {"Base32": 5, "Base64": 6, "Base64url": 6}  # Every character is a fixed number of bits
+GROUPS = {"Base85": (4, 5), "Ascii85": (4, 5)}  # Groups of bytes that are encoded as one big-endian number
+MIN_BITS = 24  # Alignments with fewer known bits (about 3 bytes) are too common to search for
+MAX_BODY = 128  # Base58 encodes all data as one number, the first characters depend on the length after the prefix
+
+CACHE_VERSION = 2
+CACHE_FILE = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "default", "basen-regex.json")
+_cache = None  # Loaded from `CACHE_FILE` on first use
+
+
+def to_digits(n, base, length=None):
+    """Digits of an integer in `base`, most significant first. Padded with zeros to `length`"""
+    digits = []
+    while n:
+        n, digit = divmod(n, base)
+        digits.append(digit)
+    digits += [0] * ((length or 0) - len(digits))
+    return digits[::-1]
+
+
+def char_class(alphabet, values):
+    """Regex matching any of the characters in `alphabet` at `values`, using ranges where possible"""
+    chars = sorted(alphabet[v] for v in set(values))
+    if len(chars) == 1:
+        return re.escape(chr(chars[0]))
+
+    result = ""
+    i = 0
+    while i < len(chars):
+        j = i
+        while j + 1 < len(chars) and chars[j + 1] == chars[j] + 1:
+            j += 1
+        if j - i >= 2:  # Ranges are only shorter from 3 characters
+            result += f"{re.escape(chr(chars[i]))}-{re.escape(chr(chars[j]))}"
+        else:
+            result += "".join(re.escape(chr(c)) for c in chars[i:j + 1])
+        i = j + 1
+
+    return f"[{result}]"
+
+
+def bits_alternatives(s, alphabet, bits):
+    """Yields `(skip, characters)` for `s` at every alignment of an encoding with a fixed number of bits per character.
+    `skip` characters before it are unknown, and `characters` is a list of possible values per character"""
+    n = len(s) * 8
+    value = int.from_bytes(s, "big")
+    for k in range(math.lcm(8, bits) // 8):  # Byte offset of `s` in a group of characters
+        skip, shift = divmod(k * 8, bits)  # `shift` unknown bits before `s` in the first character
+        characters = []
+        for start in range(0, shift + n, bits):
+            known_start = max(start, shift) - shift  # Bits of `s` in this character
+            known_end = min(start + bits, shift + n) - shift
+            known = (value >> (n - known_end)) & ((1 << (known_end - known_start)) - 1)
+            before = max(0, shift - start)  # Unknown bits around the known bits
+            after = start + bits - shift - known_end if start + bits > shift + n else 0
+            characters.append([(u << (bits - before)) | (known << after) | w
+                               for u in range(1 << before) for w in range(1 << after)])
+        yield skip, characters
+
+
+def group_alternatives(s, alphabet, in_size, out_size):
+    """Yields `(skip, characters)` for `s` at every alignment of an encoding of big-endian numbers (like base85).
+    The first partial group mixes unknown bytes into the whole number, so only the groups after it are used"""
+    base = len(alphabet)
+    for k in range(in_size):
+        first = (in_size - k) % in_size  # Bytes of `s` in the first partial group, which are skipped
+        if first >= len(s):
+            continue
+
+        skip = out_size if first else 0
+        characters = []
+        rest = s[first:]
+        for i in range(0, len(rest), in_size):
+            group = rest[i:i + in_size]
+            missing = in_size - len(group)
+            low = to_digits(int.from_bytes(group + b"\x00" * missing, "big"), base, out_size)
+            high = to_digits(int.from_bytes(group + b"\xff" * missing, "big"), base, out_size)
+            for a, b in zip(low, high):  # A range of numbers only fixes the digits they have in common
+                characters.append(list(range(a, b + 1)))
+                if a != b:
+                    break
+        yield skip, characters
+
+
+def number_alternatives(s, alphabet):
+    """Yields `(0, characters, size)` for `s` at the start of data encoded as one big number (like base58), for every
+    length. The digits that all numbers starting with `s` and followed by that many bytes have in common are fixed, the
+    next is a range. `size` is the number of digits of the whole encoded data"""
+    base = len(alphabet)
+    for length in range(1, MAX_BODY + 1):
+        low = to_digits(int.from_bytes(s + b"\x00" * length, "big"), base)
+        high = to_digits(int.from_bytes(s + b"\xff" * length, "big"), base)
+        if len(low) != len(high):
+            continue
+
+        characters = []
+        for a, b in zip(low, high):
+            characters.append(list(range(a, b + 1)))
+            if a != b:
+                break
+        yield 0, characters, len(low)
+
+
+def get_anchor(characters):
+    """Index and length of the longest run of fixed characters"""
+    best = (0, 0)
+    length = 0
+    for i, c in enumerate(characters):
+        length = length + 1 if len(c) == 1 else 0
+        if length > best[1]:
+            best = (i - length + 1, length)
+    return best
+
+
+def create_basen_regex(s, encoding):
+    """Create a strict regex for finding `s` encoded in `encoding` at every possible alignment.
+    Returns a tuple of the regex, its maximum length, a list of `(anchor, lead)` literals that every match contains
+    `lead` characters after its start, and the number of alignments used out of all possible.
+    Data encoded as one number is only matched as a whole token of the size it has at every length.
+    Returns `None` if no alignment is specific enough"""
+    alphabet = ALPHABETS[encoding]
+    if encoding in BITS:
+        alternatives = [(skip, characters, None) for skip, characters in bits_alternatives(s, alphabet, BITS[encoding])]
+    elif encoding in GROUPS:
+        alternatives = [(skip, characters, None)
+                        for skip, characters in group_alternatives(s, alphabet, *GROUPS[encoding])]
+    else:
+        alternatives = list(number_alternatives(s, alphabet))
+
+    any_char = char_class(alphabet, range(len(alphabet)))
+    regexes = {}
+    for skip, characters, size in alternatives:
+        index, length = get_anchor(characters)
+        if sum(math.log2(len(alphabet) / len(c)) for c in characters) < MIN_BITS or length < 2:  # Needs a literal to find
+            continue
+
+        regex = "".join(char_class(alphabet, c) for c in characters)
+        if skip:
+            regex = f"{any_char}{{{skip}}}{regex}"
+        if size:  # A whole token, the rest of it is checked without being part of the match
+            regex = f"(?<!{any_char}){regex}(?={any_char}{{{size - len(characters)}}}(?!{any_char}))"
+        anchor = bytes(alphabet[c[0]] for c in characters[index:index + length]).decode()
+        regexes[regex] = (size or skip + len(characters), anchor, skip + index)
+
+    if not regexes:
+        return None
+
+    return (f'(?:{"|".join(regexes)})', max(length for length, _, _ in regexes.values()),
+            [(anchor, lead) for _, anchor, lead in regexes.values()], len(regexes), len(alternatives))
+
+
+def load_cache():
+    global _cache
+    if _cache is None:
+        try:
+            with open(CACHE_FILE) as f:
+                _cache = json.load(f)
+            if _cache.get("version") != CACHE_VERSION:
+                raise ValueError("Outdated cache")
+        except (OSError, ValueError, AttributeError):
+            _cache = {"version": CACHE_VERSION, "regexes": {}}
+    return _cache
+
+
+def save_cache():
+    """Atomically write the cache, it is only an optimization so errors are ignored"""
+    tmp = f"{CACHE_FILE}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(CACHE_FILE), exist_ok=True)
+        with open(tmp, "w") as f:
+            json.dump(_cache, f)
+        os.replace(tmp, CACHE_FILE)
+    except OSError:
+        pass
+
+
+@lru_cache(maxsize=None)
+def get_basen_regex(s, encoding):
+    """Cached `create_basen_regex()`, in memory and on disk in `CACHE_FILE` so repeated searches don't recreate it"""
+    cache = load_cache()
+    key = f"{encoding}:{s.hex()}"
+    if key not in cache["regexes"]:
+        cache["regexes"][key] = create_basen_regex(s, encoding)
+        save_cache()
+
+    result = cache["regexes"][key]
+    return tuple(result) if result is not None else None
+
+
+if __name__ == "__main__":
+    for encoding in ALPHABETS:
+        print(encoding, create_basen_regex(b"CTF{", encoding))
+    # Base64 ('(?:Q1RGe[\\+/-9w-z]|[\\+/-9A-Za-z]{1}[0EUk]NURn[s-v]|[\\+/-9A-Za-z]{2}[159BFJNRVZdhlptx]DVEZ7)', 8,
+    #         [('Q1RGe', 0), ('NURn', 2), ('DVEZ7', 3)], 3, 3)
@@ -0,0 +1,148 @@
+import binascii
+import hashlib
+import heapq
+import html
+import re
+import zlib
+from base64 import b32decode, b64decode, urlsafe_b64decode
+from collections import OrderedDict
+from urllib.parse import unquote_to_bytes
+from default.lib.flag_search import Match, FlagMatcher
+
+MAX_DEPTH = 3  # Layers of encoding to decode
+MAX_BLOB = 1024 * 1024  # Longest encoded blob to decode
+MAX_DECODED = 16 * 1024 * 1024  # Most bytes to decompress from one zlib/gzip stream
+MAX_CACHE = 65536  # Number of decoded blobs to remember
+
+# Encoded-looking blobs, separate patterns that start with a literal byte are much faster to find than one alternation
+CANDIDATES = {
+    "zlib": re.compile(rb"\x78[\x01\x5e\x9c\xda]|\x1f\x8b\x08"),
+    "utf16": re.compile(rb"\x00(?:[\x20-\x7e]\x00){7,%d}" % (MAX_BLOB // 2)),  # Starts after the first character
+    "url": re.compile(rb"%%[0-9a-fA-F]{2}(?:[A-Za-z0-9._~+-]{0,64}%%[0-9a-fA-F]{2}){1,%d}[A-Za-z0-9._~+-]{0,64}" % (MAX_BLOB // 3)),
+    "html": re.compile(rb"&\#?[xX]?\w{1,8};(?:[^&<>\s]{0,64}&\#?[xX]?\w{1,8};){1,%d}[^&<>\s]{0,64}" % (MAX_BLOB // 4)),
+    "text": re.compile(rb"[A-Za-z0-9+/_-]{16,%d}={0,2}" % MAX_BLOB),
+}
+HEX = re.compile(rb"(?:[0-9a-fA-F]{2})+")
+BASE32 = re.compile(rb"[A-Z2-7]+=*")
+# Text before the first escape is also part of the blob, found backwards so not every offset has to be tried
+BEFORE_ESCAPE = {"url": re.compile(rb"[A-Za-z0-9._~+-]{1,64}\Z"), "html": re.compile(rb"[^&<>\s]{1,64}\Z")}
+
+DIRECT = ["Hex", "Base32", "Base64", "UTF-16LE"]  # Single layers of these are already found by the normal search
+
+CACHE = OrderedDict()  # (encoding, hash of blob, depth) -> findings, shared between all files in a process
+
+
+def pad(s, n):
+    return s + b"=" * (-len(s) % n)
+
+
+def decode_text(blob):
+    """Yields `(encoding, decoded)` for every way a run of letters and digits can be decoded"""
+    stripped = blob.rstrip(b"=")
+    if HEX.fullmatch(blob):
+        yield "Hex", bytes.fromhex(blob.decode())
+    if BASE32.fullmatch(blob):
+        try:
+            yield "Base32", b32decode(pad(stripped, 8))
+        except binascii.Error:
+            pass
+    if len(stripped) % 4 == 1:  # Not a valid length, the run probably started one character early
+        stripped = stripped[1:]
+    try:
+        if b"-" in blob or b"_" in blob:
+            yield "Base64", urlsafe_b64decode(pad(stripped, 4))
+        else:
+            yield "Base64", b64decode(pad(stripped, 4), validate=True)
+    except binascii.Error:
+        pass
+
+
+def decompress(data, offset):
+    """Decompress a zlib or gzip stream starting at `offset`, returns the compressed blob and its data"""
+    decompressor = zlib.decompressobj(wbits=47)  # Automatically detect zlib or gzip header
+    window = memoryview(data)[offset:offset + MAX_BLOB]  # Not copied, most matches of the header are random bytes
+    try:
+        decoded = decompressor.decompress(window, MAX_DECODED)
+    except zlib.error:
+        return None, None
+    if not decoded:
+        return None, None
+
+    return bytes(window[:len(window) - len(decompressor.unused_data)]), decoded
+
+
+def decode_blob(kind, blob):
+    """Yields `(encoding, decoded)` of a candidate blob found by `CANDIDATES`"""
+    if kind == "text":
+        yield from decode_text(blob)
+    elif kind == "utf16":
+        yield "UTF-16LE", blob.decode("utf-16-le").encode()
+    elif kind == "url":
+        yield "URL", unquote_to_bytes(blob)
+    elif kind == "html":
+        yield "HTML", html.unescape(blob.decode("latin-1")).encode()
+
+
+class DecodeMatcher:
+    def __init__(self, needles, context=None):
+        """Find flags hidden under multiple layers of encoding (like base64(hex(...)) or gzip(base64(...))), by
+        decoding every encoded-looking blob and searching it again, up to `MAX_DEPTH` layers deep.
+        Blobs are remembered by their hash, so duplicates in other files are only decoded once"""
+        self.matcher = FlagMatcher([n for n in needles if n.encoding == "Plain"], context=0)
+        self.context = context
+        self.signature = f"decode {self.matcher.signature} depth={MAX_DEPTH}"
+        self.max_length = MAX_BLOB
+
+    def iter_candidates(self, data, kind, start, end):
+        for m in CANDIDATES[kind].finditer(data, start):
+            offset = m.start()
+            if kind == "utf16":  # Include the first character, if the match didn't start after it
+                offset = offset - 1 if offset > 0 and 0x20 <= data[offset - 1] <= 0x7e else offset + 1
+            elif kind in BEFORE_ESCAPE:
+                before = BEFORE_ESCAPE[kind].search(data, max(0, offset - 64), offset)
+                offset = before.start() if before else offset
+            if offset >= end:
+                break
+            if offset >= start:
+                yield offset, kind, m.end()
+
+    def iter_blobs(self, data, start=0, end=None):
+        """Yields `(offset, kind, blob, decoded)` of every candidate blob starting between `start` and `end`, in order.
+        Only compressed streams are decoded here to find where they end, other blobs are decoded when needed"""
+        end = len(data) if end is None else end
+        for offset, kind, blob_end in heapq.merge(*(self.iter_candidates(data, kind, start, end) for kind in CANDIDATES)):
+            if kind == "zlib":
+                blob, decoded = decompress(data, offset)
+                if blob is not None:
+                    yield offset, "Gzip" if blob.startswith(b"\x1f") else "Zlib", blob, decoded
+            else:
+                yield offset, kind, bytes(data[offset:blob_end]), None
+
+    def analyze(self, kind, blob, decoded, depth):
+        """Get `(layers, prefix, flag)` of every flag inside a blob, remembered by the hash of the blob"""
+        key = (kind, hashlib.blake2b(blob, digest_size=16).digest(), depth)
+        if key in CACHE:
+            CACHE.move_to_end(key)
+            return CACHE[key]
+
+        findings = []
+        for encoding, inner in [(kind, decoded)] if decoded is not None else decode_blob(kind, blob):
+            findings += [((encoding,), m.prefix, m.text) for m in self.matcher.search(inner)]
+            if depth < MAX_DEPTH:
+                for _, inner_kind, inner_blob, inner_decoded in self.iter_blobs(inner):
+                    for layers, prefix, flag in self.analyze(inner_kind, inner_blob, inner_decoded, depth + 1):
+                        findings.append(((encoding,) + layers, prefix, flag))
+        findings = list(dict.fromkeys(findings))  # The same flag can be repeated in a blob
+
+        CACHE[key] = findings
+        if len(CACHE) > MAX_CACHE:
+            CACHE.popitem(last=False)
+        return findings
+
+    def search(self, data, path=None, start=0, end=None):
+        """Find all flags under layers of encoding in blobs that start between `start` and `end`"""
+        for offset, kind, blob, decoded in self.iter_blobs(data, start, end):
+            for layers, prefix, flag in self.analyze(kind, blob, decoded, 1):
+                if len(layers) == 1 and layers[0] in DIRECT:
+                    continue
+                yield Match(path, offset, " > ".join(layers), prefix, b"", flag, b"")
@@ -0,0 +1,164 @@
+import base64
+import binascii
+import os
+import queue
+import re
+import threading
+import time
+from collections import namedtuple
+
+IDLE_TIMEOUT = 5  # Seconds without queries after which a transfer is complete
+MAX_TRANSFERS = 1024  # Transfers in progress, the oldest is completed early when more start
+MAX_QUERIES = 100000  # Queries remembered per transfer
+
+SEQUENCE = re.compile(r"\d{1,6}")
+HEX = re.compile(r"(?:[0-9a-fA-F]{2})+")
+BASE32 = re.compile(r"[A-Za-z2-7]+=*")
+BASE64 = re.compile(r"[A-Za-z0-9+/_-]+=*")
+
+Payload = namedtuple("Payload", ["ip", "session", "encoding", "data", "queries", "missing", "path"])
+
+
+def printable_ratio(data):
+    return sum(32 <= c < 127 or c in b"\t\r\n" for c in data) / len(data) if data else 0
+
+
+def decode(text):
+    """Decode exfiltrated text as hex, base32 or base64, whichever gives the most printable data (preferred in that
+    order). Binary data is only recognized as hex, otherwise returns the raw text. Returns `(encoding, data)`"""
+    options = []
+    if HEX.fullmatch(text):
+        options.append(("Hex", bytes.fromhex(text)))
+    stripped = text.rstrip("=")
+    if BASE32.fullmatch(text) and len(stripped) % 8 in (0, 2, 4, 5, 7):  # DNS is case-insensitive, so base32 often is too
+        try:
+            options.append(("Base32", base64.b32decode(stripped.upper() + "=" * (-len(stripped) % 8))))
+        except binascii.Error:
+            pass
+    if BASE64.fullmatch(text) and len(stripped) % 4 != 1:
+        try:
+            options.append(("Base64", base64.urlsafe_b64decode(stripped.replace("+", "-").replace("/", "_") + "=" * (-len(stripped) % 4))))
+        except binascii.Error:
+            pass
+
+    best = max(options, key=lambda option: printable_ratio(option[1]), default=None)  # First of the highest
+    if best is not None and printable_ratio(best[1]) >= 0.9:
+        return best
+    if options and options[0][0] == "Hex":
+        return options[0]
+    return "Text", text.encode()
+
+
+class Transfer:
+    def __init__(self, ip):
+        """Queries from one client under the exfiltration domain, until it is idle"""
+        self.ip = ip
+        self.queries = {}  # Labels before the domain -> order of arrival, retries are only counted once
+        self.last = time.monotonic()
+
+    def add(self, labels):
+        if len(self.queries) < MAX_QUERIES:
+            self.queries.setdefault(labels, len(self.queries))
+        self.last = time.monotonic()
+
+    @staticmethod
+    def label(query, position):
+        """Label at a position counted from the right (next to the domain)"""
+        return query[-1 - position] if position < len(query) else None
+
+    def split(self, queries=None, session=()):
+        """Split into sessions, and get the data of each. Labels are aligned from the right (next to the domain).
+        Positions with the same value in all queries are static, and positions with only numbers that are different in
+        every query are the sequence number. Otherwise, the position with the fewest values that repeat is a session ID
+        to split by. The other positions are data. Yields `(session, data, queries, missing)` with gaps in the sequence"""
+        queries = sorted(self.queries, key=self.queries.get) if queries is None else queries
+        if len(queries) == 1:
+            yield ".".join(session), ".".join(queries[0]), 1, []
+            return
+
+        columns = [[self.label(q, p) for q in queries] for p in range(max(map(len, queries)))]
+        static = {p for p, column in enumerate(columns) if len(set(column)) == 1}
+        sequence = next((p for p, column in enumerate(columns) if None not in column and len(set(column)) == len(column)
+                         and all(SEQUENCE.fullmatch(v) for v in column)), None)
+        if sequence is None:
+            splits = [(len(set(column)), p) for p, column in enumerate(columns)
+                      if None not in column and 1 < len(set(column)) <= len(column) // 2]
+            if splits:
+                _, p = min(splits)
+                groups = {}
+                for q in queries:
+                    groups.setdefault(self.label(q, p), []).append(q)
+                for value, group in groups.items():
+                    yield from self.split(group, session + (value,))
+                return
+
+        missing = []
+        if sequence is not None:
+            numbers = {int(self.label(q, sequence)): q for q in queries}
+            queries = [numbers[n] for n in sorted(numbers)]
+            missing = sorted(set(range(min(numbers), max(numbers) + 1)) - set(numbers))
+
+        skip = static | {sequence}
+        data = "".join(label for q in queries for i, label in enumerate(q) if len(q) - 1 - i not in skip)
+        yield ".".join(session), data, len(queries), missing
+
+
+class Reassembler:
+    def __init__(self, domain, directory):
+        """Collect data exfiltrated in subdomains of `domain`, and write decoded payloads to files in `directory`
+        when a client has not sent a query for `IDLE_TIMEOUT` seconds. Files are written from a background thread"""
+        self.domain = domain.lower().strip(".")
+        self.directory = directory
+        self.transfers = {}  # IP -> Transfer
+        self.queue = queue.SimpleQueue()  # (path, data) to write
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def add(self, ip, name):
+        """Add a queried name, ignored if it is not under the exfiltration domain.
+        Returns a list of payloads, if the oldest transfer had to be completed to make room"""
+        name = name.rstrip(".")
+        if not name.lower().endswith("." + self.domain):
+            return []
+
+        completed = []
+        if ip not in self.transfers and len(self.transfers) >= MAX_TRANSFERS:
+            completed = list(self.complete(min(self.transfers.values(), key=lambda t: t.last)))
+        self.transfers.setdefault(ip, Transfer(ip)).add(tuple(name[:-len(self.domain) - 1].split(".")))
+        return completed
+
+    def complete(self, transfer):
+        """Decode and save the sessions of a transfer, yields a `Payload` for each"""
+        del self.transfers[transfer.ip]
+        for session, text, queries, missing in transfer.split():
+            if not text:
+                continue
+            encoding, data = decode(text)
+            extension = "txt" if printable_ratio(data) > 0.95 else "bin"
+            filename = f"{time.strftime('%Y%m%d-%H%M%S')}-{transfer.ip.replace(':', '_')}{'-' + session if session else ''}.{extension}"
+            path = os.path.join(self.directory, re.sub(r"[^\w.-]", "_", filename))
+            self.queue.put((path, data))
+            yield Payload(transfer.ip, session, encoding, data, queries, missing, path)
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            path, data = item
+            os.makedirs(self.directory, exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(data)
+
+    def flush(self):
+        """Complete all transfers that are idle"""
+        now = time.monotonic()
+        for transfer in [t for t in self.transfers.values() if now - t.last >= IDLE_TIMEOUT]:
+            yield from self.complete(transfer)
+
+    def close(self):
+        """Complete all transfers, even if they may still be in progress, and wait until every file is written"""
+        for transfer in list(self.transfers.values()):
+            yield from self.complete(transfer)
+        self.queue.put(None)
+        self.thread.join()
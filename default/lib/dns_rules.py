@@ -0,0 +1,143 @@
+import ipaddress
+import json
+import re
+from collections import OrderedDict
+from dnslib import DNSRecord, DNSHeader, DNSError, RR, QTYPE, A, AAAA, TXT, CNAME, MX, NS
+
+RDATA = {"A": A, "AAAA": AAAA, "TXT": TXT, "CNAME": CNAME, "MX": MX, "NS": NS}
+TXT_CHUNK = 255  # Bytes in one character-string of a TXT record, longer answers are split into several
+MAX_NAMES = 65536  # Names a rebinding rule remembers the query count of, the least recently queried are forgotten
+
+"""Example rules file, a list of rules that are tried from most to least specific name:
+[
+    {"name": "exact.example.com", "type": "TXT", "answer": "some text"},
+    {"name": "*.example.com", "type": "A", "answer": ["1.2.3.4", "5.6.7.8"]},
+    {"name": "rebind.example.com", "type": "A", "answer": ["1.2.3.4", "127.0.0.1"], "rebind": true},
+    {"regex": "[0-9a-f]+\\.data\\.example\\.com", "type": "MX", "answer": "10 mail.example.com", "ttl": 60}
+]
+"""
+
+
+class Rule:
+    def __init__(self, rule):
+        """One rule from a rules file, raises `ValueError` if it is invalid"""
+        if not isinstance(rule, dict) or ("name" in rule) == ("regex" in rule):
+            raise ValueError(f"Rule needs either a 'name' or 'regex': {rule!r}")
+
+        self.name = rule.get("name")
+        self.regex = re.compile(rule["regex"], re.IGNORECASE) if "regex" in rule else None
+        self.type = rule.get("type", "A").upper()
+        if self.type not in RDATA:
+            raise ValueError(f"Unsupported type {self.type!r}, use one of {', '.join(RDATA)}")
+
+        answers = rule.get("answer")
+        answers = answers if isinstance(answers, list) else [answers]
+        self.answers = [self.create_rdata(answer) for answer in answers]
+        self.rebind = bool(rule.get("rebind"))
+        self.ttl = 0 if self.rebind else int(rule.get("ttl", 0))  # Rebinding only works if clients don't cache
+        self.count = OrderedDict()  # Number of queries per name, to rotate rebinding answers
+
+    def create_rdata(self, answer):
+        if not isinstance(answer, str):
+            raise ValueError(f"Answer for {self.type} needs to be a string: {answer!r}")
+        try:
+            if self.type == "A":
+                return A(str(ipaddress.IPv4Address(answer)))
+            elif self.type == "AAAA":
+                return AAAA(str(ipaddress.IPv6Address(answer)))
+            elif self.type == "MX":
+                preference, _, name = answer.rpartition(" ")
+                return MX(name, int(preference or 10))
+            elif self.type == "TXT":
+                data = answer.encode()
+                return TXT([data[i:i + TXT_CHUNK] for i in range(0, len(data), TXT_CHUNK)] or [b""])
+            else:
+                return RDATA[self.type](answer)
+        except (ValueError, DNSError) as e:
+            raise ValueError(f"Invalid {self.type} answer {answer!r}: {e}")
+
+    def get_answers(self, name):
+        """Answers for a query. Rebinding rotates through them for every query of the same name"""
+        if not self.rebind:
+            return self.answers
+
+        count = self.count.pop(name, 0)
+        self.count[name] = count + 1  # Most recently queried last
+        if len(self.count) > MAX_NAMES:
+            self.count.popitem(last=False)
+        return [self.answers[count % len(self.answers)]]
+
+
+class Zone:
+    def __init__(self, rules):
+        """Answers queries by a list of rules, from most to least specific: exact names, wildcard names ('*.example.com')
+        with the longest suffix, regexes in order, and finally the '*' wildcard. The names are stored in a trie of
+        labels from right to left, so a lookup only walks the labels of the query"""
+        self.trie = {}  # Label -> child node, with "" -> {type: rule} for exact and "*" -> {type: rule} for wildcards
+        self.regexes = []
+        self.fallback = {}  # Type -> rule for the '*' wildcard
+
+        for rule in map(Rule, rules):
+            if rule.regex is not None:
+                self.regexes.append(rule)
+                continue
+
+            labels = rule.name.lower().rstrip(".").split(".")
+            if labels == ["*"]:
+                self.fallback.setdefault(rule.type, rule)
+                continue
+            if "*" in labels[1:]:
+                raise ValueError(f"Wildcard '*' can only be the first label, use a regex instead: {rule.name!r}")
+
+            node = self.trie
+            for label in reversed(labels[1:] if labels[0] == "*" else labels):
+                node = node.setdefault(label, {})
+            node.setdefault("*" if labels[0] == "*" else "", {}).setdefault(rule.type, rule)
+
+    @staticmethod
+    def choose(rules, qtype):
+        """A CNAME applies to every type that doesn't have its own rule"""
+        if rules is not None:
+            return rules.get(qtype) or rules.get("CNAME")
+
+    def lookup(self, name, qtype):
+        """Get the rule for a name (without trailing dot) and type, or `None`"""
+        name = name.lower()
+        node = self.trie
+        found = None
+        for label in reversed(name.split(".")):
+            found = self.choose(node.get("*"), qtype) or found  # Wildcard of the suffix before this label
+            node = node.get(label)
+            if node is None:
+                break
+        else:
+            found = self.choose(node.get(""), qtype) or found  # Exact name is the most specific
+        if found is not None:
+            return found
+
+        for rule in self.regexes:
+            if (rule.type == qtype or rule.type == "CNAME") and rule.regex.fullmatch(name):
+                return rule
+
+        return self.choose(self.fallback, qtype)
+
+    def resolve(self, request):
+        """Create a reply to a request. Returns the reply and if it may be cached, which is not the case for rebinding"""
+        reply = DNSRecord(DNSHeader(id=request.header.id, qr=1, aa=1, ra=1), q=request.q)
+        name = str(request.q.qname).rstrip(".")
+        rule = self.lookup(name, QTYPE.get(request.q.qtype))
+        if rule is None:
+            return reply, True
+
+        for rdata in rule.get_answers(name.lower()):
+            reply.add_answer(RR(request.q.qname, QTYPE.reverse[rule.type], rdata=rdata, ttl=rule.ttl))
+        return reply, not rule.rebind
+
+
+def load_rules(path):
+    """Load a JSON list of rules, raises `ValueError` if it is invalid"""
+    with open(path) as f:
+        rules = json.load(f)
+    if not isinstance(rules, list):
+        raise ValueError("Rules file needs to contain a list of rules")
+    return rules
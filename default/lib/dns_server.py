@@ -0,0 +1,159 @@
+import asyncio
+import socket
+import struct
+import time
+from collections import namedtuple, OrderedDict
+from dnslib import DNSRecord, DNSError, QTYPE
+
+UDP_SIZE = 512  # Maximum size of a reply over UDP, unless the client advertises a larger one with EDNS
+MAX_UDP_SIZE = 4096
+TCP_TIMEOUT = 10  # Seconds an idle TCP connection is kept open
+MAX_CACHE = 65536  # Number of packed replies to remember
+
+Query = namedtuple("Query", ["time", "protocol", "ip", "port", "name", "type", "answers", "request", "reply"])
+
+
+def parse_query(data):
+    """Quickly parse a standard query with one question without dnslib, for looking up cached replies.
+    Returns `(question, udp_size)` where `question` is the raw name, type and class, or `None` for anything else"""
+    if len(data) < 17:
+        return None
+    flags, questions, answers, authorities, additionals = struct.unpack_from("!HHHHH", data, 2)
+    if flags & 0xf800 or questions != 1 or answers or authorities or additionals > 1:  # Needs QR and opcode 0
+        return None
+
+    offset = 12
+    while data[offset]:
+        if data[offset] > 63:  # Compression pointer, not expected in a question
+            return None
+        offset += data[offset] + 1
+        if offset >= len(data):
+            return None
+    end = offset + 5  # Root label, type and class
+    if end > len(data):
+        return None
+
+    udp_size = UDP_SIZE
+    if additionals:
+        if data[end:end + 3] != b"\x00\x00\x29" or len(data) < end + 5:  # Only an EDNS OPT record is expected
+            return None
+        udp_size = min(max(struct.unpack_from("!H", data, end + 3)[0], UDP_SIZE), MAX_UDP_SIZE)
+    return data[12:end], udp_size
+
+
+def get_udp_size(request):
+    """Maximum reply size the client accepts over UDP, from the EDNS OPT record"""
+    for rr in request.ar:
+        if rr.rtype == 41:  # OPT, the class is the UDP payload size
+            return min(max(rr.rclass, UDP_SIZE), MAX_UDP_SIZE)
+    return UDP_SIZE
+
+
+def truncate(reply):
+    """Keep only the header and question of a packed reply, with the TC bit set so the client retries over TCP"""
+    offset = 12
+    while reply[offset]:  # Labels of the question name
+        offset += reply[offset] + 1
+    offset += 5  # Root label, type and class
+    flags = struct.unpack_from("!H", reply, 2)[0] | 0x0200
+    return reply[:2] + struct.pack("!HHHHH", flags, 1, 0, 0, 0) + reply[12:offset]
+
+
+class UDPProtocol(asyncio.DatagramProtocol):
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        reply = self.server.handle(data, addr, "udp")
+        if reply is not None:
+            self.transport.sendto(reply, addr)
+
+    def error_received(self, exc):  # ICMP errors from clients that went away
+        pass
+
+
+class DNSServer:
+    def __init__(self, resolve, on_query=None):
+        """Asynchronous DNS server over UDP and TCP. `resolve(request)` creates a `DNSRecord` reply for a request and
+        returns it with whether it may be cached. `on_query(query)` is called with a `Query` for every answered request.
+        Packed replies are cached by their question, so repeated queries only need the transaction ID replaced"""
+        self.resolve = resolve
+        self.on_query = on_query
+        self.cache = OrderedDict()  # Raw question -> (packed reply, name, type, answers)
+        self.servers = []
+        self.transports = []
+
+    def create_reply(self, data):
+        """Resolve a packed request with dnslib, returns `(packed reply, name, type, answers, udp_size, cacheable)`"""
+        try:
+            request = DNSRecord.parse(data)
+        except (DNSError, IndexError, ValueError):
+            return None
+        if request.header.qr or not request.questions:  # Not a query
+            return None
+
+        reply, cacheable = self.resolve(request)
+        answers = [str(rr.rdata) for rr in reply.rr]
+        return reply.pack(), str(request.q.qname), str(QTYPE.get(request.q.qtype)), answers, get_udp_size(request), cacheable
+
+    def handle(self, data, addr, protocol):
+        """Get the packed reply to a packed request, or `None` if it is invalid"""
+        query = parse_query(data)
+        if query is not None and query[0] in self.cache:
+            self.cache.move_to_end(query[0])
+            reply, name, qtype, answers = self.cache[query[0]]
+            reply = data[:2] + reply[2:]  # Transaction ID of this request
+            udp_size = query[1]
+        else:
+            result = self.create_reply(data)
+            if result is None:
+                return None
+            reply, name, qtype, answers, udp_size, cacheable = result
+            if cacheable and query is not None:
+                self.cache[query[0]] = (reply, name, qtype, answers)
+                if len(self.cache) > MAX_CACHE:
+                    self.cache.popitem(last=False)
+
+        if protocol == "udp" and len(reply) > udp_size:
+            reply = truncate(reply)
+
+        if self.on_query is not None:
+            self.on_query(Query(time.time(), protocol, addr[0], addr[1], name, qtype, answers, data, reply))
+        return reply
+
+    async def handle_tcp(self, reader, writer):
+        """TCP messages are prefixed with their length, and a connection can contain multiple"""
+        addr = writer.get_extra_info("peername")
+        try:
+            while True:
+                length, = struct.unpack("!H", await asyncio.wait_for(reader.readexactly(2), TCP_TIMEOUT))
+                data = await asyncio.wait_for(reader.readexactly(length), TCP_TIMEOUT)
+                reply = self.handle(data, addr, "tcp")
+                if reply is None:
+                    break
+                writer.write(struct.pack("!H", len(reply)) + reply)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, asyncio.CancelledError, ConnectionError):  # Also at shutdown
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, sockets):
+        """Start serving on sockets from `bind_sockets()`"""
+        loop = asyncio.get_running_loop()
+        for sock in sockets:
+            if sock.type == socket.SOCK_DGRAM:
+                transport, _ = await loop.create_datagram_endpoint(lambda: UDPProtocol(self), sock=sock)
+                self.transports.append(transport)
+            else:
+                self.servers.append(await asyncio.start_server(self.handle_tcp, sock=sock))
+
+    def close(self):
+        for transport in self.transports:
+            transport.close()
+        for server in self.servers:
+            server.close()
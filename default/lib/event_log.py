@@ -0,0 +1,73 @@
+import json
+import queue
+import threading
+
+MAX_QUEUE = 100000  # Events waiting to be written, more are dropped instead of blocking or using all memory
+MAX_BATCH = 1000  # Events written at once
+CORRELATION_WINDOW = 300  # Seconds between events from one IP to consider them related
+MAX_GROUPS = 100000  # Source IPs to remember for correlation
+
+
+class EventLog:
+    def __init__(self, path):
+        """Append-only JSON Lines log, written in batches by a background thread so `write()` never blocks"""
+        self.path = path
+        self.file = open(path, "a")
+        self.queue = queue.Queue(MAX_QUEUE)
+        self.dropped = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def write(self, event):
+        """Queue a dictionary to be written as one line"""
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+
+    def run(self):
+        stop = False
+        while not stop:
+            batch = [self.queue.get()]  # Wait for the first, then take everything that is already queued
+            while len(batch) < MAX_BATCH:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:  # Stop after writing everything before it
+                batch = batch[:batch.index(None)]
+                stop = True
+
+            self.file.write("".join(json.dumps(event, default=str) + "\n" for event in batch))
+            self.file.flush()
+
+    def close(self):
+        """Write the remaining events and close the file"""
+        self.queue.put(None)
+        self.thread.join()
+        self.file.close()
+
+
+class Correlator:
+    def __init__(self, window=CORRELATION_WINDOW):
+        """Group events from the same source IP that happen within `window` seconds of each other, across protocols"""
+        self.window = window
+        self.groups = {}  # IP -> [group ID, time of the last event, {protocol: time of its first event}]
+        self.next_id = 1
+
+    def add(self, ip, protocol, time):
+        """Returns the group ID of an event, and `{protocol: time}` of the other protocols in the group if this is the
+        first event of its protocol in the group (otherwise empty)"""
+        group = self.groups.get(ip)
+        if group is None or time - group[1] > self.window:
+            if len(self.groups) > MAX_GROUPS:  # Forget groups that ended
+                self.groups = {k: v for k, v in self.groups.items() if time - v[1] <= self.window}
+            group = self.groups[ip] = [self.next_id, time, {}]
+            self.next_id += 1
+        group[1] = time
+
+        others = {}
+        if protocol not in group[2]:
+            others = dict(group[2])
+            group[2][protocol] = time
+        return group[0], others
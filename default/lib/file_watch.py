@@ -0,0 +1,159 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from abc import ABC, abstractmethod
+from default.lib.flag_search import walk_files
+
+DEBOUNCE = 0.5  # Seconds a file needs to be unchanged before it is searched, while it is still being written
+POLL_INTERVAL = 2  # Seconds between walks of the whole directory when inotify is not available
+
+# From <sys/inotify.h>
+IN_MODIFY = 0x2
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+EVENT = struct.Struct("iIII")  # wd, mask, cookie, len, followed by a name of len bytes
+
+
+class Watcher(ABC):
+    def __init__(self, root, ignore=()):
+        """Base class for watching `root` for new and modified files, collects changes until they are quiet"""
+        self.root = root
+        self.ignore = ignore
+        self.changed = {}  # Path -> time of the last change
+
+    def mark(self, path):
+        if os.path.basename(path) not in self.ignore:
+            self.changed[path] = time.monotonic()
+
+    def mark_tree(self, root):
+        for path in walk_files(root, self.ignore):
+            self.mark(path)
+
+    @abstractmethod
+    def wait(self, timeout):
+        """Wait at most `timeout` seconds for changes, and mark them"""
+
+    def poll(self, timeout):
+        """Get a sorted list of changed files that were not written to for `DEBOUNCE` seconds,
+        waiting at most `timeout` seconds (or less if a file will be quiet sooner)"""
+        if self.changed:
+            timeout = min(timeout, max(0, min(self.changed.values()) + DEBOUNCE - time.monotonic()))
+        self.wait(timeout)
+
+        now = time.monotonic()
+        ready = sorted(path for path, changed in self.changed.items() if now - changed >= DEBOUNCE)
+        for path in ready:
+            del self.changed[path]
+        return ready
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(Watcher):
+    MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+    def __init__(self, root, ignore=()):
+        """Watch with Linux inotify through libc, raises `OSError` if it is not available"""
+        super().__init__(root, ignore)
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        if not hasattr(self.libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.directories = {}  # Watch descriptor -> directory
+        try:
+            self.add_tree(root)
+        except OSError:
+            self.close()
+            raise
+
+    def add_tree(self, root):
+        """Watch a directory and all subdirectories. Raises `OSError` if the limit of watches is reached"""
+        for directory, dirs, _ in os.walk(root):
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), self.MASK)
+            if wd < 0:
+                errno = ctypes.get_errno()
+                if errno == 28:  # ENOSPC, too many watches (see /proc/sys/fs/inotify/max_user_watches)
+                    raise OSError(errno, "Limit of inotify watches reached")
+                continue  # Removed in the meantime
+            self.directories[wd] = directory
+
+    def wait(self, timeout):
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return
+
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT.unpack_from(data, offset)
+            name = data[offset + EVENT.size:offset + EVENT.size + length].rstrip(b"\0")
+            offset += EVENT.size + length
+
+            if mask & IN_Q_OVERFLOW:  # Events were lost, check everything again
+                self.mark_tree(self.root)
+            elif mask & IN_IGNORED:  # Directory was removed
+                self.directories.pop(wd, None)
+            elif wd in self.directories:
+                path = os.path.join(self.directories[wd], os.fsdecode(name))
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):  # Files may be written before the watch is added
+                        self.add_tree(path)
+                        self.mark_tree(path)
+                elif not os.path.islink(path):
+                    self.mark(path)
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher(Watcher):
+    def __init__(self, root, ignore=()):
+        """Watch by walking the directory every `POLL_INTERVAL` seconds, and comparing sizes and modification times"""
+        super().__init__(root, ignore)
+        self.files = self.snapshot()
+        self.last_poll = time.monotonic()
+
+    def snapshot(self):
+        files = {}
+        for path in walk_files(self.root, self.ignore):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files[path] = (stat.st_size, stat.st_mtime_ns)
+        return files
+
+    def wait(self, timeout):
+        time.sleep(max(0, min(timeout, self.last_poll + POLL_INTERVAL - time.monotonic())))
+        if time.monotonic() - self.last_poll < POLL_INTERVAL:
+            return
+
+        files = self.snapshot()
+        self.last_poll = time.monotonic()
+        for path, state in files.items():
+            if self.files.get(path) != state:
+                self.mark(path)
+        self.files = files
+
+
+def create_watcher(root, ignore=()):
+    """Watch `root` with inotify if possible, otherwise by polling"""
+    try:
+        return InotifyWatcher(root, ignore)
+    except (OSError, AttributeError):
+        return PollingWatcher(root, ignore)
@@ -0,0 +1,351 @@
+import mmap
+import os
+import re
+import signal
+import time
+import numpy as np
+from collections import defaultdict, namedtuple
+from itertools import product
+from concurrent.futures import ProcessPoolExecutor
+from default.lib.basen_search import ALPHABETS, PADDING, char_class, get_basen_regex
+
+MAX_TAIL = 256  # Maximum number of bytes after an encoded prefix that are included in a match
+MAX_LINE = 200  # Maximum number of bytes shown around a match if no context is given
+CHUNK_SIZE = 64 * 1024 * 1024  # Files larger than this are memory-mapped and scanned in chunks on a process pool
+BLOCK_SIZE = 1024 * 1024  # Offsets looked up at once when finding anchors
+INDEX_SAVE_INTERVAL = 30  # Seconds between saves of the index while watching
+
+# One encoded form of a flag prefix, `regex` is the bounded head that is searched for.
+# Every match of it contains one of the literal `anchors`, as `(anchor, lead)` with `lead` bytes before it in the match
+Needle = namedtuple("Needle", ["encoding", "prefix", "description", "regex", "max_length", "anchors"])
+# A found flag, `text` is the head with its tail, `before` and `after` are the context around it
+Match = namedtuple("Match", ["path", "offset", "encoding", "prefix", "before", "text", "after"])
+
+TAILS = {  # What can follow the head of every encoding, used to extend a match to the full flag
+    "Plain": re.compile(rb"[^}\n]{0,%d}\}?" % MAX_TAIL),
+    "Hex": re.compile(rb"[0-9a-f]{0,%d}" % MAX_TAIL),
+    "UTF-16LE": re.compile(rb"(?:[^\x00}\n]\x00){0,%d}(?:\}\x00)?" % MAX_TAIL),
+    "UTF-16BE": re.compile(rb"(?:\x00[^\x00}\n]){0,%d}(?:\x00\})?" % MAX_TAIL),
+    "UTF-32LE": re.compile(rb"(?:[^\x00}\n]\x00\x00\x00){0,%d}(?:\}\x00\x00\x00)?" % MAX_TAIL),
+    "UTF-32BE": re.compile(rb"(?:\x00\x00\x00[^\x00}\n]){0,%d}(?:\x00\x00\x00\})?" % MAX_TAIL),
+    **{encoding: re.compile(b"%s{0,%d}%s" % (char_class(alphabet, range(len(alphabet))).encode(), MAX_TAIL,
+                                             PADDING.get(encoding, b"")))
+       for encoding, alphabet in ALPHABETS.items()},
+}
+WIDE = {"UTF-16LE": 2, "UTF-16BE": 2, "UTF-32LE": 4, "UTF-32BE": 4}  # Bytes per character of wide encodings
+WIDE_TEXT = set(range(0x20, 0x7f)) | set(b"\t\n\r")  # Characters a wide string is followed through to find its padding
+
+
+def get_case_variants(s):
+    """All combinations of upper and lowercase letters in `s`"""
+    return sorted({b"".join(v) for v in product(*[{bytes([c]).lower(), bytes([c]).upper()} for c in s])})
+
+
+def get_needles(prefix):
+    """Get all encoded forms of a flag prefix (like 'CTF{') to search for"""
+    needles = []
+    encoded = prefix.encode()
+
+    def add_literal(encoding, s):
+        needles.append(Needle(encoding, prefix, repr(s.decode()), re.escape(s), len(s), ((s, 0),)))
+
+    def add_any_case(encoding, s, description):
+        # Anchors are every case of the first few bytes, so `prefix` and `prefix.upper()` result in the same needle
+        anchors = tuple((variant, 0) for variant in get_case_variants(s[:4]))
+        needles.append(Needle(encoding, prefix, f"{description} (any case)", b"(?i:%s)" % re.escape(s.lower()), len(s),
+                              anchors))
+
+    add_any_case("Plain", encoded, repr(prefix))
+    add_any_case("Reversed", encoded[::-1], repr(prefix[::-1]))
+    add_literal("Hex", encoded.hex().encode())
+    for encoding in ALPHABETS:  # At every alignment, with as many known characters as possible
+        result = get_basen_regex(encoded, encoding)
+        if result is None:  # Prefix too short
+            continue
+
+        regex, max_length, anchors, found, total = result
+        if encoding == "Base58":
+            description = "(whole tokens)"
+        else:
+            description = "(all offsets)" if found == total else f"({found} of {total} offsets)"
+        needles.append(Needle(encoding, prefix, description, regex.encode(), max_length,
+                              tuple((anchor.encode(), lead) for anchor, lead in anchors)))
+    for encoding in WIDE:  # Strings in Windows memory, .NET binaries, etc.
+        add_any_case(encoding, prefix.encode(encoding), repr(prefix))
+
+    return needles
+
+
+def is_binary(data):
+    """Same heuristic as grep: a NULL byte in the first few kilobytes means a binary file"""
+    return b"\0" in data[:8192]
+
+
+class FlagMatcher:
+    def __init__(self, needles, context=None):
+        """Search for all needles in a single pass. The first bytes of every anchor are looked up in a table for a whole
+        block of offsets at once with NumPy, only where they are found the regex of the needle is tried
+
+        context: number of bytes to return around a match, or None for the surrounding line (at most `MAX_LINE`)"""
+        # Prefixes that only differ in case have the same case-insensitive needles, which only need to be searched once
+        unique = {}
+        for needle in needles:
+            unique.setdefault((needle.encoding, needle.regex), needle)
+        self.needles = list(unique.values())
+        self.context = context
+        self.regexes = [re.compile(n.regex) for n in self.needles]
+        self.signature = f"{b'|'.join(n.regex for n in self.needles)!r} context={context}"
+        # Length of the longest possible head, chunks overlap by this much so no match is lost on a boundary
+        self.max_length = max(n.max_length for n in self.needles)
+
+        self.width = min(4, min(len(anchor) for n in self.needles for anchor, _ in n.anchors))  # Bytes looked up per offset
+        self.anchors = defaultdict(list)  # First bytes -> [(anchor, needle index, lead)]
+        for i, needle in enumerate(self.needles):
+            for anchor, lead in needle.anchors:
+                self.anchors[anchor[:self.width]].append((anchor, i, lead))
+        self.max_lead = max(lead for n in self.needles for _, lead in n.anchors)
+
+        # First two bytes are looked up directly, the rest of the first bytes are compared for those offsets
+        self.table = np.zeros(256 ** min(2, self.width), dtype=bool)
+        self.table[[int.from_bytes(head[:2], "little") for head in self.anchors]] = True
+        self.heads = np.array([int.from_bytes(head, "little") for head in self.anchors], dtype=np.uint32)
+
+    def find_anchors(self, data, start, end):
+        """Yields offsets between `start` and `end` where the first bytes of any anchor are found"""
+        for block_start in range(start, end, BLOCK_SIZE):
+            count = min(block_start + BLOCK_SIZE, end) - block_start
+            view = np.frombuffer(data, dtype=np.uint8, count=min(len(data), block_start + count + 3) - block_start,
+                                 offset=block_start)
+            if len(view) < count + 3:  # End of data, pad so the first bytes can be read at all offsets
+                view = np.concatenate([view, np.zeros(count + 3 - len(view), dtype=np.uint8)])
+
+            if self.width >= 2:
+                index = np.flatnonzero(self.table[view[:count] | (view[1:count + 1].astype(np.uint16) << 8)])
+            else:
+                index = np.flatnonzero(self.table[view[:count]])
+            if self.width > 2:
+                heads = sum(view[index + j].astype(np.uint32) << (8 * j) for j in range(self.width))
+                index = index[np.isin(heads, self.heads)]
+
+            yield from (index + block_start).tolist()
+
+    def extend(self, data, needle, start, end):
+        """Extend the head of a match over the rest of the flag"""
+        if needle.encoding == "Reversed":  # Flag is in front of the prefix, up to the closing } (reversed {)
+            close = data.rfind(b"}", max(0, start - MAX_TAIL), start)
+            newline = data.rfind(b"\n", max(0, start - MAX_TAIL), start)
+            if close > newline:
+                start = close
+        elif needle.encoding in TAILS:
+            end = TAILS[needle.encoding].match(data, end).end()
+
+        return start, end
+
+    def surround(self, data, start, end):
+        """Get the bounded context around a match"""
+        if self.context is not None:
+            return data[max(0, start - self.context):start], data[end:end + self.context]
+
+        line_start = data.rfind(b"\n", max(0, start - MAX_LINE), start) + 1 or max(0, start - MAX_LINE)
+        line_end = data.find(b"\n", end, end + MAX_LINE)
+        if line_end == -1:
+            line_end = end + MAX_LINE
+
+        return data[line_start:start], data[end:line_end]
+
+    def wide_byte_order(self, data, start, width):
+        """Byte order of wide text from the NUL padding around the whole string that has a character at `start`: before
+        its first character in big-endian, after its last in little-endian. `None` if both or neither are padded"""
+        padding = bytes(width - 1)
+        first = last = start
+        while (start - first < MAX_LINE and first >= width and data[first - width] in WIDE_TEXT
+               and data[first - width + 1:first] == padding):
+            first -= width
+        while (last - start < MAX_LINE and last + width < len(data) and data[last + width] in WIDE_TEXT
+               and data[last + 1:last + width] == padding):
+            last += width
+        before = first >= width - 1 and data[first - width + 1:first] == padding
+        after = data[last + 1:last + width] == padding
+        return None if before == after else "BE" if before else "LE"
+
+    def is_other_order(self, data, found, start, prefix, encoding):
+        """Wide text in one byte order also matches the other one `width - 1` bytes away, keep only the real one. That is
+        decided by the NUL padding around the string, or else the alignment to the character width"""
+        width = WIDE[encoding]
+        big_endian = start if encoding.endswith("BE") else start - width + 1
+        other = big_endian + width - 1 if encoding.endswith("BE") else big_endian
+        match = found.get((other, prefix))
+        if match is None or self.needles[match[0]].encoding != encoding[:-2] + ("LE" if encoding.endswith("BE") else "BE"):
+            return False
+        order = self.wide_byte_order(data, big_endian + width - 1, width) or ("BE" if big_endian % width == 0 else "LE")
+        return not encoding.endswith(order)
+
+    def search(self, data, path=None, start=0, end=None):
+        """Find all matches in `data` that start between `start` and `end`. Tails and context may extend past `end`"""
+        end = len(data) if end is None else end
+        found = {}  # (start, prefix) -> (needle index, end)
+        for offset in self.find_anchors(data, start, min(len(data), end + self.max_lead)):
+            for anchor, i, lead in self.anchors[data[offset:offset + self.width]]:
+                match_start = offset - lead
+                if not start <= match_start < end or data[offset:offset + len(anchor)] != anchor:
+                    continue
+
+                m = self.regexes[i].match(data, match_start)
+                key = (match_start, self.needles[i].prefix)
+                if m and (key not in found or i < found[key][0]):  # Same text in multiple encodings, keep the first
+                    found[key] = (i, m.end())
+
+        for (match_start, prefix), (i, match_end) in sorted(found.items()):
+            needle = self.needles[i]
+            if needle.encoding in WIDE and self.is_other_order(data, found, match_start, prefix, needle.encoding):
+                continue
+
+            match_start, match_end = self.extend(data, needle, match_start, match_end)
+            before, after = self.surround(data, match_start, match_end)
+            yield Match(path, match_start, needle.encoding, needle.prefix, before, data[match_start:match_end], after)
+
+
+def walk_files(root, ignore=()):
+    """Recursively yield all regular files in `root`, sorted like `grep -r`. Filenames in `ignore` are skipped"""
+    if os.path.isfile(root):
+        yield root
+        return
+
+    for directory, dirs, files in os.walk(root):
+        dirs.sort()
+        for filename in sorted(files):
+            if filename in ignore:
+                continue
+
+            path = os.path.join(directory, filename)
+            if os.path.isfile(path) and not os.path.islink(path):
+                yield path
+
+
+def search_file(path, matchers):
+    """Search a single file with all matchers. Returns the matches and if it is a binary file"""
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return [], False
+
+    return [match for matcher in matchers for match in matcher.search(data, path)], is_binary(data)
+
+
+def get_chunks(size, chunk_size=CHUNK_SIZE):
+    """Split `size` bytes into `(start, end)` ranges. A match belongs to the chunk it starts in"""
+    return [(start, min(start + chunk_size, size)) for start in range(0, size, chunk_size)]
+
+
+def search_chunk(path, matchers, start, end):
+    """Search one chunk of a memory-mapped file, the rest of the file is only touched for overlap and context"""
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        return [match for matcher in matchers for match in matcher.search(data, path, start, end)]
+
+
+def search_large_file(path, matchers, pool):
+    """Search a large file in parallel chunks on `pool`. Returns the matches and if it is a binary file"""
+    try:
+        size = os.path.getsize(path)
+        with open(path, "rb") as f:
+            binary = is_binary(f.read(8192))
+    except OSError:
+        return [], False
+
+    futures = [pool.submit(search_chunk, path, matchers, start, end) for start, end in get_chunks(size)]
+    return [match for future in futures for match in future.result()], binary
+
+
+def ignore_interrupt():
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def create_pool():
+    """Process pool for searching, Ctrl+C is only handled by the main process"""
+    return ProcessPoolExecutor(initializer=ignore_interrupt)
+
+
+def search_tree(root, matchers, index=None, ignore=(), archives=None):
+    """Walk `root` once and search every file with all matchers. Yields `(path, matches, binary)` for files, and members
+    of archives, with matches
+
+    index: a `ScanIndex` to reuse results of unchanged files from, and to store new results in
+    archives: an `ArchiveSearcher` to also search inside archives and compressed files"""
+    pool = None
+
+    def get_pool():
+        nonlocal pool
+        if pool is None:  # Only start workers once they are needed
+            pool = create_pool()
+        return pool
+
+    try:
+        for path in walk_files(root, ignore):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+
+            results = index.lookup(path, stat) if index is not None else None
+            if results is None:
+                if stat.st_size > CHUNK_SIZE:
+                    matches, binary = search_large_file(path, matchers, get_pool())
+                else:
+                    matches, binary = search_file(path, matchers)
+                results = finish_file(path, stat, matches, binary, matchers, get_pool, index, archives)
+
+            for result_path, matches, binary in results:
+                if matches:
+                    yield result_path, matches, binary
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+
+def finish_file(path, stat, matches, binary, matchers, get_pool, index, archives):
+    """Add results from inside archives to the matches of a file, and store them in the index"""
+    results = [(path, matches, binary)]
+    if archives is not None:
+        results += archives.search(path, matchers, get_pool)
+    if index is not None:
+        index.store(path, stat, results)
+    return results
+
+
+def watch_tree(watcher, matchers, index=None, archives=None):
+    """Search new and modified files from `watcher` as they are written, on a process pool. Yields `(path, matches,
+    binary)` like `search_tree()` every time a file with matches is searched, until interrupted"""
+    pool = create_pool()
+    pending = {}  # Future -> (path, stat)
+    last_save = time.monotonic()
+    try:
+        while True:
+            for path in watcher.poll(0.1 if pending else 1):  # Check finished searches often
+                try:
+                    stat = os.stat(path)
+                except OSError:  # Removed again
+                    continue
+
+                results = index.lookup(path, stat) if index is not None else None
+                if results is not None:
+                    yield from (result for result in results if result[1])
+                elif stat.st_size > CHUNK_SIZE:
+                    matches, binary = search_large_file(path, matchers, pool)
+                    results = finish_file(path, stat, matches, binary, matchers, lambda: pool, index, archives)
+                    yield from (result for result in results if result[1])
+                else:
+                    pending[pool.submit(search_file, path, matchers)] = (path, stat)
+
+            for future in [f for f in pending if f.done()]:
+                path, stat = pending.pop(future)
+                matches, binary = future.result()
+                results = finish_file(path, stat, matches, binary, matchers, lambda: pool, index, archives)
+                yield from (result for result in results if result[1])
+
+            if index is not None and time.monotonic() - last_save > INDEX_SAVE_INTERVAL:
+                index.save()
+                last_save = time.monotonic()
+    finally:
+        watcher.close()
+        pool.shutdown(cancel_futures=True)
@@ -0,0 +1,199 @@
+import hashlib
+import html
+import json
+import os
+import random
+import re
+import string
+import time
+from urllib.parse import quote
+
+CACHE_VERSION = 1
+CACHE_FILE = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "default", "fuzz-calibration.json")
+CACHE_TTL = 24 * 60 * 60  # Seconds a calibration is reused for the same host, scheme and mode
+MIN_REFLECTION = 6  # Shorter inputs are not removed from bodies, because they can be part of any text
+NUMBERS = re.compile(rb"\d+")
+
+
+def random_word(length):
+    return "".join(random.choice(string.ascii_letters) for _ in range(length))
+
+
+def sample_words(mode):
+    """Random inputs that can't exist, in the shapes that servers often answer differently (dotfiles, directories and
+    extensions for content)"""
+    words = [random_word(length) for length in range(10, 26)]
+    if mode.startswith("content"):
+        words += ["." + random_word(12), "." + random_word(16), random_word(12) + "/", random_word(16) + "/",
+                  random_word(12) + ".php", random_word(16) + ".php", random_word(12) + ".html", random_word(12) + ".txt",
+                  "admin" + random_word(10), random_word(12) + "~"]
+    return words
+
+
+def reflections(response):
+    """Forms of the inputs of a request that may be reflected in the response"""
+    forms = set()
+    for value in response.request.input.values():
+        forms.update({value, quote(value), html.escape(value)})
+    return [form.encode() for form in sorted(forms, key=len, reverse=True) if len(form) >= MIN_REFLECTION]
+
+
+def normalize(response, reflects=True):
+    """Body without reflected inputs and with all numbers replaced, so pages with the path or a timestamp in them
+    look the same. Returns the body and the number of bytes that were removed as reflections"""
+    body = response.body
+    if reflects:
+        for form in reflections(response):
+            body = body.replace(form, b"")
+    return NUMBERS.sub(b"0", body), len(response.body) - len(body)
+
+
+def fingerprint(body):
+    return hashlib.sha1(body).hexdigest()[:16]
+
+
+def tolerance(values):
+    """Range of values with some margin around the spread of the samples, exact if they are all the same"""
+    low, high = min(values), max(values)
+    margin = (high - low + 1) // 2
+    return [low - margin, high + margin]
+
+
+def is_stable(bounds):
+    """If a range is narrow enough to tell negative responses apart from real ones"""
+    low, high = bounds
+    return high - low <= max(10, high // 10)
+
+
+class Profile:
+    def __init__(self, status, size, length, words, lines, fingerprints, reflected=0):
+        """Negative responses with one status code: ranges of their size, size without reflections, words and lines,
+        fingerprints of their normalized bodies, and how often the input is reflected in them"""
+        self.status = status
+        self.size = size
+        self.length = length
+        self.words = words
+        self.lines = lines
+        self.fingerprints = set(fingerprints)
+        self.reflected = reflected
+
+    @classmethod
+    def build(cls, status, responses):
+        normalized = [normalize(response) for response in responses]
+        reflected = round(sum(removed / len(r.request.input["FUZZ"])
+                              for r, (_, removed) in zip(responses, normalized)) / len(responses))
+        return cls(status, tolerance([r.length for r in responses]),
+                   tolerance([r.length - removed for r, (_, removed) in zip(responses, normalized)]),
+                   tolerance([r.words for r in responses]), tolerance([r.lines for r in responses]),
+                   [fingerprint(body) for body, _ in normalized], reflected)
+
+    def matches(self, response):
+        if response.status != self.status:
+            return False
+        body, removed = normalize(response, self.reflected > 0)
+        if fingerprint(body) in self.fingerprints:
+            return True
+        if self.reflected and not removed:  # Too short to remove, assume it is reflected as often as in the samples
+            removed = self.reflected * len(response.request.input.get("FUZZ", ""))
+        checks = [(bounds, value) for bounds, value in [(self.length, response.length - removed),
+                  (self.words, response.words), (self.lines, response.lines)] if is_stable(bounds)]
+        return bool(checks) and all(low <= value <= high for (low, high), value in checks)
+
+    def to_json(self):
+        return {"status": self.status, "size": self.size, "length": self.length, "words": self.words,
+                "lines": self.lines, "fingerprints": sorted(self.fingerprints), "reflected": self.reflected}
+
+    def __str__(self):
+        size = f"{self.length[0]}-{self.length[1]}" if self.length[0] != self.length[1] else self.length[0]
+        return f"status={self.status} size={size}"
+
+
+class Baseline:
+    def __init__(self, profiles, created=None):
+        """Model of the responses to inputs that don't exist, to filter them out of fuzzing results"""
+        self.profiles = profiles
+        self.created = created or time.time()
+
+    @classmethod
+    def build(cls, responses):
+        """Build from responses to random inputs, one profile for every status code"""
+        groups = {}
+        for response in responses:
+            groups.setdefault(response.status, []).append(response)
+        return cls([Profile.build(status, group) for status, group in sorted(groups.items())])
+
+    def is_negative(self, response):
+        return any(profile.matches(response) for profile in self.profiles)
+
+    def to_ffuf_args(self):
+        """Closest ffuf filters, which can't combine a status with a size or ignore reflections. Per status the
+        narrowest of size, words or lines is used. Returns `None` if a status has no usable range"""
+        filters = {"-fs": [], "-fw": [], "-fl": []}
+        for profile in self.profiles:
+            options = [(option, bounds) for option, bounds in [("-fs", profile.size), ("-fw", profile.words),
+                       ("-fl", profile.lines)] if is_stable(bounds)]
+            if not options:
+                return None
+            option, (low, high) = min(options, key=lambda o: o[1][1] - o[1][0])
+            filters[option].append(str(low) if low == high else f"{max(0, low)}-{high}")
+        return [arg for option, values in filters.items() if values for arg in (option, ",".join(values))]
+
+    def to_json(self):
+        return {"created": self.created, "profiles": [profile.to_json() for profile in self.profiles]}
+
+    @classmethod
+    def from_json(cls, data):
+        return cls([Profile(**profile) for profile in data["profiles"]], data["created"])
+
+    def __str__(self):
+        return ", ".join(map(str, self.profiles))
+
+
+async def calibrate(fuzzer, template, mode, keywords={}):
+    """Send random inputs concurrently and build a `Baseline` from the answers, `None` if nothing answered. Other
+    `keywords` of the template are filled with every combination of their words, so one baseline covers them all"""
+    responses = []
+    await fuzzer.run(template.requests({"FUZZ": sample_words(mode), **keywords}), responses.append)
+    return Baseline.build(responses) if responses else None
+
+
+def load_cache():
+    try:
+        with open(CACHE_FILE) as f:
+            cache = json.load(f)
+        if cache.get("version") != CACHE_VERSION:
+            raise ValueError("Outdated cache")
+        return cache
+    except (OSError, ValueError, AttributeError):
+        return {"version": CACHE_VERSION, "baselines": {}}
+
+
+def save_cache(cache):
+    """Atomically write the cache, it is only an optimization so errors are ignored"""
+    tmp = f"{CACHE_FILE}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(CACHE_FILE), exist_ok=True)
+        with open(tmp, "w") as f:
+            json.dump(cache, f)
+        os.replace(tmp, CACHE_FILE)
+    except OSError:
+        pass
+
+
+def cache_key(host, scheme, mode):
+    return f"{scheme}://{host.lower()} {mode}"
+
+
+def get_cached(host, scheme, mode, ttl=CACHE_TTL):
+    """Baseline of an earlier calibration that is younger than `ttl` seconds, or `None`"""
+    data = load_cache()["baselines"].get(cache_key(host, scheme, mode))
+    if data is None or time.time() - data["created"] > ttl:
+        return None
+    return Baseline.from_json(data)
+
+
+def set_cached(host, scheme, mode, baseline):
+    cache = load_cache()
+    cache["baselines"] = {key: data for key, data in cache["baselines"].items() if time.time() - data["created"] <= CACHE_TTL}
+    cache["baselines"][cache_key(host, scheme, mode)] = baseline.to_json()
+    save_cache(cache)
@@ -0,0 +1,88 @@
+import math
+import re
+
+TOKENS = re.compile(rb"[A-Za-z_]{2,}")
+SAMPLE = 256  # About this many token hashes a SimHash is built from, the lowest ones so similar bodies sample the same
+MIN_TOKENS = 16  # Bodies with fewer distinct tokens are compared exactly, a SimHash of them changes too much
+BANDS = 8  # Parts of a SimHash that are indexed, two within `MAX_DISTANCE` bits always share one of them
+MAX_DISTANCE = 6  # Bits two SimHashes can differ in to be in the same cluster
+LENGTH_BUCKET = 2  # Ratio between the lengths of bucket boundaries, neighbouring buckets are compared too
+LANE = 16  # Bits to count every bit of the token hashes in, while adding them up as one integer
+MASK = (1 << 64) - 1
+SPREAD = [sum(((byte >> bit) & 1) << (bit * LANE) for bit in range(8)) for byte in range(256)]  # Byte -> 8 lanes
+SPREAD_AT = [[lanes << (8 * i * LANE) for lanes in SPREAD] for i in range(8)]  # For every byte of a hash
+
+
+def simhash(hashes):
+    """64-bit SimHash of token hashes: every bit is set if most of the hashes have it set"""
+    total = 0  # 64 counters of `LANE` bits, all added at once
+    s0, s1, s2, s3, s4, s5, s6, s7 = SPREAD_AT
+    for h in hashes:
+        total += (s0[h & 255] + s1[(h >> 8) & 255] + s2[(h >> 16) & 255] + s3[(h >> 24) & 255] +
+                  s4[(h >> 32) & 255] + s5[(h >> 40) & 255] + s6[(h >> 48) & 255] + s7[h >> 56])
+    lane_mask = (1 << LANE) - 1
+    return sum(1 << i for i in range(64) if ((total >> (i * LANE)) & lane_mask) * 2 > len(hashes))
+
+
+def fingerprint(body, inputs=()):
+    """Fingerprint of a body, ignoring the tokens of reflected inputs. Returns `(exact, value)`, a SimHash for larger
+    bodies and a hash of all tokens for small ones"""
+    tokens = TOKENS.findall(body)
+    ignored = {token for value in inputs for token in TOKENS.findall(value.encode())}
+    if ignored:
+        tokens = [token for token in tokens if token not in ignored]
+    hashes = {hash(token) & MASK for token in tokens}
+    if len(hashes) < MIN_TOKENS:
+        return True, hash(tuple(tokens)) & MASK
+    limit = MASK // max(1, len(hashes) // SAMPLE)
+    return False, simhash([h for h in hashes if h <= limit])
+
+
+def length_bucket(length):
+    return int(math.log(length + 1, LENGTH_BUCKET))
+
+
+class Cluster:
+    def __init__(self, id, result, label, key):
+        """Similar responses, represented by the first one and its label"""
+        self.id = id
+        self.result = result
+        self.label = label
+        self.key = key  # (status, exact, fingerprint)
+        self.count = 1
+
+
+class Clusters:
+    def __init__(self):
+        """Groups results into clusters of near-duplicate responses as they come in. Only candidates with the same
+        status, a similar length and one equal band of the SimHash are compared, so adding is constant time"""
+        self.clusters = []
+        self.index = {}  # (status, length bucket, exact, band number, band) -> [Cluster]
+
+    def keys(self, status, bucket, exact, value):
+        if exact:
+            return [(status, bucket, True, 0, value)]
+        width = 64 // BANDS
+        return [(status, bucket, False, i, (value >> (i * width)) & ((1 << width) - 1)) for i in range(BANDS)]
+
+    def add(self, result, response=None, label=None):
+        """Add a result in the JSON format of ffuf, with its `Response` to compare bodies. Without it only the status,
+        words and lines are compared. Returns the `Cluster` it was added to"""
+        status, bucket = result["status"], length_bucket(result["length"])
+        if response is not None:
+            exact, value = fingerprint(response.body, result["input"].values())
+        else:
+            exact, value = True, hash((result["words"], result["lines"])) & MASK
+
+        for nearby in (bucket, bucket - 1, bucket + 1):
+            for key in self.keys(status, nearby, exact, value):
+                for cluster in self.index.get(key, []):
+                    if exact and cluster.key[2] == value or not exact and bin(cluster.key[2] ^ value).count("1") <= MAX_DISTANCE:
+                        cluster.count += 1
+                        return cluster
+
+        cluster = Cluster(len(self.clusters) + 1, result, label, (status, exact, value))
+        self.clusters.append(cluster)
+        for key in self.keys(status, bucket, exact, value):
+            self.index.setdefault(key, []).append(cluster)
+        return cluster
@@ -0,0 +1,329 @@
+import asyncio
+import itertools
+import ssl
+import time
+from collections import namedtuple, deque
+from urllib.parse import urlsplit
+from default.lib.fuzz_throttle import Throttle, retry_after
+
+MATCH_CODES = {*range(200, 300), 301, 302, 307, 401, 403, 405, 500}  # Same as the default of ffuf
+SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}  # Only these are pipelined, so a failure can't repeat side effects
+MAX_KEEP = 64 * 1024  # Bytes of a response body that are kept, for comparing responses
+MAX_HEADERS = 100
+THROTTLE_RETRIES = 10  # Attempts of a request that keeps being answered with 429 Too Many Requests
+USER_AGENT = "Mozilla/5.0 (compatible; default-fuzz)"
+
+Request = namedtuple("Request", ["method", "url", "headers", "body", "input", "position"])
+Response = namedtuple("Response", ["request", "status", "length", "words", "lines", "headers", "body", "duration"])
+
+
+def read_wordlist(path):
+    """Stream words from a file without loading it into memory"""
+    with open(path, errors="replace") as f:
+        for line in f:
+            word = line.strip()
+            if word:
+                yield word
+
+
+def header(response, name):
+    """First value of a response header, or an empty string"""
+    name = name.lower()
+    return next((value for key, value in response.headers if key.lower() == name), "")
+
+
+def to_result(response):
+    """Response as a result in the JSON output format of ffuf, so the same tools can read it"""
+    request = response.request
+    return {
+        "input": request.input,
+        "position": request.position,
+        "status": response.status,
+        "length": response.length,
+        "words": response.words,
+        "lines": response.lines,
+        "content-type": header(response, "Content-Type"),
+        "redirectlocation": header(response, "Location"),
+        "url": request.url,
+        "duration": int(response.duration * 1e9),
+        "host": next((value for key, value in request.headers if key.lower() == "host"), urlsplit(request.url).netloc),
+    }
+
+
+class Template:
+    def __init__(self, url, method="GET", headers=(), body=None):
+        """A request with keywords like FUZZ anywhere in the URL, headers or body, to fill in with words"""
+        self.url = url
+        self.method = method
+        self.headers = list(headers)
+        self.body = body
+
+    def render(self, values, position=0):
+        """Request with the keywords filled in from the last one, so a value can contain an earlier keyword (like a host
+        pattern with FUZZ in it)"""
+        def fill(s):
+            for keyword, word in reversed(values.items()):
+                s = s.replace(keyword, word)
+            return s
+
+        return Request(fill(self.method), fill(self.url), [(fill(k), fill(v)) for k, v in self.headers],
+                       None if self.body is None else fill(self.body), values, position)
+
+    def requests(self, wordlists, extensions=(), start=0):
+        """Every combination of words (clusterbomb), with extensions added to FUZZ. The first wordlist is streamed,
+        the others are kept in memory. Positions before `start` are skipped"""
+        keywords = list(wordlists)
+        first, *others = wordlists.values()
+        others = [list(words) for words in others]
+        position = 0
+        for word in first:
+            for variant in [word] + [word + extension for extension in extensions] if keywords[0] == "FUZZ" else [word]:
+                for rest in itertools.product(*others):
+                    if position >= start:
+                        yield self.render(dict(zip(keywords, (variant, *rest))), position)
+                    position += 1
+
+
+def serialize(request):
+    parts = urlsplit(request.url)
+    target = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+    names = {name.lower() for name, _ in request.headers}
+    lines = [f"{request.method} {target} HTTP/1.1"]
+    if "host" not in names:
+        lines.append(f"Host: {parts.netloc}")
+    if "user-agent" not in names:
+        lines.append(f"User-Agent: {USER_AGENT}")
+    if "accept" not in names:
+        lines.append("Accept: */*")
+    body = (request.body or "").encode()
+    if body or request.method not in SAFE_METHODS:
+        lines.append(f"Content-Length: {len(body)}")
+    lines += [f"{name}: {value}" for name, value in request.headers]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1", errors="replace") + body
+
+
+class Connection:
+    def __init__(self, origin, reader, writer):
+        """Keep-alive connection to one origin. Pipelining is allowed after the server kept it alive once"""
+        self.origin = origin
+        self.reader = reader
+        self.writer = writer
+        self.keep_alive = False
+
+    @classmethod
+    async def open(cls, origin, context, timeout):
+        scheme, host, port = origin
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(
+            host, port, ssl=context if scheme == "https" else None, limit=1024 * 1024), timeout)
+        return cls(origin, reader, writer)
+
+    async def read_body(self, length, chunked):
+        """Read a body while counting it like ffuf, keeps only the first `MAX_KEEP` bytes"""
+        kept = []
+        size = words = lines = 0
+
+        def add(chunk):
+            nonlocal size, words, lines
+            if size < MAX_KEEP:
+                kept.append(chunk[:MAX_KEEP - size])
+            size += len(chunk)
+            words += chunk.count(b" ")
+            lines += chunk.count(b"\n")
+
+        if chunked:
+            while True:
+                chunk_size = int((await self.reader.readline()).split(b";")[0].strip() or b"0", 16)
+                if chunk_size == 0:
+                    while (await self.reader.readline()) not in (b"\r\n", b"\n", b""):  # Trailers
+                        pass
+                    break
+                add(await self.reader.readexactly(chunk_size))
+                await self.reader.readline()
+        elif length is not None:
+            while length:
+                chunk = await self.reader.read(min(length, 1024 * 1024))
+                if not chunk:
+                    raise asyncio.IncompleteReadError(b"", length)
+                add(chunk)
+                length -= len(chunk)
+        else:  # Until the connection is closed
+            while chunk := await self.reader.read(1024 * 1024):
+                add(chunk)
+        return b"".join(kept), size, words + 1, lines + 1
+
+    async def receive(self, request, start):
+        """Read the response to a request, returns a `Response`"""
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                raise ConnectionError("Connection closed")
+            version, status = line.decode("latin-1").split(None, 2)[:2]
+            headers = []
+            while (line := await self.reader.readline()) not in (b"\r\n", b"\n", b""):
+                name, _, value = line.decode("latin-1").partition(":")
+                if len(headers) < MAX_HEADERS:
+                    headers.append((name.strip(), value.strip()))
+            if not status.startswith("1") or status == "101":  # Skip 100 Continue
+                break
+
+        status = int(status)
+        lookup = {name.lower(): value.lower() for name, value in headers}
+        connection = lookup.get("connection", "")
+        if version == "HTTP/1.0":
+            self.keep_alive = "keep-alive" in connection
+        else:
+            self.keep_alive = "close" not in connection
+
+        if request.method == "HEAD" or status in (204, 304):
+            body, length, words, lines = b"", 0, 1, 1
+        else:
+            chunked = "chunked" in lookup.get("transfer-encoding", "")
+            length = int(lookup["content-length"]) if "content-length" in lookup and not chunked else None
+            if length is None and not chunked:
+                self.keep_alive = False
+            body, length, words, lines = await self.read_body(length, chunked)
+        return Response(request, status, length, words, lines, headers, body, time.monotonic() - start)
+
+    def close(self):
+        self.writer.close()
+
+
+def origin(url):
+    parts = urlsplit(url)
+    return parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == "https" else 80)
+
+
+class Fuzzer:
+    def __init__(self, concurrency=40, pipeline=4, timeout=10, retries=2, rate=None):
+        """Sends requests over a shared pool of keep-alive connections, with at most `concurrency` connections busy
+        at once across all running jobs. Every origin gets a `Throttle` that adapts this to how well it keeps up,
+        optionally under `rate` requests per second. Up to `pipeline` safe requests are sent at once on a connection
+        when the server supports it. TLS certificates are not verified, like ffuf"""
+        self.concurrency = concurrency
+        self.pipeline = pipeline
+        self.timeout = timeout
+        self.retries = retries
+        self.rate = rate
+        self.slots = asyncio.Semaphore(concurrency)
+        self.throttles = {}  # Origin -> Throttle
+        self.idle = {}  # Origin -> [Connection]
+        self.pipelining = pipeline > 1  # Turned off when a server drops pipelined requests
+        self.persistent = set()  # Origins that kept a connection alive, only those are pipelined to
+        self.sent = 0
+        self.errors = 0
+        self.context = ssl.create_default_context()
+        self.context.check_hostname = False
+        self.context.verify_mode = ssl.CERT_NONE
+
+    def throttle(self, request_origin):
+        if request_origin not in self.throttles:
+            self.throttles[request_origin] = Throttle(self.concurrency, self.rate)
+        return self.throttles[request_origin]
+
+    async def connect(self, request_origin):
+        idle = self.idle.get(request_origin)
+        while idle:
+            connection = idle.pop()
+            if not connection.reader.at_eof():
+                return connection
+            connection.close()
+        return await Connection.open(request_origin, self.context, self.timeout)
+
+    def release(self, connection):
+        if connection.keep_alive:
+            self.idle.setdefault(connection.origin, []).append(connection)
+        else:
+            connection.close()
+
+    async def exchange(self, batch, on_response, throttle):
+        """Send a batch of requests to the same origin on one connection. Returns the requests that were not answered,
+        and those that were answered with 429 Too Many Requests"""
+        connection = None
+        answered = 0
+        throttled = []
+        try:
+            connection = await self.connect(origin(batch[0].url))
+            start = time.monotonic()
+            connection.writer.write(b"".join(serialize(request) for request in batch))
+            self.sent += len(batch)
+            for request in batch:
+                response = await asyncio.wait_for(connection.receive(request, start), self.timeout)
+                answered += 1
+                throttle.record(response.status, response.duration, retry_after(header(response, "Retry-After")))
+                if response.status == 429:
+                    throttled.append(request)
+                else:
+                    on_response(response)
+                if not connection.keep_alive:
+                    break
+            self.release(connection)
+            if connection.keep_alive:
+                self.persistent.add(connection.origin)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            if connection is not None:
+                connection.close()
+            if answered and len(batch) > answered:  # Closed with pipelined requests left, so it doesn't pipeline
+                self.pipelining = False
+        except (OSError, ValueError, asyncio.TimeoutError, asyncio.LimitOverrunError):
+            if connection is not None:
+                connection.close()
+        if answered < len(batch):
+            throttle.failure()
+        return batch[answered:], throttled
+
+    async def worker(self, requests, on_response, on_error):
+        waiting = deque()  # (request, attempt) to send first, for retries and a request to another origin
+
+        def take():
+            if waiting:
+                return waiting.popleft()
+            request = next(requests, None)
+            return None if request is None else (request, 0)
+
+        while (item := take()) is not None:
+            batch = [item]
+            target = origin(item[0].url)
+            depth = self.pipeline if self.pipelining and target in self.persistent else 1
+            while len(batch) < depth and not item[1] and item[0].method in SAFE_METHODS:  # Retries are sent alone
+                item = take()
+                if item is None:
+                    break
+                if item[1] or item[0].method not in SAFE_METHODS or origin(item[0].url) != target:
+                    waiting.appendleft(item)
+                    break
+                batch.append(item)
+
+            throttle = self.throttle(target)
+            await throttle.acquire(len(batch))
+            try:
+                async with self.slots:
+                    unanswered, throttled = await self.exchange([request for request, _ in batch], on_response, throttle)
+            finally:
+                throttle.release()
+            attempts = {id(request): attempt for request, attempt in batch}
+            limits = {id(request): THROTTLE_RETRIES for request in throttled}
+            for request in reversed(unanswered + throttled):
+                attempt = attempts[id(request)] + 1
+                if attempt > limits.get(id(request), self.retries):
+                    self.errors += 1
+                    on_error(request)
+                else:
+                    waiting.appendleft((request, attempt))
+
+    async def run(self, requests, on_response, on_error=lambda request: None, concurrency=None):
+        """Send all requests from an iterable, calling `on_response(response)` for every answer and `on_error(request)`
+        when it failed after retrying. The iterable is read lazily, so it can stream a large wordlist"""
+        requests = iter(requests)
+        await asyncio.gather(*(self.worker(requests, on_response, on_error) for _ in range(concurrency or self.concurrency)))
+
+    async def fetch(self, request):
+        """Send a single request, returns its `Response` or `None` if it failed after retrying"""
+        responses = []
+        await self.run([request], responses.append, concurrency=1)
+        return responses[0] if responses else None
+
+    def close(self):
+        for connections in self.idle.values():
+            for connection in connections:
+                connection.close()
+        self.idle.clear()
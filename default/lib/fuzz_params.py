@@ -0,0 +1,167 @@
+import asyncio
+import json
+import random
+import re
+import string
+from difflib import SequenceMatcher
+from urllib.parse import urlencode, quote
+from default.lib.fuzz_engine import Request
+
+MODES = ("query", "form", "json")
+MAX_QUERY = 6000  # Bytes of parameters in a URL, servers often allow about 8KB for the whole request line
+MAX_BODY = 64 * 1024  # Bytes of parameters in a body
+MAX_BATCH = 1000  # Parameters in one request, halved while the server rejects requests that large
+MIN_BATCH = 8
+BASELINE_SAMPLES = 3  # Requests with random parameters to learn which parts of the page change by themselves
+TOO_LARGE = {400, 413, 414, 431}  # Statuses of a server that doesn't accept so many parameters
+FETCH_ATTEMPTS = 3  # Times a batch is sent before its parameters are reported as unchecked
+TOKENS = re.compile(rb"[A-Za-z_]{2,}|[0-9]+")  # Words and numbers of a body that are compared
+
+
+def random_name():
+    return "".join(random.choice(string.ascii_lowercase) for _ in range(10))
+
+
+def build_request(url, mode, params, value):
+    """Request with every parameter set to `value`, in the query string, a form body or a JSON body"""
+    pairs = {name: value for name in params}
+    if mode == "query":
+        return Request("GET", url + ("&" if "?" in url else "?") + urlencode(pairs) if pairs else url, [], None, {}, 0)
+    if mode == "form":
+        return Request("POST", url, [("Content-Type", "application/x-www-form-urlencoded")], urlencode(pairs), {}, 0)
+    return Request("POST", url, [("Content-Type", "application/json")], json.dumps(pairs), {}, 0)
+
+
+def batches(names, mode, value, size):
+    """Split parameter names into batches of at most `size` that fit in one request"""
+    limit = MAX_QUERY if mode == "query" else MAX_BODY
+    batch, length = [], 0
+    for name in names:
+        extra = len(quote(name)) + len(quote(value)) + 6  # Separators, or quotes in JSON
+        if batch and (len(batch) >= size or length + extra > limit):
+            yield batch
+            batch, length = [], 0
+        batch.append(name)
+        length += extra
+    if batch:
+        yield batch
+
+
+def ignored_tokens(params, value):
+    """Tokens of the parameters and value, which a page may reflect"""
+    return {token for text in (*params, value) for token in TOKENS.findall(text.encode())}
+
+
+class ParamBaseline:
+    def __init__(self, status, tokens, dynamic, lengths):
+        """How the page answers to parameters it doesn't know: its status and the sequence of tokens in its body, with
+        the positions of the `dynamic` ones that changed between samples, like nonces. The `(min, max)` body `lengths`
+        catch changes outside of tokens, `None` if the page reflects parameters so its length depends on them"""
+        self.status = status
+        self.tokens = tokens
+        self.dynamic = dynamic
+        self.lengths = lengths
+
+    @classmethod
+    def build(cls, samples, value):
+        """Build from `(response, params)` samples with random parameters, `None` if their status was not stable"""
+        if len({response.status for response, _ in samples}) != 1:
+            return None
+        sequences = [[token for token in TOKENS.findall(response.body) if token not in ignored_tokens(params, value)]
+                     for response, params in samples]
+        reflected = any(name.encode() in response.body for response, params in samples for name in params)
+        lengths = [len(response.body) for response, _ in samples]
+        dynamic = set()
+        for other in sequences[1:]:
+            for tag, i1, i2, _, _ in SequenceMatcher(None, sequences[0], other, autojunk=False).get_opcodes():
+                if tag != "equal":
+                    dynamic.update(range(i1, max(i2, i1 + 1)))  # An insertion marks the token after it
+        return cls(samples[0][0].status, sequences[0], dynamic, None if reflected else (min(lengths), max(lengths)))
+
+    def difference(self, response, params, value):
+        """Description of how a response with these parameters differs, `None` if it looks the same"""
+        if response.status != self.status:
+            return f"status {self.status} -> {response.status}"
+        ignored = ignored_tokens(params, value)
+        expected = [(i, token) for i, token in enumerate(self.tokens) if token not in ignored]
+        actual = [token for token in TOKENS.findall(response.body) if token not in ignored]
+
+        changes = []
+        matcher = SequenceMatcher(None, [token for _, token in expected], actual, autojunk=False)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            positions = [i for i, _ in expected[i1:i2]] or [expected[i1][0] if i1 < len(expected) else len(self.tokens)]
+            if tag == "equal" or tag == "replace" and i2 - i1 == j2 - j1 and self.dynamic.issuperset(positions):
+                continue
+            changes += [f"+{token.decode()}" for token in actual[j1:j2]] + [f"-{token.decode()}" for _, token in expected[i1:i2]]
+        if changes:
+            return f"body {' '.join(changes[:3])}{' ...' if len(changes) > 3 else ''}"
+
+        if self.lengths:  # Something outside of the tokens changed, like punctuation or a single character
+            low, high = self.lengths
+            tolerance = high - low  # As much as the samples varied by themselves
+            if not low - tolerance <= len(response.body) <= high + tolerance:
+                return f"length {low if len(response.body) < low else high} -> {len(response.body)}"
+
+
+class ParamMiner:
+    def __init__(self, fuzzer, url, mode="query", value="1"):
+        """Finds the parameters that change a page, by sending hundreds at once and binary searching the batches that
+        made a difference. Needs about `log2(batch size)` requests per found parameter instead of one per candidate"""
+        self.fuzzer = fuzzer
+        self.url = url
+        self.mode = mode
+        self.value = value
+        self.baseline = None
+        self.size = MAX_BATCH
+        self.unchecked = []  # Parameters whose requests kept failing, so nothing is known about them
+
+    async def fetch(self, params):
+        return await self.fuzzer.fetch(build_request(self.url, self.mode, params, self.value))
+
+    async def calibrate(self):
+        """Learn the baseline from batches of random parameters, with the largest batch size the server accepts.
+        Returns `False` if the page doesn't answer the same every time"""
+        plain = await self.fetch([])
+        while True:
+            samples = []
+            for _ in range(BASELINE_SAMPLES):
+                params = [random_name() for _ in range(self.size)]
+                response = await self.fetch(params)
+                if response is not None:
+                    samples.append((response, params))
+            if not samples:
+                return False
+            if self.size > MIN_BATCH and samples[0][0].status in TOO_LARGE and (plain is None or plain.status not in TOO_LARGE):
+                self.size //= 2
+                continue
+            self.baseline = ParamBaseline.build(samples, self.value)
+            return self.baseline is not None
+
+    async def check(self, params):
+        """Difference these parameters make to the page, or `None`. If every attempt fails they are added to
+        `unchecked` instead of counting as no difference"""
+        for _ in range(FETCH_ATTEMPTS):
+            response = await self.fetch(params)
+            if response is not None:
+                return self.baseline.difference(response, params, self.value)
+        self.unchecked += params
+        return None
+
+    async def search(self, params, on_found):
+        """Binary search a batch that changed the page, for the parameters that did it"""
+        if len(params) == 1:
+            difference = await self.check(params)  # Again, in case it was a fluke
+            if difference:
+                on_found(params[0], difference)
+            return
+        parts = [params[:len(params) // 2], params[len(params) // 2:]]
+        differences = await asyncio.gather(*(self.check(part) for part in parts))
+        await asyncio.gather(*(self.search(part, on_found) for part, difference in zip(parts, differences) if difference))
+
+    async def run(self, names, on_found):
+        """Check all parameter names after `calibrate()`, calling `on_found(name, difference)` for every one found"""
+        async def scan(batch):
+            if await self.check(batch):
+                await self.search(batch, on_found)
+
+        await asyncio.gather(*(scan(batch) for batch in batches(names, self.mode, self.value, self.size)))
@@ -0,0 +1,147 @@
+import hashlib
+import json
+import os
+import time
+from default.lib.fuzz_engine import Template, read_wordlist
+
+STATE_VERSION = 1
+CHECKPOINT_INTERVAL = 5  # Seconds between writes of the state file while fuzzing
+
+
+def get_signature(arguments):
+    """Identifies a run by its arguments, only a run with the same ones can resume it"""
+    return hashlib.sha256(json.dumps(arguments, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+class Progress:
+    def __init__(self, done=0, extra=(), failed=()):
+        """Positions of the requests of a job that were completed: all before `done` except the `failed` ones, and the
+        later ones in `extra`, because concurrent requests finish out of order"""
+        self.done = done
+        self.extra = set(extra)
+        self.failed = set(failed)
+
+    def complete(self, position, failed=False):
+        """Mark a request as sent, a failed one stays in `failed` until it is sent again successfully"""
+        if failed:
+            self.failed.add(position)
+        else:
+            self.failed.discard(position)
+        if position < self.done:  # A retry of a failed request
+            return
+        self.extra.add(position)
+        while self.done in self.extra:
+            self.extra.remove(self.done)
+            self.done += 1
+
+    def remaining(self, requests):
+        """Requests that still have to be sent, from a function that generates them starting at a position. Failed
+        requests are sent again"""
+        failed = set(self.failed)
+        for request in requests(min(failed, default=self.done)):
+            if request.position in failed or (request.position >= self.done and request.position not in self.extra):
+                yield request
+
+    def to_json(self):
+        return {"done": self.done, "extra": sorted(self.extra), "failed": sorted(self.failed)}
+
+
+class FuzzState:
+    def __init__(self, arguments, resume=False):
+        """Checkpoint of a fuzzing run in the current directory: its jobs with their progress, results and calibrations.
+        Written atomically at most every `CHECKPOINT_INTERVAL` seconds, and removed when the run finishes
+
+        arguments: everything that defines the run, the checkpoint is only resumed by a run with the same ones
+        resume: continue from the checkpoint if there is one, otherwise start over"""
+        self.filename = f".default-ffuf-{get_signature(arguments)}.json"
+        self.jobs = {}  # Name -> {"template", "mode", "progress", "finished"}, the template is `None` for ffuf scans
+        self.results = {}  # Kind -> [result]
+        self.baselines = {}  # Mode -> Baseline JSON
+        self.started = set()  # Names of the jobs that were started in this run
+        self.resumed = False
+        self.saved = 0
+
+        if not resume:
+            return
+
+        try:
+            with open(self.filename) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        if state.get("version") != STATE_VERSION:
+            return
+
+        for name, job in state["jobs"].items():
+            job["template"] = job["template"] and Template(**job["template"])
+            job["progress"] = Progress(**job["progress"])
+            self.jobs[name] = job
+        self.results = state["results"]
+        self.baselines = state["baselines"]
+        self.resumed = True
+
+    def job(self, name, template, mode):
+        """Add a job, or get the existing one with that name"""
+        if name not in self.jobs:
+            self.jobs[name] = {"template": template, "mode": mode, "progress": Progress(), "finished": False}
+        return self.jobs[name]
+
+    def pending(self, prefix=""):
+        """Names of the jobs that did not finish and were not started in this run yet, in the order they were added.
+        With a prefix, only the job with that name and the ones named after it with a space, like its directories"""
+        return [name for name, job in self.jobs.items() if not job["finished"] and name not in self.started
+                and (not prefix or name == prefix or name.startswith(prefix + " "))]
+
+    def start(self, name):
+        self.started.add(name)
+
+    def finish(self, name):
+        """Mark a job as done, unless some of its requests failed to leave them for a resumed run"""
+        job = self.jobs[name]
+        job["finished"] = not job["progress"].failed
+        self.save(force=True)
+
+    def is_complete(self):
+        return all(job["finished"] for job in self.jobs.values())
+
+    def add_result(self, kind, result):
+        self.results.setdefault(kind, []).append(result)
+
+    def save(self, force=False):
+        """Atomically write the state, unless it was written less than `CHECKPOINT_INTERVAL` seconds ago"""
+        if not force and time.monotonic() - self.saved < CHECKPOINT_INTERVAL:
+            return
+        self.saved = time.monotonic()
+
+        jobs = {name: {"template": job["template"] and vars(job["template"]), "mode": job["mode"],
+                       "progress": job["progress"].to_json(), "finished": job["finished"]} for name, job in self.jobs.items()}
+        tmp = f"{self.filename}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"version": STATE_VERSION, "jobs": jobs, "results": self.results, "baselines": self.baselines}, f)
+        os.replace(tmp, self.filename)
+
+    def remove(self):
+        try:
+            os.remove(self.filename)
+        except FileNotFoundError:
+            pass
+
+
+async def run_job(fuzzer, state, name, wordlists, on_response, extensions=()):
+    """Send the requests of a job that were not completed yet, with `{keyword: path or list of words}` wordlists, and mark
+    it finished"""
+    job = state.jobs[name]
+    state.start(name)
+
+    def on_answer(response):
+        on_response(response)
+        job["progress"].complete(response.request.position)
+        state.save()
+
+    def requests(start):
+        return job["template"].requests({keyword: read_wordlist(words) if isinstance(words, str) else words
+                                         for keyword, words in wordlists.items()}, extensions, start)
+
+    await fuzzer.run(job["progress"].remaining(requests), on_answer,
+                     lambda request: job["progress"].complete(request.position, failed=True))
+    state.finish(name)
@@ -0,0 +1,147 @@
+import asyncio
+import time
+from collections import deque
+
+INITIAL_LIMIT = 4  # Concurrent requests to a new host, grows quickly until it shows signs of overload
+DECREASE = 0.5  # Factor the limit is multiplied with when a host is overloaded
+RATE_DECREASE = 0.8  # Factor of the measured rate that becomes the rate ceiling when a host throttles
+RATE_STEPS = 10  # Seconds without throttling for a learned rate ceiling to grow by its starting value again
+SLOW_LATENCY = 2  # Times the fastest latency at which the limit stops growing
+OVERLOADED_LATENCY = 4  # Times the fastest latency at which the limit is decreased
+LATENCY_FLOOR = 0.05  # Seconds of latency that never count as slow, fast local targets vary a lot relatively
+COOLDOWN = 1  # Seconds after a decrease before another one, answers to requests sent before it show the same overload
+THROTTLE_STATUS = {429, 503}
+MAX_PAUSE = 30  # Seconds a Retry-After header can pause a host for
+
+
+def retry_after(value):
+    """Seconds to wait from a Retry-After header in seconds, 0 if it is missing or a date"""
+    try:
+        return min(MAX_PAUSE, max(0, int(value)))
+    except ValueError:
+        return 0
+
+
+class Throttle:
+    def __init__(self, maximum, rate=None, minimum=1):
+        """AIMD limit of concurrent requests to one host. Grows while responses are fast and successful (doubling at the
+        start), halves on errors, 429/503 responses or growing latency. Throttling also sets a rate ceiling below the
+        measured rate that grows linearly again. `rate` is an optional hard ceiling of requests/sec"""
+        self.maximum = maximum
+        self.minimum = minimum
+        self.rate = rate
+        self.learned_rate = None  # Ceiling of requests/sec after the host throttled
+        self.rate_step = 0
+        self.limit = min(INITIAL_LIMIT, maximum)
+        self.slow_start = True  # Until the first sign of overload
+        self.active = 0
+        self.successes = 0  # Since the limit last grew
+        self.latency = None  # Moving average
+        self.fastest = None
+        self.decreased = 0
+        self.paused_until = 0
+        self.next_send = 0
+        self.waiters = deque()  # Futures of requests waiting for a free slot, first come first served
+        self.started = self.window = time.monotonic()
+        self.window_count = 0  # Answers since `window` started
+        self.recent_rate = None  # Answers per second in the last full window
+        self.answered = self.errors = self.throttled = 0
+
+    def ceiling(self):
+        rates = [rate for rate in (self.rate, self.learned_rate) if rate]
+        return min(rates) if rates else None
+
+    def notify(self):
+        """Hand free slots to waiting requests in order"""
+        while self.waiters and self.active < int(self.limit):
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                self.active += 1
+                waiter.set_result(None)
+
+    async def acquire(self, count=1):
+        """Wait until a connection may be used for `count` requests"""
+        while (now := time.monotonic()) < self.paused_until:
+            await asyncio.sleep(self.paused_until - now)
+        if self.waiters or self.active >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():  # Got a slot just before
+                    self.release()
+                raise
+            now = time.monotonic()
+        else:
+            self.active += 1
+        if rate := self.ceiling():  # Reserve the next free moment under the ceiling
+            send = max(now, self.next_send)
+            self.next_send = send + count / rate
+            if send > now:
+                await asyncio.sleep(send - now)
+
+    def release(self):
+        self.active -= 1
+        self.notify()
+
+    def record(self, status, duration, wait=0):
+        """Feedback from a response, with the seconds of its Retry-After header"""
+        self.answered += 1
+        now = time.monotonic()
+        if now - self.window >= 1:
+            self.recent_rate = self.window_count / (now - self.window)
+            self.window, self.window_count = now, 0
+            if self.learned_rate and now - self.decreased >= COOLDOWN:
+                self.learned_rate += self.rate_step
+        if status in THROTTLE_STATUS:
+            self.throttled += 1
+            self.decrease(throttled=True)
+            if now + wait > self.paused_until:  # Measure the rate again after the pause
+                self.paused_until = self.window = now + wait
+                self.window_count = 0
+            return
+        self.window_count += 1
+
+        self.latency = duration if self.latency is None else self.latency * 0.9 + duration * 0.1
+        self.fastest = duration if self.fastest is None else min(self.fastest, duration)
+        normal = max(self.fastest, LATENCY_FLOOR)
+        if self.latency > normal * OVERLOADED_LATENCY:
+            self.decrease()
+        elif self.latency < normal * SLOW_LATENCY:
+            self.successes += 1
+            if self.slow_start or self.successes >= self.limit:  # Otherwise one more per round trip
+                self.successes = 0
+                self.limit = min(self.maximum, self.limit + 1)
+                self.notify()
+
+    def failure(self):
+        """Feedback from a request that got no answer"""
+        self.errors += 1
+        self.decrease()
+
+    def decrease(self, throttled=False):
+        now = time.monotonic()
+        if now - self.decreased < max(COOLDOWN, self.latency or 0):
+            return
+        self.decreased = now
+        self.slow_start = False
+        self.successes = 0
+        self.limit = max(self.minimum, self.limit * DECREASE)
+        if throttled:
+            measured = self.recent_rate or (self.answered - self.throttled) / max(now - self.started, 0.1)
+            self.learned_rate = max(1, RATE_DECREASE * min(measured, self.learned_rate or measured))
+            self.rate_step = self.learned_rate / RATE_STEPS
+
+    def to_ffuf_args(self, processes=1):
+        """Closest ffuf settings, which can't change while running: the limit as threads (the maximum if the host never
+        slowed down) and the rate ceiling, split over `processes`"""
+        limit = self.maximum if self.slow_start else int(self.limit)
+        args = ["-t", str(max(1, limit // processes))]
+        if rate := self.ceiling():
+            args += ["-rate", str(max(1, int(rate / processes)))]
+        return args
+
+    def __str__(self):
+        rate = self.ceiling()
+        return f"{int(self.limit)} concurrent requests" + (f" at most {rate:.0f}/s" if rate else "")
@@ -0,0 +1,249 @@
+import asyncio
+import html
+import mimetypes
+import os
+import re
+import time
+from collections import namedtuple
+from email.utils import formatdate
+from urllib.parse import quote, unquote, urlsplit
+
+KEEP_ALIVE_TIMEOUT = 15  # Seconds an idle connection is kept open
+MAX_HEADERS = 100
+MAX_BODY = 64 * 1024 * 1024  # Largest request body that is accepted
+MAX_CAPTURE = 1024 * 1024  # Bytes of a request body that are kept for logging
+RANGE = re.compile(r"bytes=(\d*)-(\d*)")
+
+REASONS = {200: "OK", 204: "No Content", 206: "Partial Content", 301: "Moved Permanently", 400: "Bad Request",
+           403: "Forbidden", 404: "Not Found", 413: "Payload Too Large", 416: "Range Not Satisfiable"}
+
+Request = namedtuple("Request", ["time", "ip", "port", "method", "path", "version", "headers", "body", "status", "size"])
+
+
+class BadRequest(Exception):
+    pass
+
+
+def parse_range(value, size):
+    """Get `(start, end)` of a single byte range (end exclusive), `None` to send everything, or raises `ValueError`
+    if it can't be satisfied. Multiple ranges are not supported, so the whole file is sent instead"""
+    match = RANGE.fullmatch(value.strip())
+    if match is None:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:  # Suffix of the file
+        start, end = max(0, size - int(end)), size
+    else:
+        start, end = int(start), min(int(end) + 1, size) if end else size
+    if start >= size or start >= end:
+        raise ValueError("Range not satisfiable")
+    return start, end
+
+
+def list_directory(path, url_path):
+    """HTML listing of a directory, like Python's http.server"""
+    names = sorted(os.listdir(path), key=str.lower)
+    title = f"Directory listing for {html.escape(url_path)}"
+    items = []
+    for name in names:
+        display = name + "/" if os.path.isdir(os.path.join(path, name)) else name
+        items.append(f'<li><a href="{quote(display)}">{html.escape(display)}</a></li>')
+    return (f'<!DOCTYPE HTML>\n<html lang="en">\n<head>\n<meta charset="utf-8">\n<title>{title}</title>\n</head>\n'
+            f'<body>\n<h1>{title}</h1>\n<hr>\n<ul>\n{chr(10).join(items)}\n</ul>\n<hr>\n</body>\n</html>\n').encode()
+
+
+class HTTPServer:
+    def __init__(self, directory, on_request=None):
+        """Asynchronous HTTP/1.1 server for the files in `directory`, with keep-alive and Range requests. Files are
+        sent with `sendfile` where possible. `on_request(request)` is called with a `Request` for every request,
+        including its headers and body, also when it failed. Any method is accepted and answered like a GET, to catch
+        all callbacks"""
+        self.directory = os.path.abspath(directory)
+        self.on_request = on_request
+        self.servers = []
+
+    async def read_request(self, reader, fields):
+        """Read a request into the `Request` fields, as far as it can be parsed. Returns `False` when the connection is
+        closed. An invalid request line is kept as the path"""
+        line = await asyncio.wait_for(reader.readline(), KEEP_ALIVE_TIMEOUT)
+        while line in (b"\r\n", b"\n"):  # Empty lines between requests are allowed
+            line = await asyncio.wait_for(reader.readline(), KEEP_ALIVE_TIMEOUT)
+        if not line:
+            return False
+
+        parts = line.decode("latin-1").split()
+        if len(parts) != 3 or not parts[2].startswith("HTTP/"):
+            fields.update(method="", path=line.decode("latin-1").strip(), version="", headers=[])
+            raise BadRequest(f"Invalid request line: {line!r}")
+        method, target, version = parts
+        headers = []
+        fields.update(method=method, path=target, version=version, headers=headers)
+
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, sep, value = line.decode("latin-1").partition(":")
+            if not sep or len(headers) >= MAX_HEADERS:
+                raise BadRequest(f"Invalid header: {line!r}")
+            headers.append((name.strip(), value.strip()))
+        return True
+
+    async def read_body(self, reader, headers):
+        """Read the body by its Content-Length or chunked encoding, keeps only the first `MAX_CAPTURE` bytes"""
+        lookup = {name.lower(): value for name, value in headers}
+        chunks = []
+        if "chunked" in lookup.get("transfer-encoding", "").lower():
+            total = 0
+            while True:
+                size = int((await reader.readline()).split(b";")[0].strip() or b"0", 16)
+                if size == 0:
+                    while (await reader.readline()) not in (b"\r\n", b"\n", b""):  # Trailers
+                        pass
+                    break
+                total += size
+                if total > MAX_BODY:
+                    raise BadRequest("Body too large")
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+        elif "content-length" in lookup:
+            remaining = int(lookup["content-length"])
+            if remaining < 0 or remaining > MAX_BODY:
+                raise BadRequest("Body too large")
+            while remaining:
+                chunk = await reader.read(min(remaining, 64 * 1024))
+                if not chunk:
+                    raise asyncio.IncompleteReadError(b"", remaining)
+                chunks.append(chunk)
+                remaining -= len(chunk)
+        return b"".join(chunks)[:MAX_CAPTURE]
+
+    def resolve_path(self, target):
+        """Local path of a URL path, without allowing it to escape the directory"""
+        path = os.path.normpath("/" + unquote(urlsplit(target).path)).lstrip("/")
+        return os.path.join(self.directory, path)
+
+    async def respond(self, writer, method, target, headers, keep_alive):
+        """Send a response, returns the status and number of body bytes"""
+        url_path = urlsplit(target).path
+        path = self.resolve_path(target)
+        response_headers = {
+            "Connection": "keep-alive" if keep_alive else "close",
+            "Access-Control-Allow-Origin": "*",  # Let XSS payloads read the responses
+        }
+        lookup = {name.lower(): value for name, value in headers}
+
+        if os.path.isdir(path):
+            if not url_path.endswith("/"):
+                return self.send(writer, method, 301, b"", {**response_headers, "Location": url_path + "/"})
+            index = os.path.join(path, "index.html")
+            if not os.path.isfile(index):
+                try:
+                    body = list_directory(path, unquote(url_path))
+                except OSError:
+                    return self.send(writer, method, 403, b"Forbidden\n", response_headers)
+                return self.send(writer, method, 200, body, {**response_headers, "Content-Type": "text/html; charset=utf-8"})
+            path = index
+
+        try:
+            f = open(path, "rb")
+        except (FileNotFoundError, NotADirectoryError):
+            return self.send(writer, method, 404, b"Not Found\n", response_headers)
+        except OSError:
+            return self.send(writer, method, 403, b"Forbidden\n", response_headers)
+        except ValueError:  # Like a null byte
+            return self.send(writer, method, 400, b"Bad Request\n", response_headers)
+
+        with f:
+            stat = os.fstat(f.fileno())
+            response_headers.update({
+                "Content-Type": mimetypes.guess_type(path)[0] or "application/octet-stream",
+                "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+                "Accept-Ranges": "bytes",
+            })
+            status, start, end = 200, 0, stat.st_size
+            if "range" in lookup:
+                try:
+                    byte_range = parse_range(lookup["range"], stat.st_size)
+                except ValueError:
+                    return self.send(writer, method, 416, b"", {**response_headers, "Content-Range": f"bytes */{stat.st_size}"})
+                if byte_range is not None:
+                    status, (start, end) = 206, byte_range
+                    response_headers["Content-Range"] = f"bytes {start}-{end - 1}/{stat.st_size}"
+
+            self.send_headers(writer, status, end - start, response_headers)
+            if method == "HEAD" or end == start:
+                return status, 0
+            try:
+                await writer.drain()
+                await asyncio.get_running_loop().sendfile(writer.transport, f, start, end - start)  # Falls back to copying
+            except ConnectionError:  # Download aborted by the client
+                writer.close()
+                return status, 0
+            return status, end - start
+
+    def send_headers(self, writer, status, length, headers):
+        lines = [f"HTTP/1.1 {status} {REASONS.get(status, '')}", f"Date: {formatdate(usegmt=True)}",
+                 f"Content-Length: {length}", *(f"{name}: {value}" for name, value in headers.items())]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+
+    def send(self, writer, method, status, body, headers):
+        self.send_headers(writer, status, len(body), headers)
+        if method != "HEAD":
+            writer.write(body)
+        return status, 0 if method == "HEAD" else len(body)
+
+    async def exchange(self, reader, writer, fields):
+        """Read a request and respond to it, filling in the `Request` fields as they become known. Returns if the
+        connection is kept alive"""
+        try:
+            if not await self.read_request(reader, fields):
+                return False
+            lookup = {name.lower(): value.lower() for name, value in fields["headers"]}
+            if lookup.get("expect") == "100-continue":
+                writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+            fields["body"] = await self.read_body(reader, fields["headers"])
+        except (BadRequest, ValueError) as e:
+            fields["status"], fields["size"] = self.send(writer, "GET", 400, f"Bad Request: {e}\n".encode(), {"Connection": "close"})
+            await writer.drain()
+            return False
+
+        if fields["version"] == "HTTP/1.0":
+            keep_alive = lookup.get("connection") == "keep-alive"
+        else:
+            keep_alive = lookup.get("connection") != "close"
+        fields["status"], fields["size"] = await self.respond(writer, fields["method"], fields["path"], fields["headers"], keep_alive)
+        if writer.is_closing():
+            return False
+        await writer.drain()
+        return keep_alive
+
+    async def handle(self, reader, writer):
+        """Handle requests on a connection until it is closed, or not kept alive. Every request is passed to
+        `on_request`, also when it could not be read completely or answered (with a `None` status)"""
+        ip, port = writer.get_extra_info("peername")[:2]
+        try:
+            keep_alive = True
+            while keep_alive:
+                fields = {}
+                try:
+                    keep_alive = await self.exchange(reader, writer, fields)
+                finally:
+                    if fields and self.on_request is not None:
+                        self.on_request(Request(**{"time": time.time(), "ip": ip, "port": port, "body": b"", "status": None,
+                                                   "size": 0, **fields}))
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, asyncio.CancelledError, ConnectionError):  # Also at shutdown
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, sockets):
+        """Start serving on TCP sockets from `bind_sockets()`"""
+        for sock in sockets:
+            self.servers.append(await asyncio.start_server(self.handle, sock=sock))
+
+    def close(self):
+        for server in self.servers:
+            server.close()
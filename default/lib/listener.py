@@ -0,0 +1,38 @@
+import socket
+
+RECEIVE_BUFFER = 4 * 1024 * 1024  # UDP socket buffer to absorb floods while replies are being sent
+
+
+def bind_sockets(ip, port, kinds=(socket.SOCK_DGRAM, socket.SOCK_STREAM)):
+    """Bind UDP and/or TCP sockets on `ip`, and also on IPv6 (`::`) when listening on all IPv4 interfaces.
+    Raises `PermissionError` for low ports, missing IPv6 support is ignored"""
+    hosts = [ip, "::"] if ip == "0.0.0.0" else [ip]
+    sockets = []
+    try:
+        for host in hosts:
+            family = socket.AF_INET6 if ":" in host else socket.AF_INET
+            for kind in kinds:
+                try:
+                    sock = socket.socket(family, kind)
+                except OSError:  # IPv6 disabled
+                    break
+                if family == socket.AF_INET6:
+                    sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 1)  # IPv4 is bound separately
+                if kind == socket.SOCK_STREAM:
+                    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                else:
+                    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER)
+                try:
+                    sock.bind((host, port))
+                except OSError as e:
+                    sock.close()
+                    if host == "::" and not isinstance(e, PermissionError):  # No IPv6 address available
+                        break
+                    raise
+                sockets.append(sock)
+    except OSError:
+        for sock in sockets:
+            sock.close()
+        raise
+
+    return sockets
@@ -0,0 +1,204 @@
+import asyncio
+import os
+import queue
+import socket
+import threading
+import time
+from collections import deque
+
+MAX_BUFFER = 1024 * 1024  # Bytes of output kept per session while it is not attached
+
+
+class Session:
+    def __init__(self, id, protocol, ip, port, send, close):
+        """A connection (TCP) or remote address (UDP), with its recent output in a bounded ring buffer"""
+        self.id = id
+        self.protocol = protocol
+        self.ip = ip
+        self.port = port
+        self.send = send
+        self.close = close
+        self.started = time.time()
+        self.closed = False
+        self.buffer = deque()
+        self.size = 0  # Bytes in the buffer
+        self.received = 0  # Bytes received in total
+        self.shown = 0  # Bytes received in total that were shown
+
+    def add(self, data):
+        self.buffer.append(data)
+        self.size += len(data)
+        self.received += len(data)
+        while self.size > MAX_BUFFER:  # Drop the oldest output
+            self.size -= len(self.buffer.popleft())
+
+    def unseen(self):
+        """Get output that was not shown yet, and the number of bytes before it that were dropped from the buffer"""
+        start = self.received - self.size  # Position of the buffer in all output
+        data = b"".join(self.buffer)[max(0, self.shown - start):]
+        dropped = max(0, start - self.shown)
+        self.shown = self.received
+        return dropped, data
+
+    def __str__(self):
+        return f"{self.protocol}://{self.ip}:{self.port}"
+
+
+class Transcripts:
+    def __init__(self, directory):
+        """Write the input and output of every session to its own file, from a background thread"""
+        self.directory = directory
+        self.queue = queue.SimpleQueue()
+        self.files = {}
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def path(self, session):
+        name = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(session.started))}-{session.id}-{session.protocol}-{session.ip}-{session.port}.log"
+        return os.path.join(self.directory, name.replace(":", "_"))
+
+    def write(self, session, data):
+        self.queue.put((session, data))
+
+    def end(self, session):
+        """Close the file of a session after everything before it is written"""
+        self.queue.put((session, None))
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            session, data = item
+            if data is None:
+                if session.id in self.files:
+                    self.files.pop(session.id).close()
+                continue
+            if session.id not in self.files:
+                os.makedirs(self.directory, exist_ok=True)
+                self.files[session.id] = open(self.path(session), "ab")
+            f = self.files[session.id]
+            f.write(data)
+            if self.queue.empty():
+                f.flush()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        for f in self.files.values():
+            f.close()
+
+
+class UDPProtocol(asyncio.DatagramProtocol):
+    def __init__(self, manager):
+        self.manager = manager
+        self.transport = None
+        self.sessions = {}  # Address -> Session
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        session = self.sessions.get(addr)
+        if session is None or session.closed:
+            session = self.manager.open("udp", addr[0], addr[1], lambda data: self.transport.sendto(data, addr),
+                                        lambda: self.manager.closed(self.sessions.pop(addr)))
+            self.sessions[addr] = session
+        self.manager.receive(session, data)
+
+    def error_received(self, exc):
+        pass
+
+
+class SessionManager:
+    def __init__(self, transcripts=None, on_event=None, on_output=None):
+        """Accept any number of concurrent TCP connections and UDP peers as sessions. Output of the attached session
+        goes to `on_output(data)`, other output is buffered until it is attached. `on_event(event, session)` is called
+        with "open" and "close" events. Transcripts are written to the `transcripts` directory if given"""
+        self.sessions = {}  # ID -> Session
+        self.next_id = 1
+        self.attached = None
+        self.transcripts = Transcripts(transcripts) if transcripts else None
+        self.on_event = on_event
+        self.on_output = on_output
+        self.servers = []
+        self.transports = []
+
+    def open(self, protocol, ip, port, send, close):
+        session = Session(self.next_id, protocol, ip, port, send, close)
+        self.sessions[session.id] = session
+        self.next_id += 1
+        if self.on_event is not None:
+            self.on_event("open", session)
+        return session
+
+    def receive(self, session, data):
+        session.add(data)
+        if self.transcripts is not None:
+            self.transcripts.write(session, data)
+        if session is self.attached and self.on_output is not None:
+            session.shown = session.received
+            self.on_output(data)
+
+    def closed(self, session):
+        session.closed = True
+        if self.attached is session:
+            self.attached = None
+        if self.transcripts is not None:
+            self.transcripts.end(session)
+        if self.on_event is not None:
+            self.on_event("close", session)
+
+    def attach(self, id):
+        """Attach to a session, returns the output that was missed and the number of bytes that were dropped from it"""
+        session = self.sessions[id]
+        self.attached = session
+        return session.unseen()
+
+    def detach(self):
+        self.attached = None
+
+    def send(self, data):
+        """Send input to the attached session"""
+        session = self.attached
+        session.send(data)
+        if self.transcripts is not None:
+            self.transcripts.write(session, data)
+
+    def kill(self, id):
+        session = self.sessions[id]
+        if not session.closed:
+            session.close()
+
+    async def handle_tcp(self, reader, writer):
+        ip, port = writer.get_extra_info("peername")[:2]
+        session = self.open("tcp", ip, port, writer.write, writer.close)
+        try:
+            while data := await reader.read(64 * 1024):
+                self.receive(session, data)
+        except (asyncio.CancelledError, ConnectionError):  # Also at shutdown
+            pass
+        finally:
+            writer.close()
+            self.closed(session)
+
+    async def start(self, sockets):
+        """Start accepting sessions on sockets from `bind_sockets()`"""
+        loop = asyncio.get_running_loop()
+        for sock in sockets:
+            if sock.type == socket.SOCK_DGRAM:
+                transport, _ = await loop.create_datagram_endpoint(lambda: UDPProtocol(self), sock=sock)
+                self.transports.append(transport)
+            else:
+                self.servers.append(await asyncio.start_server(self.handle_tcp, sock=sock))
+
+    def close(self):
+        for server in self.servers:
+            server.close()
+        for transport in self.transports:
+            transport.close()
+        for session in self.sessions.values():
+            if not session.closed:
+                session.close()
+        if self.transcripts is not None:
+            self.transcripts.close()
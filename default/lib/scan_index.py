@@ -0,0 +1,118 @@
+import hashlib
+import json
+import os
+from default.lib.flag_search import Match
+
+INDEX_FILENAME = ".default-flag-index.json"  # Stored in the root of the search
+INDEX_VERSION = 2
+
+
+def hash_file(path):
+    """SHA256 of the content of a file, read in chunks"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def get_signature(signatures):
+    """Identifies the prefixes, encodings and options of a search, results are only reused for the same signature"""
+    return hashlib.sha256("\n".join(signatures).encode()).hexdigest()[:16]
+
+
+def match_to_json(match):
+    # Bytes are stored as latin-1 strings, which can represent every byte exactly
+    return [match.offset, match.encoding, match.prefix, match.before.decode("latin-1"),
+            match.text.decode("latin-1"), match.after.decode("latin-1")]
+
+
+def match_from_json(path, data):
+    offset, encoding, prefix, before, text, after = data
+    return Match(path, offset, encoding, prefix, before.encode("latin-1"), text.encode("latin-1"), after.encode("latin-1"))
+
+
+class ScanIndex:
+    def __init__(self, root, signatures, prefixes, reindex=False):
+        """On-disk index of files that were already searched, with their cached results
+
+        signatures: a `signature` string of every part of the search (matchers and archive searching)
+        prefixes: the configured flag prefixes, if they changed all cached results are invalidated
+        reindex: ignore the existing index and search every file again"""
+        self.filename = os.path.join(root, INDEX_FILENAME)
+        self.signature = get_signature(signatures)
+        self.prefixes = prefixes
+        self.old_files = {}  # From the previous run
+        self.files = {}  # Seen in this run, deleted files are dropped when saving
+        self.invalidated = False
+        self.reused = 0
+
+        if reindex:
+            return
+
+        try:
+            with open(self.filename) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        if index.get("version") != INDEX_VERSION:
+            return
+        if index["prefixes"] != prefixes:  # Keep hashes, but results may be missing new prefixes
+            self.invalidated = True
+            for entry in index["files"].values():
+                entry["results"] = {}
+
+        self.old_files = index["files"]
+
+    def lookup(self, path, stat):
+        """Get the cached results of a file if it did not change since the last search, otherwise `None`.
+        Results are a list of `(path, matches, binary)`, with more than one for archives"""
+        entry = self.old_files.get(path)
+        if entry is None or entry["size"] != stat.st_size:
+            return None
+
+        if entry["mtime"] != stat.st_mtime_ns:  # Might be the same content written again
+            try:
+                if hash_file(path) != entry["hash"]:
+                    return None
+            except OSError:
+                return None
+            entry["mtime"] = stat.st_mtime_ns
+
+        self.files[path] = entry
+        if self.signature not in entry["results"]:
+            return None
+
+        self.reused += 1
+        return [(result_path, [match_from_json(result_path, m) for m in matches], binary)
+                for result_path, matches, binary in entry["results"][self.signature]]
+
+    def store(self, path, stat, results):
+        """Save the results of a file that was just searched"""
+        entry = self.files.get(path)
+        if entry is None or entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime_ns:  # New or changed content
+            try:
+                digest = hash_file(path)
+            except OSError:
+                return
+            entry = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "hash": digest, "results": {}}
+            self.files[path] = entry
+
+        entry["results"][self.signature] = [(result_path, [match_to_json(m) for m in matches], binary)
+                                            for result_path, matches, binary in results]
+
+    def save(self):
+        """Atomically write the index, so an interrupted search never leaves a broken file"""
+        index = {
+            "version": INDEX_VERSION,
+            "prefixes": self.prefixes,
+            "files": self.files,
+        }
+        tmp = self.filename + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(index, f)
+            os.replace(tmp, self.filename)
+        except OSError:
+            pass
@@ -0,0 +1,138 @@
+import string
+import numpy as np
+from default.lib.flag_search import Match
+
+MAX_KEY_LENGTH = 16  # Longest repeating XOR key to try, should also be shorter than the known prefix
+VERIFY_LENGTH = 16  # Number of bytes after the prefix that need to decode to flag characters (or end with })
+MIN_CHECKS = 3  # Number of prefix bytes that should confirm a key, every missing one is replaced by a longer flag
+BODY_PER_CHECK = 4  # Length of the flag needed to replace a missing confirmation from the prefix
+MAX_FLAG = 256  # Maximum length of a decoded flag
+BLOCK_SIZE = 1024 * 1024  # Number of offsets compared at once
+
+FLAG_CHARACTERS = (string.ascii_letters + string.digits + "_-!?@#$%&*+=.,:/'").encode()
+FLAG_TABLE = np.zeros(256, dtype=bool)  # Lookup table to check a whole array of bytes at once
+FLAG_TABLE[list(FLAG_CHARACTERS)] = True
+
+
+def xor(s, key):
+    """XOR every byte of s with a repeating key"""
+    return bytes(c ^ key[i % len(key)] for i, c in enumerate(s))
+
+
+def rot(s, key):
+    """Rotate every byte of s by key, modulo 256"""
+    return bytes((c + key) % 256 for c in s)
+
+
+def has_shorter_period(key):
+    """If a repeating key is also a repetition of a shorter key, which is already tried"""
+    return any(len(key) % n == 0 and key == key[:n] * (len(key) // n) for n in range(1, len(key)))
+
+
+def get_methods(prefix):
+    """Yields `(method, key_length)` pairs that can be recovered from `prefix`"""
+    yield "XOR", 1
+    yield "ROT", 1
+    for length in range(2, min(MAX_KEY_LENGTH + 1, len(prefix))):  # Key needs to repeat at least once in the prefix
+        yield "XOR", length
+
+
+def get_min_body(prefix, length):
+    """Minimum length of the flag inside {}, for when a long key leaves few prefix bytes to confirm it"""
+    return max(0, MIN_CHECKS - (len(prefix) - length)) * BODY_PER_CHECK
+
+
+class BruteForceMatcher:
+    def __init__(self, prefixes):
+        """Find flags encoded with single-byte XOR, single-byte ROT (addition) and repeating-key XOR.
+        Instead of searching for every possible key, differences between bytes that are a key length apart are compared
+        to the same differences in the known prefix, where the key cancels out. This tests all keys at once"""
+        self.prefixes = [p.encode() for p in prefixes]
+        self.signature = f"brute-force {self.prefixes!r} keys={MAX_KEY_LENGTH} verify={VERIFY_LENGTH},{MIN_CHECKS},{BODY_PER_CHECK}"
+        # Bytes needed after a candidate to verify it, chunks overlap by this much
+        self.max_length = max(len(p) for p in self.prefixes) + VERIFY_LENGTH
+
+    def find_candidates(self, view, diff, count, prefix, method, length):
+        """Get offsets in `view` (< count) where `prefix` is encoded with `method` and a key of `length`.
+        `diff[i]` is the difference between `view[i + length]` and `view[i]`"""
+        p = prefix
+        n = len(p)
+
+        # The key cancels out in the difference, so it needs to be the same as in the prefix
+        expected = p[length] ^ p[0] if method == "XOR" else (p[1] - p[0]) % 256
+        idx = np.flatnonzero(diff[:count] == expected)
+        for j in range(length + 1, n):
+            expected = p[j] ^ p[j - length] if method == "XOR" else (p[j] - p[j - 1]) % 256
+            idx = idx[diff[idx + j - length] == expected]
+
+        # The bytes after the prefix decode to flag characters, until the closing }
+        min_body = get_min_body(prefix, length)
+        closed = np.zeros(len(idx), dtype=bool)
+        for t in range(n, n + VERIFY_LENGTH):
+            if len(idx) == 0:
+                break
+
+            k = t % length
+            if method == "XOR":
+                decoded = view[idx + t] ^ view[idx + k] ^ p[k]
+            else:
+                decoded = view[idx + t] - (view[idx] - p[0])
+
+            if t < n + min_body:
+                condition = FLAG_TABLE[decoded]
+            else:
+                condition = closed | FLAG_TABLE[decoded] | (decoded == ord("}"))
+            closed = (closed | (decoded == ord("}")))[condition]
+            idx = idx[condition]
+
+        return idx
+
+    def decode(self, data, offset, prefix, method, length):
+        """Recover the key at `offset` and decode the full flag, returns `None` if it is not a valid flag"""
+        encoded = bytes(data[offset:offset + MAX_FLAG])
+        if method == "XOR":
+            key = xor(encoded[:length], prefix)
+            if not any(key) or not any(encoded[:len(prefix)]) or has_shorter_period(key):  # Plain text or only 0s
+                return None
+            decoded = xor(encoded, key)
+            key_name = f"XOR key 0x{key.hex()}"
+        else:
+            key = (encoded[0] - prefix[0]) % 256
+            if key == 0:
+                return None
+            decoded = rot(encoded, -key)
+            key_name = f"ROT {key}"
+
+        end = decoded.find(b"}")
+        if not decoded.startswith(prefix) or end - len(prefix) < get_min_body(prefix, length) or \
+                not all(c in FLAG_CHARACTERS for c in decoded[len(prefix):end]):
+            return None
+
+        return key_name, decoded[:end + 1]
+
+    def search_block(self, data, path, start, end):
+        view_end = min(len(data), end + self.max_length)
+        view = np.frombuffer(data, dtype=np.uint8, count=view_end - start, offset=start)
+        count = end - start
+        if len(view) < count + self.max_length:  # End of data, pad so all offsets can be compared
+            view = np.concatenate([view, np.zeros(count + self.max_length - len(view), dtype=np.uint8)])
+
+        diffs = {}  # Differences are shared between all prefixes
+        for prefix in self.prefixes:
+            for method, length in get_methods(prefix):
+                if (method, length) not in diffs:
+                    diffs[method, length] = view[length:] ^ view[:-length] if method == "XOR" else view[1:] - view[:-1]
+
+                for i in self.find_candidates(view, diffs[method, length], count, prefix, method, length):
+                    offset = start + int(i)
+                    result = self.decode(data, offset, prefix, method, length)
+                    if result:
+                        key_name, flag = result
+                        yield Match(path, offset, key_name, prefix.decode(), b"", flag, b"")
+
+    def search(self, data, path=None, start=0, end=None):
+        """Find all brute-forced flags in `data` that start between `start` and `end`"""
+        end = len(data) if end is None else end
+        for block_start in range(start, end, BLOCK_SIZE):  # Small blocks stay in the CPU cache for all methods
+            block_end = min(block_start + BLOCK_SIZE, end)
+            yield from sorted(self.search_block(data, path, block_start, block_end), key=lambda m: m.offset)